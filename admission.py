@@ -0,0 +1,200 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from config import (ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT,
+                    ADMISSION_MAX_INFLIGHT_LLM, ADMISSION_RATE_LIMIT_WINDOW, ADMISSION_MAX_RATE_LIMITED)
+
+class Overloaded(Exception):
+    """A discussion was shed; retry_after says when trying again is likely to succeed."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def is_rate_limit(error: BaseException) -> bool:
+    """Whether an LLM client error is an HTTP 429 / quota error (OpenAI or Gemini)."""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    name = type(error).__name__
+    return name in ("RateLimitError", "ResourceExhausted", "TooManyRequests") or "429" in str(error)
+
+class Ticket:
+    """An admitted discussion; release() (or leaving the with block) frees its slot."""
+
+    def __init__(self, controller: "AdmissionController", key: str, waited: float):
+        self.controller = controller
+        self.key = key
+        self.waited = waited
+        self.started = time.time()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+class AdmissionController:
+    """Decides whether a new discussion starts now, waits for a slot or is shed.
+
+    A discussion starts when fewer than max_active are running, none is
+    running on the same key (a topology's agents are shared, so two
+    discussions cannot use them at once) and fewer than max_inflight LLM
+    calls are outstanding. Otherwise up to max_queue discussions wait, in
+    order, for up to queue_timeout seconds. New discussions are shed
+    outright while the queue is full or while more than max_rate_limited
+    of the recent LLM calls were rejected with 429s, since starting them
+    would only fail mid-discussion. track() is the llm_calls middleware
+    that feeds the in-flight and 429 counts. Discussions admitted elsewhere
+    (the async runtime) are reported in stats() through add_load().
+    """
+
+    def __init__(self, max_active: int = ADMISSION_MAX_ACTIVE, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, max_inflight: int = ADMISSION_MAX_INFLIGHT_LLM,
+                 window: float = ADMISSION_RATE_LIMIT_WINDOW, max_rate_limited: float = ADMISSION_MAX_RATE_LIMITED):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_inflight = max_inflight
+        self.window = window
+        self.max_rate_limited = max_rate_limited
+        self.condition = threading.Condition()
+        self.active_keys = {}
+        self.waiting = deque()
+        self.inflight = 0
+        # (time, was_rate_limited) for each LLM call finished within the window
+        self.outcomes = deque()
+        self.shed = 0
+        # Smoothed discussion duration, for Retry-After estimates
+        self.average_duration = 60.0
+        self.loads: Dict[str, Callable[[], dict]] = {}
+
+    def _prune(self, now: float):
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            self.outcomes.popleft()
+
+    def _rate_limit_delay(self, now: float) -> float:
+        """Seconds until the 429 rate drops back under the limit, 0 if it already is."""
+        self._prune(now)
+        if len(self.outcomes) < 5:
+            return 0
+        limited = [t for t, was_limited in self.outcomes if was_limited]
+        if len(limited) <= self.max_rate_limited * len(self.outcomes):
+            return 0
+        # Wait for enough of the rejected calls to leave the window
+        excess = len(limited) - int(self.max_rate_limited * len(self.outcomes))
+        return limited[excess - 1] + self.window - now
+
+    def _can_start(self, key: str) -> bool:
+        return (sum(self.active_keys.values()) < self.max_active and key not in self.active_keys
+                and self.inflight < self.max_inflight)
+
+    def _queue_delay(self, position: int) -> float:
+        return self.average_duration * (position // max(self.max_active, 1) + 1)
+
+    def admit(self, key: str, wait: bool = True, timeout: Optional[float] = None) -> Ticket:
+        """Start a discussion on key, waiting for a slot if allowed; raises Overloaded when shed."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.time()
+        with self.condition:
+            delay = self._rate_limit_delay(started)
+            if delay > 0:
+                self.shed += 1
+                raise Overloaded("The LLM provider is rate limiting requests", delay)
+            if not self.waiting and self._can_start(key):
+                self.active_keys[key] = self.active_keys.get(key, 0) + 1
+                return Ticket(self, key, 0)
+            if not wait or len(self.waiting) >= self.max_queue:
+                self.shed += 1
+                raise Overloaded("Too many discussions are running or waiting", self._queue_delay(len(self.waiting)))
+
+            entry = (key, object())
+            self.waiting.append(entry)
+            try:
+                while True:
+                    # First come, first served among waiters that could start
+                    ahead = [k for k, _ in self.waiting][:self.waiting.index(entry)]
+                    if key not in ahead and self._can_start(key):
+                        break
+                    remaining = started + timeout - time.time()
+                    if remaining <= 0:
+                        self.shed += 1
+                        raise Overloaded("Timed out waiting for a free discussion slot",
+                                         self._queue_delay(len(self.waiting)))
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.remove(entry)
+                self.condition.notify_all()
+            self.active_keys[key] = self.active_keys.get(key, 0) + 1
+            return Ticket(self, key, time.time() - started)
+
+    def _release(self, ticket: Ticket):
+        with self.condition:
+            self.active_keys[ticket.key] -= 1
+            if not self.active_keys[ticket.key]:
+                del self.active_keys[ticket.key]
+            self.average_duration = 0.8 * self.average_duration + 0.2 * (time.time() - ticket.started)
+            self.condition.notify_all()
+
+    def shed_delay(self) -> float:
+        """Seconds a loop should hold off before starting its next discussion."""
+        with self.condition:
+            return self._rate_limit_delay(time.time())
+
+    def track(self, call, proceed):
+        """llm_calls middleware counting in-flight calls and 429 responses."""
+        with self.condition:
+            self.inflight += 1
+        rate_limited = False
+        try:
+            return proceed()
+        except Exception as e:
+            rate_limited = is_rate_limit(e)
+            raise
+        finally:
+            with self.condition:
+                self.inflight -= 1
+                now = time.time()
+                self.outcomes.append((now, rate_limited))
+                self._prune(now)
+                self.condition.notify_all()
+
+    def inflight_available(self) -> bool:
+        """Whether a discussion could start now as far as outstanding LLM calls go."""
+        with self.condition:
+            return self.inflight < self.max_inflight
+
+    def add_load(self, name: str, stats: Callable[[], dict]):
+        """Report the discussions another admitter runs in stats(), under name."""
+        self.loads[name] = stats
+
+    def active(self) -> int:
+        with self.condition:
+            return sum(self.active_keys.values())
+
+    def stats(self) -> dict:
+        with self.condition:
+            now = time.time()
+            self._prune(now)
+            stats = {
+                "active": sum(self.active_keys.values()),
+                "queued": len(self.waiting),
+                "inflight_llm_calls": self.inflight,
+                "recent_llm_calls": len(self.outcomes),
+                "recent_rate_limited": sum(1 for _, limited in self.outcomes if limited),
+                "shed": self.shed,
+                "average_duration": round(self.average_duration, 1)
+            }
+        for name, load in self.loads.items():
+            stats[name] = load()
+        return stats
+
+admission_controller = AdmissionController()
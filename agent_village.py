@@ -1,14 +1,45 @@
 import os
+import gzip
+import asyncio
+import functools
 import json
 import time
 import logging
+import threading
 from datetime import datetime
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, render_template, jsonify, request
 from dotenv import load_dotenv
-import autogen
-import google.generativeai as genai
-from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
 from flask_sock import Sock
+from admission import admission_controller, Overloaded
+from async_runtime import async_runtime, AgentPool, AsyncWriter, checkpoint_writer
+from batch import Batch
+from cassette import Recorder
+import health
+from checkpoint import Checkpoint, find_incomplete, load as load_checkpoint, resume_from as resume_checkpoint
+from job_queue import job_queue
+import profiling
+from log_store import log_store, parse_time
+from llm_calls import add_middleware
+from message_store import message_store, release_chat
+from parallel import run_parallel_round, a_run_parallel_round
+from prefetch import speculate
+from retrieval import build_context
+from scheduler import loop_statuses
+from tools import new_discussion_id
+from tool_pool import tool_pool
+from usage import usage_tracker, BudgetExceeded
+from ws_clients import (WSClient, Subscriptions, PROTOCOL_VERSION, entry_channels, handle_subscription,
+                        missed_entries, parse_channels)
+from topology import topology_store
+from config import LOGS_PAGE_SIZE, LOGS_MAX_PAGE_SIZE, WS_PING_INTERVAL, WEB_TOPOLOGY, CASSETTE_RECORD
+from config import PROFILE_ENABLED, PROFILE_SAMPLE_INTERVAL, PROFILE_MAX_SECONDS
+from config import BATCH_DIR, BATCH_PARALLELISM, LOOP_TOPOLOGY
+from config import ASYNC_DISCUSSIONS, ASYNC_RESULT_TTL, ASYNC_WS_PORT
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +50,8 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+# Ping every client so dead connections are noticed and evicted promptly
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': WS_PING_INTERVAL}
 sock = Sock(app)
 
 # Add Content Security Policy headers
@@ -27,32 +60,34 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' 'unsafe-eval' 'unsafe-inline'; connect-src 'self' ws: wss:; style-src 'self' 'unsafe-inline'; img-src 'self' data:; font-src 'self' data:;"
     return response
 
-# Global variables to store logs and strategy
-chat_logs = []
+# Profile a request when asked to (or every request with PROFILE_ENABLED)
+@app.before_request
+def start_profiling():
+    if PROFILE_ENABLED or request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1':
+        g.trace_id = profiling.begin_request(f"{request.method} {request.path}",
+                                             **{"http.method": request.method, "http.target": request.full_path})
+
+@app.after_request
+def add_trace_header(response):
+    if 'trace_id' in g:
+        response.headers['X-Trace-Id'] = g.trace_id
+    return response
+
+@app.teardown_request
+def finish_profiling(error=None):
+    profiling.end_request(error)
+
+# Global variables to store the strategy; recent logs are kept in message_store
 current_strategy = "Initial strategy: Set clear, measurable goals and create actionable steps to achieve them through effective collaboration and continuous progress tracking."
-connected_clients = set()
-active_discussion = False
+connected_clients = Subscriptions()
 discussion_thread = None
+# Batches started through /batches, by id
+batches = {}
 
-# Configure Google API key
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
-
-# Configure Gemini API
-genai.configure(api_key=api_key)
-
-# Create the model configuration
-model_config = {
-    "config_list": [{
-        "model": "gemini-1.5-pro",
-        "api_key": api_key,
-        "base_url": "https://generativelanguage.googleapis.com/v1beta",
-        "api_type": "google"
-    }],
-    "timeout": 600,
-    "cache_seed": None
-}
+# The LLM stack (autogen, Gemini client, agents, group chat) is built lazily on
+# the first discussion so that importing this module stays cheap; one per topology
+_chat_stacks = {}
+_chat_stack_lock = threading.Lock()
 
 # Create necessary files if they don't exist
 def ensure_files_exist():
@@ -67,97 +102,123 @@ def ensure_files_exist():
                 f.write(initial_content)
             logger.info(f"Created {filename}")
 
-# Ensure files exist before creating agents
-ensure_files_exist()
-
-# Create agents with the model configuration
-researcher = AssistantAgent(
-    name="Researcher",
-    llm_config=model_config,
-    system_message="""You are a research agent. Your role:
-    1. Read goals from goals.txt (read-only)
-    2. Read strategy from current_strategy.txt (read-only)
-    3. Analyze and provide insights
-    4. Be extremely concise - use bullet points and short sentences""",
-    human_input_mode="NEVER"
-)
-
-strategist = AssistantAgent(
-    name="Strategist",
-    llm_config=model_config,
-    system_message="""You are a strategy agent. Your role:
-    1. Read goals from goals.txt (read-only)
-    2. Read/write strategy in current_strategy.txt
-    3. Create actionable steps
-    4. Be extremely concise - use bullet points and short sentences""",
-    human_input_mode="NEVER"
-)
-
-implementer = AssistantAgent(
-    name="Implementer",
-    llm_config=model_config,
-    system_message="""You are an implementation agent. Your role:
-    1. Read goals from goals.txt (read-only)
-    2. Read strategy from current_strategy.txt (read-only)
-    3. Create practical action steps
-    4. Be extremely concise - use bullet points and short sentences""",
-    human_input_mode="NEVER"
-)
-
-user_proxy = UserProxyAgent(
-    name="User_Proxy",
-    human_input_mode="NEVER",
-    code_execution_config={"use_docker": False},
-    llm_config=model_config,
-    system_message="""You are a user interface agent. Your role:
-    1. Read goals from goals.txt (read-only)
-    2. Guide discussions based on goals
-    3. Keep discussions focused
-    4. Be extremely concise - use bullet points and short sentences"""
-)
-
-# Create the group chat with proper configuration
-groupchat = GroupChat(
-    agents=[researcher, strategist, implementer, user_proxy],
-    messages=[],
-    max_round=50,
-    speaker_selection_method="round_robin"
-)
-
-chat_manager = GroupChatManager(
-    groupchat=groupchat,
-    llm_config=model_config
-)
-logger.info("Successfully created all agents and group chat")
+def _create_chat_stack(topology):
+    """Create the topology's agents."""
+    # Ensure files exist before creating agents
+    ensure_files_exist()
+
+    # Agents are instrumented and get a bounded history window as they are built
+    agents = topology.build_agents()
+    add_middleware(usage_tracker.account)
+    add_middleware(admission_controller.track)
+    add_middleware(profiling.llm_call_span)
+    add_middleware(cancel_stopped)
+    logger.info(f"Successfully created the {topology.name} agents")
+
+    return {"topology": topology, "agents": agents}
+
+# Async discussions each need agents of their own; finished sets are reused
+agent_pool = AgentPool(lambda topology: _create_chat_stack(topology)["agents"])
+# Background async discussions, by id: their future and when it finished.
+# Running ones are bounded by admission; finished ones are dropped
+# ASYNC_RESULT_TTL seconds after they finish
+async_discussions = {}
+async_discussions_lock = threading.Lock()
+
+def track_async_discussion(discussion_id, future):
+    """Keep a background discussion for /discussions/<id>, evicting expired results."""
+    entry = {"future": future, "finished": None}
+    future.add_done_callback(lambda _: entry.__setitem__("finished", time.time()))
+    cutoff = time.time() - ASYNC_RESULT_TTL
+    with async_discussions_lock:
+        for expired in [d for d, e in async_discussions.items() if e["finished"] and e["finished"] < cutoff]:
+            del async_discussions[expired]
+        async_discussions[discussion_id] = entry
+
+class DiscussionCancelled(Exception):
+    """Raised from the LLM calls of a discussion stopped through /stop_discussion."""
+
+# Running discussions: id -> cancel event, and each agent's discussion id.
+# /stop_discussion sets the event and the discussion ends at its next LLM call
+_cancel_events = {}
+_cancel_agents = {}
+_cancel_lock = threading.Lock()
+
+def register_cancel(discussion_id, agents):
+    """Make a discussion stoppable and return its cancel event."""
+    cancel = threading.Event()
+    with _cancel_lock:
+        _cancel_events[discussion_id] = cancel
+        for agent in agents:
+            _cancel_agents[agent] = discussion_id
+    return cancel
+
+def unregister_cancel(discussion_id, agents):
+    with _cancel_lock:
+        _cancel_events.pop(discussion_id, None)
+        for agent in agents:
+            if _cancel_agents.get(agent) == discussion_id:
+                del _cancel_agents[agent]
+
+def cancel_stopped(call, proceed):
+    """llm_calls middleware ending a stopped discussion before its next LLM call."""
+    with _cancel_lock:
+        discussion_id = _cancel_agents.get(call.agent)
+        cancel = _cancel_events.get(discussion_id)
+    if cancel is not None and cancel.is_set():
+        raise DiscussionCancelled(f"Discussion {discussion_id} stopped by user request")
+    return proceed()
+
+def get_chat_stack(topology_name=WEB_TOPOLOGY):
+    """Return a topology's agents, creating them on first use and again
+    after the topology's definition changes."""
+    topology = topology_store.get(topology_name)
+    stack = _chat_stacks.get(topology_name)
+    if stack is None or stack["topology"] is not topology:
+        with _chat_stack_lock:
+            stack = _chat_stacks.get(topology_name)
+            if stack is None or stack["topology"] is not topology:
+                stack = _chat_stacks[topology_name] = _create_chat_stack(topology)
+    return stack
 
 # Function to log messages with timestamp
-def log_message(sender, message):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"{timestamp} - {sender}: {message}"
-    
-    # Add to in-memory logs
-    chat_logs.append(log_entry)
+@profiling.traced("log_message")
+def log_message(sender, message, discussion=None):
+    return log_messages([(sender, message, discussion)])[0]
+
+def log_messages(entries):
+    """Log (sender, message, discussion) entries with one write to agent_logs.txt."""
+    # The bounded in-memory store is filled under the log store's lock, in seq order
+    records = [log_store.append(sender, message, discussion, on_append=message_store.append)
+               for sender, message, discussion in entries]
+    log_entries = [f"{record['ts']} - {record['sender']}: {record['message']}" for record in records]
     
     # Save to file
     with open("agent_logs.txt", "a") as f:
-        f.write(log_entry + "\n")
+        f.write("".join(log_entry + "\n" for log_entry in log_entries))
     
-    # Broadcast to all connected WebSocket clients
-    broadcast_log(log_entry)
+    # Broadcast to the WebSocket clients watching this sender or discussion
+    for log_entry, record in zip(log_entries, records):
+        broadcast_log(log_entry, record["seq"], record["sender"], record["discussion"])
     
-    return log_entry
+    return log_entries
+
+# Log entries of async discussions, written off the event loop in batches
+log_writer = AsyncWriter(log_messages)
 
 # Function to broadcast log to all connected clients
-def broadcast_log(log_entry):
-    """Broadcast a log message to all connected clients"""
+@profiling.traced("broadcast_log")
+def broadcast_log(log_entry, seq=None, sender=None, discussion=None):
+    """Broadcast a log message to the clients subscribed to one of its channels"""
     logger.info(f"Broadcasting log: {log_entry}")
-    message = json.dumps({"log": log_entry})
-    for client in connected_clients:
-        try:
-            client.send(message)
-        except Exception as e:
-            logger.error(f"Error sending to client: {e}")
-            connected_clients.remove(client)
+    entry = {"seq": seq, "log": log_entry, "sender": sender, "discussion": discussion}
+    channels = entry_channels(sender, discussion)
+    for client in connected_clients.recipients(channels):
+        if client.closed:
+            connected_clients.discard(client)
+        else:
+            client.enqueue(entry)
+    async_runtime.publish(entry, channels)
 
 # Function to update strategy file
 def update_strategy_file(new_strategy):
@@ -176,69 +237,87 @@ def update_strategy_file(new_strategy):
 # WebSocket route
 @sock.route('/ws')
 def ws(ws):
+    """Stream log entries.
+
+    Protocol v1 (no "v" parameter) replays agent_logs.txt unless replay=0,
+    then sends one {"log": ...} frame per entry. Protocol v2 (v=2) starts
+    with a hello frame carrying the latest sequence number and sends
+    batched frames. A client reconnecting with cursor=<last seq seen> first
+    gets every entry it missed, or a reset frame if it missed more than
+    WS_RESUME_MAX and should reload through /logs.
+
+    channels=<comma-separated> limits the stream to "system",
+    "agent:<name>" or "discussion:<id>" entries (default "all"). v2 clients
+    can change them later by sending {"type": "subscribe"|"unsubscribe"|"set",
+    "channels": [...]}.
+    """
     logger.info("WebSocket connection request received")
-    connected_clients.add(ws)
-    logger.info(f"New WebSocket client connected. Total clients: {len(connected_clients)}")
+    version = request.args.get('v', 1, type=int)
+    try:
+        channels = parse_channels(request.args.get('channels'))
+    except ValueError as e:
+        ws.send(json.dumps({"type": "error", "message": str(e)}))
+        return
+    client = WSClient(ws, version, channels)
+    connected_clients.add(client)
+    logger.info(f"New WebSocket client connected (protocol v{version}). Total clients: {len(connected_clients)}")
     
     try:
-        # Send initial logs
-        with open("agent_logs.txt", "r") as f:
-            logs = f.read()
-            if logs:
-                logger.info(f"Sending initial logs to client: {len(logs)} characters")
-                # Send each log entry separately
-                for log_line in logs.split('\n'):
-                    if log_line.strip():
-                        ws.send(json.dumps({"log": log_line}))
+        with profiling.span("ws.replay"):
+            replay = []
+            if version >= PROTOCOL_VERSION:
+                cursor = request.args.get('cursor', type=int)
+                latest = log_store.latest_seq()
+                client.send_control({"type": "hello", "v": PROTOCOL_VERSION, "latest": latest,
+                                     "channels": sorted(channels)})
+                if cursor is not None and cursor < latest:
+                    replay = missed_entries(cursor, latest, channels)
+                    if replay is None:
+                        client.send_control({"type": "reset", "latest": latest})
+                        replay = []
             else:
-                logger.info("No initial logs to send")
-        
-        # Send a test message
-        test_message = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - System: WebSocket connection established"
-        ws.send(json.dumps({"log": test_message}))
-        logger.info(f"Sent test message: {test_message}")
+                # Send initial logs, unless the client pages through /logs itself
+                if request.args.get('replay') != '0':
+                    with open("agent_logs.txt", "r") as f:
+                        replay = [{"log": line} for line in f.read().split('\n') if line.strip()]
+                test_message = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - System: WebSocket connection established"
+                replay.append({"log": test_message})
+            client.release(replay)
         
-        # Keep the connection open
-        while True:
-            # Wait for messages (we don't expect any from the client)
-            data = ws.receive()
+        # Keep the connection open; with SOCK_SERVER_OPTIONS ping_interval set,
+        # a client that stops answering pings makes receive() raise
+        while not client.closed:
+            data = ws.receive(timeout=WS_PING_INTERVAL)
             if data:
                 logger.info(f"Received WebSocket message from client: {data}")
+                with profiling.span("ws.message"):
+                    handle_subscription(connected_clients, client, data)
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
+        logger.info(f"WebSocket closed: {e}")
     finally:
-        connected_clients.remove(ws)
+        client.close()
+        connected_clients.discard(client)
         logger.info(f"WebSocket client disconnected. Remaining clients: {len(connected_clients)}")
 
-# Function to start a discussion
-def start_discussion(topic):
-    """Start a discussion with the agents"""
-    global active_discussion
-    
-    if active_discussion:
-        return {"status": "error", "message": "A discussion is already in progress. Please stop it first."}
+def discussion_message(topic, discussion_id):
+    """The opening message of a discussion: the topic, goals, strategy and related earlier analysis."""
+    # Read goals and strategy files
+    try:
+        with open("goals.txt", "r") as f:
+            goals = f.read()
+    except FileNotFoundError:
+        goals = "No goals file found."
+        log_message("System", "Warning - goals.txt not found", discussion_id)
     
     try:
-        active_discussion = True
-        broadcast_log(f"System: Starting discussion on topic: {topic}")
-        
-        # Read goals and strategy files
-        try:
-            with open("goals.txt", "r") as f:
-                goals = f.read()
-        except FileNotFoundError:
-            goals = "No goals file found."
-            broadcast_log("System: Warning - goals.txt not found")
-        
-        try:
-            with open("current_strategy.txt", "r") as f:
-                current_strategy = f.read()
-        except FileNotFoundError:
-            current_strategy = "No strategy file found."
-            broadcast_log("System: Warning - current_strategy.txt not found")
-        
-        # Create the message for the agents
-        message = f"""
+        with open("current_strategy.txt", "r") as f:
+            current_strategy = f.read()
+    except FileNotFoundError:
+        current_strategy = "No strategy file found."
+        log_message("System", "Warning - current_strategy.txt not found", discussion_id)
+    
+    # Create the message for the agents
+    message = f"""
         Let's discuss the following topic: {topic}
         
         Current goals (from goals.txt):
@@ -247,6 +326,7 @@ def start_discussion(topic):
         Current strategy (from current_strategy.txt):
         {current_strategy}
         
+        {build_context(topic)}
         Please provide your thoughts and suggestions. Remember:
         1. Goals are read-only from goals.txt
         2. Strategy can be read/written in current_strategy.txt
@@ -255,64 +335,304 @@ def start_discussion(topic):
         5. Keep responses brief and to the point
         6. DO NOT ask for the contents of goals.txt or current_strategy.txt - they are provided above
         """
+    return message
+
+# Function to start a discussion
+@profiling.traced("start_discussion")
+def start_discussion(topic, mode="groupchat", topology_name=WEB_TOPOLOGY, cassette=None, wait=True):
+    """Start a discussion with the agents of a topology from topologies.json.
+
+    mode is "groupchat" (turns in the topology's speaker order) or
+    "parallel" (the topology's parallel agents answer concurrently, then
+    its synthesizer merges their answers). cassette records the LLM calls
+    (a Recorder) or answers them from a recording (a Replayer).
+
+    The admission controller may make the call wait for a free slot (unless
+    wait is False) or raise Overloaded when the discussion is shed.
+    """
+    ticket = admission_controller.admit(topology_name, wait=wait)
+    try:
+        discussion_id = new_discussion_id()
+        log_message("System", f"Starting discussion on topic: {topic}", discussion_id)
+        
+        message = discussion_message(topic, discussion_id)
         
         # Start the discussion
-        try:
-            # Initialize the chat with the message
-            response = chat_manager.initiate_chat(
-                user_proxy,
-                message=message
-            )
-            
-            # Process the response
-            if response is not None:
-                if hasattr(response, 'summary'):
-                    broadcast_log(f"System: Discussion completed with summary: {response.summary}")
-                else:
-                    broadcast_log("System: Discussion completed")
-                
-                # Log any messages from the chat
-                if hasattr(groupchat, 'messages') and groupchat.messages:
-                    for msg in groupchat.messages:
-                        if isinstance(msg, dict) and 'content' in msg and 'name' in msg:
-                            broadcast_log(f"{msg['name']}: {msg['content']}")
-            else:
-                broadcast_log("System: No response from chat manager")
-            
-            active_discussion = False
-            return {"status": "success", "message": "Discussion completed successfully"}
-            
-        except Exception as chat_error:
-            logger.error(f"Error in chat: {str(chat_error)}")
-            broadcast_log(f"System: Error in chat: {str(chat_error)}")
-            active_discussion = False
-            return {"status": "error", "message": f"Error in chat: {str(chat_error)}"}
+        checkpoint = Checkpoint(discussion_id)
+        checkpoint.start(source="agent_village", topic=topic, mode=mode, message=message,
+                         topology=topology_name)
+        if cassette is None and CASSETTE_RECORD:
+            cassette = Recorder()
+        return run_discussion(checkpoint, topic, message, mode, topology_name, cassette=cassette)
             
     except Exception as e:
         logger.error(f"Error starting discussion: {str(e)}")
-        broadcast_log(f"System: Error starting discussion: {str(e)}")
-        active_discussion = False
+        log_message("System", f"Error starting discussion: {str(e)}")
         return {"status": "error", "message": f"Error starting discussion: {str(e)}"}
+    finally:
+        ticket.release()
 
-# Function to stop a discussion
-def stop_discussion():
-    global active_discussion
-    
-    if not active_discussion:
-        log_message("System", "No active discussion to stop")
-        return "No active discussion to stop"
-    
+@profiling.traced("run_discussion")
+def run_discussion(checkpoint, topic, message, mode, topology_name=WEB_TOPOLOGY, resume_messages=None,
+                   cassette=None):
+    """Run a discussion, checkpointing every completed turn.
+
+    With resume_messages the discussion continues after the saved turns
+    instead of starting over.
+    """
+    discussion_id = checkpoint.discussion_id
+    agents = {}
+    groupchat = chat_manager = None
+    cancel = None
     try:
-        active_discussion = False
-        log_message("System", "Discussion stopped by user request")
-        return "Discussion stopped successfully"
+        stack = get_chat_stack(topology_name)
+        topology = stack["topology"]
+        agents = stack["agents"]
+        cancel = register_cancel(discussion_id, agents.values())
+        usage_tracker.begin_discussion(discussion_id, topic, agents.values())
+        if cassette is not None:
+            cassette.start(agents.values(), pipeline="agent_village", topic=topic, mode=mode,
+                           topology=topology_name, discussion=discussion_id)
+
+        if mode == "parallel":
+            def on_reply(name, reply):
+                checkpoint.record_reply(name, reply)
+                log_message(name, reply, discussion_id)
+
+            replies, synthesis = run_parallel_round(
+                [agents[name] for name in topology.parallel_agents],
+                message,
+                synthesizer=agents[topology.synthesizer],
+                on_reply=on_reply,
+                done={m["name"]: m["content"] for m in resume_messages or []}
+            )
+            log_message(f"{topology.synthesizer} (synthesis)", synthesis, discussion_id)
+            log_message("System", "Discussion completed", discussion_id)
+            checkpoint.finish()
+            return {"status": "success", "message": "Discussion completed successfully"}
+
+        checkpoint.attach(agents.values())
+        if resume_messages:
+            # Replay the saved turns into the agents without calling the LLM,
+            # then run only the rounds that are left
+            max_round = max(topology.max_round - len(resume_messages) + 1, 1)
+            groupchat, chat_manager = topology.build_groupchat(agents, max_round)
+            last_agent, last_message = chat_manager.resume(messages=resume_messages)
+            with speculate(groupchat, chat_manager):
+                response = last_agent.initiate_chat(
+                    recipient=chat_manager,
+                    message=last_message,
+                    clear_history=False
+                )
+        else:
+            # Initialize the chat with the message from the topology's initiator
+            groupchat, chat_manager = topology.build_groupchat(agents, cassette=cassette)
+            with speculate(groupchat, chat_manager):
+                response = agents[topology.initiator].initiate_chat(
+                    chat_manager,
+                    message=message
+                )
+        
+        log_chat_result(response, groupchat, discussion_id)
+        checkpoint.finish()
+        return {"status": "success", "message": "Discussion completed successfully"}
+        
+    except BudgetExceeded as budget_error:
+        logger.warning(f"Discussion stopped: {budget_error}")
+        log_message("System", f"Discussion stopped: {budget_error}", discussion_id)
+        checkpoint.finish("budget_exceeded")
+        return {"status": "error", "message": f"Discussion stopped: {budget_error}"}
+    except Exception as chat_error:
+        # Parallel rounds swallow per-agent errors, so check the event itself
+        if cancel is not None and cancel.is_set():
+            log_message("System", "Discussion stopped by user request", discussion_id)
+            checkpoint.finish("cancelled")
+            return {"status": "cancelled", "message": "Discussion stopped by user request"}
+        # The checkpoint stays open so the discussion can be resumed
+        logger.error(f"Error in chat: {str(chat_error)}")
+        log_message("System", f"Error in chat: {str(chat_error)}", discussion_id)
+        return {"status": "error", "message": f"Error in chat: {str(chat_error)}"}
+    finally:
+        unregister_cancel(discussion_id, agents.values())
+        usage_tracker.end_discussion(discussion_id)
+        checkpoint.detach(agents.values())
+        if cassette is not None:
+            cassette.close()
+        if groupchat is not None:
+            release_chat(groupchat, chat_manager)
+
+def log_chat_result(response, groupchat, discussion_id, log=log_message):
+    """Log how a group chat ended and the messages it exchanged."""
+    if response is not None:
+        if hasattr(response, 'summary'):
+            log("System", f"Discussion completed with summary: {response.summary}", discussion_id)
+        else:
+            log("System", "Discussion completed", discussion_id)
+        
+        # Log any messages from the chat
+        if hasattr(groupchat, 'messages') and groupchat.messages:
+            for msg in groupchat.messages:
+                if isinstance(msg, dict) and 'content' in msg and 'name' in msg:
+                    log(msg['name'], msg['content'], discussion_id)
+    else:
+        log("System", "No response from chat manager", discussion_id)
+
+async def a_start_discussion(discussion_id, topic, mode="groupchat", topology_name=WEB_TOPOLOGY):
+    """start_discussion on the async runtime, as a coroutine on its event loop.
+
+    Call async_runtime.admit() before submitting it; it waits here for one
+    of the runtime's discussion slots. Cassettes are not supported.
+    """
+    loop = asyncio.get_running_loop()
+    async with async_runtime.slot():
+        try:
+            log_writer.write(("System", f"Starting discussion on topic: {topic}", discussion_id))
+            message = await loop.run_in_executor(None, discussion_message, topic, discussion_id)
+            checkpoint = Checkpoint(discussion_id)
+            await loop.run_in_executor(None, functools.partial(
+                checkpoint.start, source="agent_village", topic=topic, mode=mode, message=message,
+                topology=topology_name))
+            checkpoint.defer = checkpoint_writer.write
+            return await a_run_discussion(checkpoint, topic, message, mode, topology_name)
+        except Exception as e:
+            logger.error(f"Error starting discussion: {str(e)}")
+            log_writer.write(("System", f"Error starting discussion: {str(e)}", None))
+            return {"status": "error", "message": f"Error starting discussion: {str(e)}"}
+        finally:
+            await log_writer.flush()
+
+async def a_run_discussion(checkpoint, topic, message, mode, topology_name=WEB_TOPOLOGY):
+    """run_discussion on the async runtime: rounds and replies are awaited, and the
+    turns and log entries are written off the event loop."""
+    discussion_id = checkpoint.discussion_id
+    loop = asyncio.get_running_loop()
+
+    def log(sender, text, discussion):
+        log_writer.write((sender, text, discussion))
+
+    topology, agents = await agent_pool.acquire(topology_name)
+    groupchat = chat_manager = None
+    status = None
+    cancel = register_cancel(discussion_id, agents.values())
+    try:
+        usage_tracker.begin_discussion(discussion_id, topic, agents.values())
+
+        if mode == "parallel":
+            def on_reply(name, reply):
+                checkpoint.record_reply(name, reply)
+                log(name, reply, discussion_id)
+
+            replies, synthesis = await a_run_parallel_round(
+                [agents[name] for name in topology.parallel_agents],
+                message,
+                synthesizer=agents[topology.synthesizer],
+                on_reply=on_reply
+            )
+            log(f"{topology.synthesizer} (synthesis)", synthesis, discussion_id)
+            log("System", "Discussion completed", discussion_id)
+        else:
+            checkpoint.attach(agents.values())
+            groupchat, chat_manager = topology.build_groupchat(agents)
+            response = await agents[topology.initiator].a_initiate_chat(chat_manager, message=message)
+            log_chat_result(response, groupchat, discussion_id, log)
+
+        status = "completed"
+        return {"status": "success", "message": "Discussion completed successfully"}
+
+    except BudgetExceeded as budget_error:
+        logger.warning(f"Discussion stopped: {budget_error}")
+        log("System", f"Discussion stopped: {budget_error}", discussion_id)
+        status = "budget_exceeded"
+        return {"status": "error", "message": f"Discussion stopped: {budget_error}"}
+    except Exception as chat_error:
+        if cancel.is_set():
+            log("System", "Discussion stopped by user request", discussion_id)
+            status = "cancelled"
+            return {"status": "cancelled", "message": "Discussion stopped by user request"}
+        # The checkpoint stays open so the discussion can be resumed
+        logger.error(f"Error in chat: {str(chat_error)}")
+        log("System", f"Error in chat: {str(chat_error)}", discussion_id)
+        return {"status": "error", "message": f"Error in chat: {str(chat_error)}"}
+    finally:
+        unregister_cancel(discussion_id, agents.values())
+        usage_tracker.end_discussion(discussion_id)
+        checkpoint.detach(agents.values())
+        if groupchat is not None:
+            release_chat(groupchat, chat_manager)
+        agent_pool.release(topology, agents)
+        # The end record goes after every turn
+        await checkpoint_writer.flush()
+        if status is not None:
+            await loop.run_in_executor(None, checkpoint.finish, status)
+
+# Function to resume a discussion from its checkpoint
+def resume_discussion(discussion_id=None, wait=True):
+    """Resume an unfinished discussion, by default the most recent one.
+
+    Raises LookupError when there is nothing to resume and ValueError when
+    the discussion already finished. Resumed discussions go through
+    admission control like new ones.
+    """
+    if discussion_id is None:
+        incomplete = find_incomplete(source="agent_village")
+        if not incomplete:
+            raise LookupError("No unfinished discussion to resume")
+        discussion_id = incomplete[-1]["discussion"]
+
+    try:
+        metadata, turns, end = load_checkpoint(discussion_id)
+    except FileNotFoundError:
+        raise LookupError(f"No checkpoint for discussion {discussion_id}")
+    if end is not None:
+        raise ValueError(f"Discussion {discussion_id} already finished")
+
+    ticket = admission_controller.admit(metadata.get("topology", WEB_TOPOLOGY), wait=wait)
+    try:
+        log_message("System", f"Resuming discussion {discussion_id} after {len(turns)} saved turns", discussion_id)
+        checkpoint = resume_checkpoint(discussion_id)
+        return run_discussion(checkpoint, metadata["topic"], metadata["message"],
+                              metadata.get("mode", "groupchat"), metadata.get("topology", WEB_TOPOLOGY),
+                              resume_messages=turns or None)
     except Exception as e:
-        error_msg = f"Error stopping discussion: {str(e)}"
-        logger.error(error_msg)
-        log_message("System", error_msg)
-        return error_msg
+        logger.error(f"Error resuming discussion: {str(e)}")
+        log_message("System", f"Error resuming discussion: {str(e)}")
+        return {"status": "error", "message": f"Error resuming discussion: {str(e)}"}
+    finally:
+        ticket.release()
+
+# Function to stop a discussion
+def stop_discussion(discussion_id=None):
+    """Cancel a running discussion, by default every running one.
+
+    Returns the ids that were cancelled. Each ends at its next LLM call,
+    releasing its admission ticket; a turn already in progress finishes first.
+    """
+    with _cancel_lock:
+        if discussion_id is None:
+            stopping = [d for d, cancel in _cancel_events.items() if not cancel.is_set()]
+        elif discussion_id in _cancel_events and not _cancel_events[discussion_id].is_set():
+            stopping = [discussion_id]
+        else:
+            stopping = []
+        for stopped in stopping:
+            _cancel_events[stopped].set()
+    for stopped in stopping:
+        log_message("System", "Stopping discussion by user request", stopped)
+    return stopping
 
 # Flask routes
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    """Shed discussions get 503 with a hint of when to retry."""
+    response = jsonify({"status": "error", "message": str(error), "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def discussion_response(result):
+    """200 for a discussion that completed or was stopped, 500 for one that failed."""
+    return jsonify(result), 200 if result["status"] in ("success", "cancelled") else 500
+
 @app.route('/')
 def index():
     return render_template('monitor.html')
@@ -336,6 +656,46 @@ def get_logs():
         logger.error(f"Error reading logs: {e}")
         return "Error reading logs"
 
+def compress_response(response):
+    """Compress a response with brotli or gzip, whichever the client accepts."""
+    accepted = request.headers.get('Accept-Encoding', '').lower()
+    data = response.get_data()
+    response.headers['Vary'] = 'Accept-Encoding'
+    if len(data) < 1024:
+        return response
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.route('/logs')
+def query_logs():
+    """Page through the log, newest first unless after= is given.
+
+    Query parameters: before/after (cursor from next_cursor), limit, agent
+    (repeatable or comma-separated), discussion, since/until (epoch seconds
+    or ISO time) and q (case-insensitive text).
+    """
+    args = request.args
+    try:
+        senders = [name for value in args.getlist('agent') for name in value.split(',') if name]
+        page = log_store.query(
+            before=args.get('before', type=int),
+            after=args.get('after', type=int),
+            limit=max(1, min(args.get('limit', LOGS_PAGE_SIZE, type=int), LOGS_MAX_PAGE_SIZE)),
+            senders=senders or None,
+            discussion=args.get('discussion') or None,
+            since=parse_time(args.get('since')),
+            until=parse_time(args.get('until')),
+            text=args.get('q') or None
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return compress_response(jsonify(page))
+
 @app.route('/get_strategy')
 def get_strategy():
     try:
@@ -350,20 +710,226 @@ def get_strategy():
 def api_start_discussion():
     data = request.json
     topic = data.get('topic', 'How can I achieve my goals with cunning and keeping costs low?')
-    result = start_discussion(topic)
-    return jsonify({"status": "success", "message": result})
+    mode = data.get('mode', 'groupchat')
+    # "record": true saves the discussion's LLM calls to a cassette for offline replay
+    cassette = Recorder() if data.get('record') else None
+    # "wait": false sheds the discussion instead of queueing it when no slot is free
+    wait = data.get('wait', True)
+    topology_name = data.get('topology', WEB_TOPOLOGY)
+    # Reject a bad request before it takes an admission slot
+    try:
+        topology = topology_store.get(topology_name)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if mode not in ("groupchat", "parallel"):
+        return jsonify({"status": "error", "message": f"Unknown mode: {mode}"}), 400
+    if mode == "parallel" and not topology.parallel_agents:
+        return jsonify({"status": "error", "message": f"Topology {topology_name} has no parallel agents"}), 400
+    # "async": true runs it on the async runtime (the default with ASYNC_DISCUSSIONS=1)
+    if data.get('async', ASYNC_DISCUSSIONS) and cassette is None:
+        ticket = async_runtime.admit(wait)
+        discussion_id = new_discussion_id()
+        future = async_runtime.submit(a_start_discussion(discussion_id, topic, mode, topology_name), ticket)
+        # "background": true answers at once; poll /discussions/<id> for the result
+        if data.get('background'):
+            track_async_discussion(discussion_id, future)
+            return jsonify({"status": "accepted", "discussion_id": discussion_id}), 202, \
+                {"Location": f"/discussions/{discussion_id}"}
+        return discussion_response(future.result())
+    result = start_discussion(topic, mode, topology_name, cassette, wait)
+    return discussion_response(result)
+
+@app.route('/discussions/<discussion_id>')
+def get_async_discussion(discussion_id):
+    """Whether a background async discussion is still running, and its result once it is not.
+
+    Results are kept for ASYNC_RESULT_TTL seconds after the discussion
+    finishes; after that, and across restarts, this is 404.
+    """
+    with async_discussions_lock:
+        entry = async_discussions.get(discussion_id)
+        if entry is not None and entry["finished"] and entry["finished"] < time.time() - ASYNC_RESULT_TTL:
+            del async_discussions[discussion_id]
+            entry = None
+    if entry is None:
+        return jsonify({"status": "error", "message": f"No async discussion {discussion_id}"}), 404
+    if not entry["future"].done():
+        return jsonify({"status": "running", "discussion_id": discussion_id})
+    return discussion_response(entry["future"].result())
+
+@app.route('/topologies')
+def get_topologies():
+    """Topologies available to /start_discussion, from topologies.json."""
+    try:
+        topologies = [topology_store.get(name) for name in topology_store.names()]
+    except Exception as e:
+        logger.error(f"Error reading topologies: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({
+        "default": WEB_TOPOLOGY,
+        "topologies": [{
+            "name": t.name,
+            "description": t.description,
+            "agents": [agent.name for agent in t.agents],
+            "speaker_selection": t.speaker_selection,
+            "max_round": t.max_round
+        } for t in topologies]
+    })
+
+@app.route('/resume_discussion', methods=['POST'])
+def api_resume_discussion():
+    data = request.get_json(silent=True) or {}
+    try:
+        result = resume_discussion(data.get('discussion_id'), data.get('wait', True))
+    except LookupError as e:
+        return jsonify({"status": "error", "message": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return discussion_response(result)
+
+@app.route('/admission')
+def get_admission():
+    """Running and queued discussions, in-flight LLM calls and recent 429s."""
+    return jsonify(admission_controller.stats())
+
+@app.route('/checkpoints')
+def get_checkpoints():
+    """Unfinished discussions that can be resumed."""
+    return jsonify({"incomplete": find_incomplete(source="agent_village")})
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs():
+    """List queued, running and finished jobs, or queue a discussion for the workers."""
+    if request.method == 'GET':
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        return jsonify({
+            "counts": job_queue.counts(),
+            "jobs": job_queue.list(request.args.get('status'), limit)
+        })
+    data = request.get_json(silent=True) or {}
+    topic = data.get('topic')
+    if not topic:
+        return jsonify({"status": "error", "message": "topic is required"}), 400
+    try:
+        priority = int(data.get('priority', 0))
+        run_at = time.time() + float(data.get('delay', 0))
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        job = job_queue.enqueue(topic, mode=data.get('mode', 'groupchat'), priority=priority, run_at=run_at)
+    except Exception as e:
+        logger.error(f"Error queueing job: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "job": job}), 200 if job["duplicate"] else 201
+
+@app.route('/jobs/<int:job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "No such job"}), 404
+    return jsonify(job)
+
+@app.route('/schedules', methods=['GET', 'POST'])
+def schedules():
+    """List recurring discussions, or add one with a cron expression ("0 9 * * 1-5")."""
+    if request.method == 'GET':
+        return jsonify({"schedules": job_queue.list_schedules()})
+    data = request.get_json(silent=True) or {}
+    if not data.get('topic') or not data.get('cron'):
+        return jsonify({"status": "error", "message": "topic and cron are required"}), 400
+    try:
+        schedule = job_queue.add_schedule(
+            data['topic'], data['cron'],
+            mode=data.get('mode', 'groupchat'),
+            priority=int(data.get('priority', 0))
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "schedule": schedule}), 201
+
+@app.route('/schedules/<int:schedule_id>', methods=['DELETE'])
+def delete_schedule(schedule_id):
+    job_queue.remove_schedule(schedule_id)
+    return jsonify({"status": "success"})
+
+def run_batch(batch):
+    try:
+        batch.run()
+    except Exception as e:
+        logger.error(f"Batch {batch.id} failed: {e}")
+
+@app.route('/batches', methods=['GET', 'POST'])
+def batches_route():
+    """Start a batch of goals ({"goals": [...], "topology", "mode", "parallelism"}) or list batches.
+
+    A batch runs in the background; poll /batches/<id> for its progress
+    and results.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            topology_name = data.get('topology', LOOP_TOPOLOGY)
+            topology_store.get(topology_name)
+            batch = Batch(list(data.get('goals') or []), topology_name, data.get('mode'),
+                          int(data.get('parallelism', BATCH_PARALLELISM)))
+        except (ValueError, TypeError) as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        # Its goals would only be shed: answer 503 with Retry-After instead
+        delay = admission_controller.shed_delay()
+        if delay > 0:
+            raise Overloaded("The LLM provider is rate limiting requests", delay)
+        stats = admission_controller.stats()
+        if stats["queued"] >= admission_controller.max_queue:
+            raise Overloaded("Too many discussions are running or waiting", stats["average_duration"])
+        batches[batch.id] = batch
+        threading.Thread(target=run_batch, args=(batch,), name=f"batch-{batch.id}", daemon=True).start()
+        response = jsonify({"batch": batch.id, "status": batch.status, "goals": len(batch.goals)})
+        response.status_code = 202
+        response.headers['Location'] = f"/batches/{batch.id}"
+        return response
+    return jsonify({"batches": [{
+        "batch": batch.id,
+        "status": batch.status,
+        "topology": batch.topology,
+        "goals": len(batch.goals),
+        "completed": sum(1 for r in batch.results if r is not None)
+    } for batch in batches.values()]})
+
+@app.route('/batches/<batch_id>')
+def get_batch(batch_id):
+    """A batch's progress and per-goal results; transcripts=1 includes the transcripts."""
+    include_transcripts = request.args.get('transcripts') == '1'
+    if batch_id in batches:
+        return jsonify(batches[batch_id].report(include_transcripts))
+    path = os.path.join(BATCH_DIR, f"{os.path.basename(batch_id)}.json")
+    if not os.path.exists(path):
+        return jsonify({"status": "error", "message": "Batch not found"}), 404
+    with open(path, "r") as f:
+        report = json.load(f)
+    if not include_transcripts:
+        for result in report["results"]:
+            result.pop("transcript", None)
+    return jsonify(report)
 
 @app.route('/stop_discussion', methods=['POST'])
 def api_stop_discussion():
-    result = stop_discussion()
-    return jsonify({"status": "success", "message": result})
+    discussion_id = (request.get_json(silent=True) or {}).get('discussion_id')
+    stopped = stop_discussion(discussion_id)
+    if not stopped:
+        message = f"Discussion {discussion_id} is not running" if discussion_id else "No active discussion to stop"
+        return jsonify({"status": "error", "message": message}), 409
+    return jsonify({"status": "success", "discussions": stopped,
+                    "message": f"Stopping {len(stopped)} discussion(s) at their next LLM call"})
 
 @app.route('/clear_logs', methods=['POST'])
 def clear_logs():
-    global chat_logs
-    chat_logs = []
+    message_store.clear()
     with open("agent_logs.txt", "w") as f:
         f.write("")
+    log_store.clear()
     log_message("System", "Logs cleared")
     return jsonify({"status": "success"})
 
@@ -392,10 +958,87 @@ def save_goals():
         logger.error(f"Error saving goals: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/usage')
+def get_usage():
+    """Token and cost totals per day, goal and discussion."""
+    try:
+        return jsonify(usage_tracker.summary(request.args.get('discussion')))
+    except Exception as e:
+        logger.error(f"Error reading usage: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/test')
 def test():
     return jsonify({"status": "success", "message": "Server is running"})
 
+@app.route('/health')
+def get_health():
+    """Liveness: the process answers requests."""
+    return jsonify(health.liveness())
+
+@app.route('/ready')
+def get_ready():
+    """Readiness: LLM providers reachable, enough disk and room in the admission queue (503 if not)."""
+    stats = admission_controller.stats()
+    async_load = stats["async"]
+    result = health.readiness({
+        "admission": {"ok": stats["queued"] < admission_controller.max_queue,
+                      "active": stats["active"], "queued": stats["queued"]},
+        "async_admission": {"ok": async_load["queued"] < async_load["max_queue"],
+                            "active": async_load["active"], "queued": async_load["queued"]}
+    })
+    return jsonify(result), 200 if result["status"] == "ready" else 503
+
+@app.route('/status')
+def get_status():
+    """Providers, loops, queues, active discussions, WebSocket clients and disk usage."""
+    stats = admission_controller.stats()
+    return jsonify(health.system_status({
+        "active_discussions": stats["active"] + stats["async"]["active"],
+        "queued_discussions": stats["queued"] + stats["async"]["queued"],
+        "batches": sum(1 for batch in batches.values() if batch.status == "running"),
+        "websocket_clients": len(connected_clients) + len(async_runtime.clients),
+        "message_store": message_store.footprint(),
+        "async_runtime": {**async_runtime.stats(), "agent_sets": agent_pool.stats()}
+    }))
+
+@app.route('/loop_status')
+def loop_status():
+    """When each agents.py loop runs its next session, and why."""
+    return jsonify({"loops": loop_statuses()})
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Stack samples as collapsed stacks ("frame;frame;... count" lines) for flame graphs.
+
+    With seconds=N, every thread is sampled for N seconds and only those
+    samples are returned; otherwise the samples collected from profiled
+    requests so far (reset=1 clears them). format=json returns the same
+    data as JSON.
+    """
+    seconds = request.args.get('seconds', type=float)
+    if seconds:
+        counts = profiling.sampler.profile(min(seconds, PROFILE_MAX_SECONDS))
+    else:
+        counts = profiling.sampler.snapshot(reset=request.args.get('reset') == '1')
+    if request.args.get('format') == 'json':
+        return jsonify({
+            "samples": sum(counts.values()),
+            "interval": PROFILE_SAMPLE_INTERVAL,
+            "stacks": [{"stack": stack, "count": count} for stack, count in counts.most_common()]
+        })
+    return Response(profiling.collapsed(counts), mimetype='text/plain')
+
+@app.route('/debug/memory')
+def debug_memory():
+    """The process's resident memory and the in-memory message store's footprint."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        rss = None
+    return jsonify({"rss_bytes": rss, "message_store": message_store.footprint()})
+
 @app.route('/get_previous_logs')
 def get_previous_logs():
     try:
@@ -465,5 +1108,9 @@ def ws_test():
     """
 
 if __name__ == '__main__':
+    ensure_files_exist()
+    tool_pool.start()
+    if ASYNC_WS_PORT:
+        async_runtime.serve_websockets()
     # Start the Flask app
     app.run(debug=True, port=5001) 
\ No newline at end of file
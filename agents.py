@@ -1,110 +1,300 @@
+import signal
+import sys
 import time
-from typing import List, Dict
-import autogen
-import google.generativeai as genai
-from config import AGENT_DEFS, MODELS, DEFAULT_MODEL, LOOP_INTERVAL
+from typing import List, Optional
+from config import (
+    LOOP_INTERVAL,
+    LOOP_TOPOLOGY,
+    JOB_POLL_INTERVAL,
+    CASSETTE_RECORD,
+    DISCUSSION_MODE,
+    SCRATCHPAD_TOP_IDEAS
+)
+from admission import admission_controller, Overloaded
+from cassette import Recorder
+from checkpoint import (Checkpoint, Claim, DiscussionClaimed, find_incomplete, load as load_checkpoint,
+                        resume_from as resume_checkpoint)
+from job_queue import job_queue
+from llm_calls import add_middleware
+from message_store import release_chat
+from parallel import run_parallel_round
+from prefetch import speculate
+from profiling import traced, llm_call_span
+from retrieval import build_context
+from scheduler import LoopScheduler
+from scratchpad import scratchpad_store
+from tool_pool import tool_pool
+from topology import topology_store
+from usage import usage_tracker, BudgetExceeded
 from tools import (
     ensure_directories,
-    write_strategy,
     log_chat,
     load_goal,
-    save_to_scratchpad,
-    get_latest_strategy
+    get_latest_strategy,
+    new_discussion_id
 )
 
 class AgentVillage:
-    def __init__(self):
+    def __init__(self, topology_name: str = LOOP_TOPOLOGY, admission=admission_controller, lane: int = 0):
         ensure_directories()
-        self.model_config = MODELS[DEFAULT_MODEL]
-        self._setup_model()
-        self.agents = self._create_agents()
+        self.topology_name = topology_name
+        # Villages with their own agents (batch lanes) may run side by side
+        self.admission = admission
+        self.lane = lane
+        self.last_discussion_id = None
+        self.topology = None
+        # Agent creation is deferred to the first session
+        self.agents = None
         self.group_chat = None
         self.chat_manager = None
 
-    def _setup_model(self):
-        """Setup the selected model."""
-        if DEFAULT_MODEL == "gemini":
-            genai.configure(api_key=self.model_config["api_key"])
-            # Configure the model for autogen
-            self.model_config["base_url"] = "https://generativelanguage.googleapis.com/v1beta"
-            self.model_config["api_type"] = "google"
-
-    def _create_agents(self) -> Dict[str, autogen.AssistantAgent]:
-        """Create all agents with their respective configurations."""
-        agents = {}
-        
-        for agent_def in AGENT_DEFS:
-            agent = autogen.AssistantAgent(
-                name=agent_def["name"],
-                system_message=agent_def["message"],
-                llm_config=self.model_config
-            )
-            agents[agent_def["name"]] = agent
-
-        # Register tools for specific agents
-        agents["Refiner"]._function_map.update({
-            "write_strategy": write_strategy
-        })
-        agents["Explorer"]._function_map.update({
-            "save_to_scratchpad": save_to_scratchpad
-        })
-
-        return agents
+    def _ensure_agents(self):
+        """Create the topology's agents on first use, and again after the topology file changes."""
+        topology = topology_store.get(self.topology_name)
+        if self.agents is None or topology is not self.topology:
+            if self.agents is not None:
+                print(f"Topology {topology.name} changed, rebuilding agents")
+            self.agents = topology.build_agents()
+            self.topology = topology
+            add_middleware(usage_tracker.account)
+            add_middleware(admission_controller.track)
+            add_middleware(llm_call_span)
+
+    def warm(self):
+        """Build the agents now instead of on the first session."""
+        self._ensure_agents()
 
     def _update_agent_context(self, goal: str):
         """Update agent system messages with current goal context."""
         context = f"Current goal: {goal}\n\n"
         if strategy := get_latest_strategy():
             context += f"Current strategy:\n{strategy}\n\n"
+
+        # Bring back relevant analysis from earlier sessions
+        context += build_context(goal)
+
+        # Reuse earlier exploration of this goal instead of regenerating it
+        scratchpad_store.current_goal = goal
+        if ideas := scratchpad_store.top_ideas(goal, SCRATCHPAD_TOP_IDEAS):
+            context += "Distinct ideas already explored for this goal:\n"
+            context += "\n".join(f"- {idea.strip()[:500]}" for idea in ideas) + "\n\n"
         
         for name, agent in self.agents.items():
-            for agent_def in AGENT_DEFS:
-                if agent_def["name"] == name:
-                    agent._system_message = context + agent_def["message"]
-                    break
+            agent.update_system_message(context + self.topology.agent_spec(name).system_message)
+
+    @traced("run_session")
+    def run_session(self, goal: str, resume_id: Optional[str] = None, mode: Optional[str] = None,
+                    cassette=None, discussion_id: Optional[str] = None, job_id: Optional[int] = None) -> str:
+        """Run one discussion about the goal and return its transcript.
+
+        With resume_id, an unfinished discussion continues from its checkpoint;
+        otherwise a new one starts, as discussion_id if given. job_id links
+        the checkpoint to the queued job running it. cassette records the
+        LLM calls (a Recorder) or answers them from a recording (a Replayer).
+        Raises Overloaded while the LLM provider is rate limiting, instead of
+        starting a discussion that would fail, and DiscussionClaimed when
+        another process is already running the discussion.
+        """
+        discussion_id = resume_id or discussion_id or new_discussion_id()
+        with Claim(discussion_id):
+            if resume_id and load_checkpoint(resume_id)[2] is not None:
+                raise ValueError(f"Discussion {resume_id} already finished")
+            with self.admission.admit(f"{self.topology_name}:{self.lane}"):
+                return self._run_session(goal, discussion_id, bool(resume_id), mode, cassette, job_id)
+
+    def _run_session(self, goal: str, discussion_id: str, resume: bool, mode: Optional[str], cassette,
+                     job_id: Optional[int]) -> str:
+        # Update agent context with current goal
+        self._ensure_agents()
+        self._update_agent_context(goal)
+
+        message = f"Let's discuss and refine our strategy for: {goal}"
+        mode = mode or DISCUSSION_MODE
+        resume_messages = None
+        if resume:
+            metadata, resume_messages, _ = load_checkpoint(discussion_id)
+            mode = metadata.get("mode", mode)
+            checkpoint = resume_checkpoint(discussion_id)
+        else:
+            checkpoint = Checkpoint(discussion_id)
+            checkpoint.start(source="agents", goal=goal, mode=mode, job=job_id)
+        self.last_discussion_id = checkpoint.discussion_id
+
+        usage_tracker.begin_discussion(checkpoint.discussion_id, goal, self.agents.values())
+        if cassette is None and CASSETTE_RECORD and not resume:
+            cassette = Recorder()
+        if cassette is not None:
+            cassette.start(self.agents.values(), pipeline="agents", topic=goal, mode=mode,
+                           topology=self.topology_name, discussion=checkpoint.discussion_id)
+        try:
+            if mode == "parallel":
+                transcript = self._run_parallel_session(message, checkpoint, resume_messages)
+            else:
+                transcript = self._run_group_session(message, checkpoint, resume_messages, cassette)
+            checkpoint.finish()
+            return transcript
+        except BudgetExceeded:
+            checkpoint.finish("budget_exceeded")
+            raise
+        finally:
+            usage_tracker.end_discussion(checkpoint.discussion_id)
+            checkpoint.detach(self.agents.values())
+            if cassette is not None:
+                cassette.close()
+            if self.group_chat is not None:
+                release_chat(self.group_chat, self.chat_manager)
+                self.group_chat = self.chat_manager = None
+
+    def _run_group_session(self, message: str, checkpoint: Checkpoint,
+                           resume_messages: Optional[List[dict]] = None, cassette=None) -> str:
+        """Let the agents take turns in a group chat."""
+        # Initialize group chat; a resumed discussion only gets the rounds it has left
+        max_round = self.topology.max_round
+        if resume_messages:
+            max_round = max(max_round - len(resume_messages) + 1, 1)
+        self.group_chat, self.chat_manager = self.topology.build_groupchat(self.agents, max_round, cassette)
+        checkpoint.attach(self.group_chat.agents)
+
+        if resume_messages:
+            # Replay the saved turns without calling the LLM, then finish the remaining rounds
+            last_agent, last_message = self.chat_manager.resume(messages=resume_messages)
+            with speculate(self.group_chat, self.chat_manager):
+                chat_transcript = last_agent.initiate_chat(
+                    recipient=self.chat_manager,
+                    message=last_message,
+                    clear_history=False
+                )
+        else:
+            with speculate(self.group_chat, self.chat_manager):
+                chat_transcript = self.agents[self.topology.initiator].initiate_chat(
+                    self.chat_manager,
+                    message=message
+                )
+        return str(chat_transcript)
+
+    def _run_parallel_session(self, message: str, checkpoint: Checkpoint,
+                              resume_messages: Optional[List[dict]] = None) -> str:
+        """Let the independent agents answer concurrently and the synthesizer merge them."""
+        synthesizer = self.topology.synthesizer
+        replies, synthesis = run_parallel_round(
+            [self.agents[name] for name in self.topology.parallel_agents],
+            message,
+            synthesizer=self.agents[synthesizer],
+            on_reply=checkpoint.record_reply,
+            done={m["name"]: m["content"] for m in resume_messages or []}
+        )
+        sections = [f"{name}:\n{reply}" for name, reply in replies.items() if reply is not None]
+        sections.append(f"{synthesizer}:\n{synthesis}")
+        return "\n\n".join(sections)
+
+    def resume_unfinished(self):
+        """Finish discussions that were interrupted by a crash or restart.
+
+        Discussions another process is running are skipped, as are those of
+        queued jobs, which the worker that retries the job resumes.
+        """
+        for metadata in find_incomplete(source="agents"):
+            if metadata.get("job") is not None:
+                continue
+            print(f"Resuming discussion {metadata['discussion']} after {metadata['turns']} saved turns")
+            try:
+                log_chat(self.run_session(metadata["goal"], resume_id=metadata["discussion"]))
+            except (DiscussionClaimed, ValueError) as e:
+                print(f"Not resuming: {e}")
+            except Exception as e:
+                print(f"Error resuming discussion: {e}")
+                log_chat(f"Error occurred: {str(e)}")
 
     def run_chat_loop(self):
-        """Main chat loop that runs continuously."""
+        """Main chat loop that runs continuously, paced by a LoopScheduler."""
+        self.resume_unfinished()
+        scheduler = LoopScheduler()
+        try:
+            self._run_sessions(scheduler)
+        finally:
+            scheduler.close()
+
+    def _run_sessions(self, scheduler: LoopScheduler):
         while True:
+            scheduler.wait()
+
             # Load and validate goal
             goal = load_goal()
             if not goal:
                 print("No goal found in goals.txt. Waiting...")
-                time.sleep(LOOP_INTERVAL)
+                scheduler.defer(LOOP_INTERVAL, "no goal in goals.txt")
                 continue
 
-            # Update agent context with current goal
-            self._update_agent_context(goal)
-
-            # Initialize group chat
-            self.group_chat = autogen.GroupChat(
-                agents=list(self.agents.values()),
-                messages=[],
-                max_round=10
-            )
-            
-            self.chat_manager = autogen.GroupChatManager(
-                groupchat=self.group_chat,
-                llm_config=self.model_config
-            )
-
             # Run the chat session
+            scheduler.begin()
             try:
-                chat_transcript = self.chat_manager.initiate_chat(
-                    message=f"Let's discuss and refine our strategy for: {goal}",
-                    sender=self.agents["Explorer"]
-                )
-                
                 # Log the chat transcript
-                log_chat(str(chat_transcript))
-                
+                log_chat(self.run_session(goal))
+            except Overloaded as e:
+                print(f"Not starting a discussion: {e}. Retrying in {e.retry_after}s")
+                scheduler.defer(e.retry_after, f"not admitted: {e}")
+                continue
             except Exception as e:
                 print(f"Error in chat loop: {e}")
                 log_chat(f"Error occurred: {str(e)}")
+                scheduler.failed(e)
+                continue
+            scheduler.succeeded()
+
+    def run_worker(self):
+        """Run queued discussions one at a time, as they become due."""
+        self.resume_unfinished()
+        while True:
+            job_queue.enqueue_due_schedules()
+            # Leave jobs queued while the LLM provider is rate limiting us
+            delay = admission_controller.shed_delay()
+            if delay > 0:
+                print(f"LLM provider is rate limiting, waiting {delay:.0f}s before claiming a job")
+                time.sleep(delay)
+                continue
+            job = job_queue.claim()
+            if job is None:
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
 
-            # Wait before next iteration
-            time.sleep(LOOP_INTERVAL)
+            print(f"Running job {job['id']} (attempt {job['attempts']}): {job['topic']}")
+            with job_queue.lease(job):
+                self._run_job(job)
+
+    def _run_job(self, job: dict):
+        """Run a claimed job, resuming the discussion an earlier attempt left unfinished."""
+        resume_id = discussion_id = job["discussion"]
+        if discussion_id:
+            try:
+                end = load_checkpoint(discussion_id)[2]
+            except FileNotFoundError:
+                # Linked but stopped before its checkpoint was written
+                end = resume_id = None
+            if end is not None:
+                # The discussion finished but the worker stopped before recording it
+                job_queue.complete(job["id"], job["worker"], f"Completed as discussion {discussion_id}")
+                return
+        if resume_id is None:
+            discussion_id = new_discussion_id()
+            job_queue.link_discussion(job["id"], job["worker"], discussion_id)
+        try:
+            transcript = self.run_session(job["topic"], resume_id=resume_id, mode=job["mode"],
+                                          discussion_id=discussion_id, job_id=job["id"])
+            log_chat(transcript)
+            if not job_queue.complete(job["id"], job["worker"], transcript[-2000:]):
+                print(f"Job {job['id']} was taken over by another worker; its result is not recorded")
+        except Exception as e:
+            print(f"Error in job {job['id']}: {e}")
+            log_chat(f"Error occurred: {str(e)}")
+            if not job_queue.fail(job["id"], job["worker"], str(e)):
+                print(f"Job {job['id']} was taken over by another worker")
 
 if __name__ == "__main__":
     village = AgentVillage()
-    village.run_chat_loop() 
\ No newline at end of file
+    tool_pool.start()
+    if "--worker" in sys.argv:
+        village.run_worker()
+    else:
+        # Exit through run_chat_loop's cleanup when the supervisor stops us
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        village.run_chat_loop() 
\ No newline at end of file
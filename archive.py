@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Columnar archives of past discussions
+Exports every checkpointed discussion, its turns and the LLM calls from the
+usage log to Parquet or Arrow IPC files for offline analysis, and restores
+them, e.g. python archive.py export --format parquet
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+from config import ARCHIVE_DIR, ARCHIVE_BATCH_ROWS, ARCHIVE_COMPRESSION, CHECKPOINT_DIR, USAGE_LOG_FILE
+
+ARCHIVE_VERSION = 1
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}
+TABLES = ("discussions", "turns", "llm_calls")
+
+def _arrow():
+    """pyarrow, which archives need but the rest of the project does not."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Archives need pyarrow: pip install pyarrow")
+    return pyarrow
+
+def _schemas(pa, file_format: str = "parquet") -> Dict:
+    # Names, roles and ids repeat on every row; Parquet's dictionary encoding
+    # stores each once per batch. Arrow IPC files allow only one dictionary
+    # per column for the whole file, so there they are plain strings
+    label = pa.dictionary(pa.int32(), pa.string()) if file_format == "parquet" else pa.string()
+    return {
+        "discussions": pa.schema([
+            ("discussion", pa.string()),
+            ("source", label),
+            ("topic", pa.string()),
+            ("mode", label),
+            ("topology", label),
+            ("created", pa.timestamp("s")),
+            ("finished", pa.timestamp("s")),
+            ("status", label),
+            ("turns", pa.int32()),
+            # The full start and end records, so a restore is lossless
+            ("start_record", pa.string()),
+            ("end_record", pa.string())
+        ]),
+        "turns": pa.schema([
+            ("discussion", label),
+            ("index", pa.int32()),
+            ("name", label),
+            ("role", label),
+            ("content", pa.string()),
+            ("length", pa.int32()),
+            ("message", pa.string())
+        ]),
+        "llm_calls": pa.schema([
+            ("timestamp", pa.timestamp("s")),
+            ("discussion", label),
+            ("goal", pa.string()),
+            ("agent", label),
+            ("model", label),
+            ("prompt_tokens", pa.int64()),
+            ("completion_tokens", pa.int64()),
+            ("total_tokens", pa.int64()),
+            ("cost", pa.float64()),
+            ("latency", pa.float64())
+        ])
+    }
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S") if value else None
+
+def _read_checkpoint(path: str) -> Iterator[Dict]:
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-write
+                continue
+
+class _TableWriter:
+    """Buffers rows of one table column by column and writes them a batch at a time."""
+
+    def __init__(self, pa, path: str, schema, file_format: str):
+        self.pa = pa
+        self.schema = schema
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        if file_format == "parquet":
+            self.writer = pa.parquet.ParquetWriter(path, schema, compression=ARCHIVE_COMPRESSION)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=ARCHIVE_COMPRESSION)
+            self.writer = pa.ipc.new_file(path, schema, options=options)
+
+    def append(self, row: Dict):
+        for name, column in self.columns.items():
+            column.append(row.get(name))
+        self.rows += 1
+        if len(self.columns[self.schema.names[0]]) >= ARCHIVE_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.columns[self.schema.names[0]]:
+            return
+        batch = self.pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self.writer.write_batch(batch)
+        for column in self.columns.values():
+            column.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+def export_archive(output: Optional[str] = None, file_format: str = "parquet",
+                   checkpoint_dir: str = CHECKPOINT_DIR, usage_log: str = USAGE_LOG_FILE) -> Dict:
+    """Write the discussions, turns and LLM calls tables to a new archive directory.
+
+    Checkpoints are read one at a time and the usage log one line at a
+    time, and rows are written every ARCHIVE_BATCH_ROWS, so memory use does
+    not grow with the amount of history. Returns the archive's manifest.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown archive format: {file_format}")
+    pa = _arrow()
+    output = output or os.path.join(ARCHIVE_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(output, exist_ok=True)
+    schemas = _schemas(pa, file_format)
+    writers = {name: _TableWriter(pa, os.path.join(output, f"{name}.{FORMATS[file_format]}"),
+                                  schemas[name], file_format)
+               for name in TABLES}
+    try:
+        filenames = sorted(os.listdir(checkpoint_dir)) if os.path.isdir(checkpoint_dir) else []
+        for filename in filenames:
+            if not filename.endswith(".jsonl"):
+                continue
+            discussion_id = filename[:-len(".jsonl")]
+            start, end, turns = {}, None, 0
+            for record in _read_checkpoint(os.path.join(checkpoint_dir, filename)):
+                if record["type"] == "start":
+                    start = record
+                elif record["type"] == "turn":
+                    message = record["message"]
+                    content = message.get("content")
+                    text = content if isinstance(content, str) else None
+                    writers["turns"].append({
+                        "discussion": discussion_id,
+                        "index": turns,
+                        "name": message.get("name"),
+                        "role": message.get("role"),
+                        "content": text,
+                        "length": len(text) if text is not None else None,
+                        # Tool calls and multi-part content are kept whole
+                        "message": None if text is not None and set(message) <= {"content", "name", "role"}
+                        else json.dumps(message, default=str)
+                    })
+                    turns += 1
+                elif record["type"] == "end":
+                    end = record
+            writers["discussions"].append({
+                "discussion": discussion_id,
+                "source": start.get("source"),
+                "topic": start.get("topic", start.get("goal")),
+                "mode": start.get("mode"),
+                "topology": start.get("topology"),
+                "created": _parse_time(start.get("created")),
+                "finished": _parse_time(end.get("finished")) if end else None,
+                "status": end.get("status") if end else "incomplete",
+                "turns": turns,
+                "start_record": json.dumps(start) if start else None,
+                "end_record": json.dumps(end) if end else None
+            })
+
+        if os.path.exists(usage_log):
+            with open(usage_log, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    writers["llm_calls"].append({**record, "timestamp": _parse_time(record.get("timestamp"))})
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    manifest = {
+        "version": ARCHIVE_VERSION,
+        "format": file_format,
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": {name: writer.rows for name, writer in writers.items()}
+    }
+    with open(os.path.join(output, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return {"path": output, **manifest}
+
+def _manifest(archive: str) -> Dict:
+    with open(os.path.join(archive, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported archive version: {manifest.get('version')}")
+    return manifest
+
+def iter_batches(archive: str, table: str) -> Iterator:
+    """Stream one table of an archive as pyarrow record batches."""
+    pa = _arrow()
+    file_format = _manifest(archive)["format"]
+    path = os.path.join(archive, f"{table}.{FORMATS[file_format]}")
+    if file_format == "parquet":
+        yield from pa.parquet.ParquetFile(path).iter_batches(batch_size=ARCHIVE_BATCH_ROWS)
+    else:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+def load_table(archive: str, table: str):
+    """One table of an archive as a pyarrow Table, for vectorized analysis
+    (e.g. load_table(path, "llm_calls").group_by("agent").aggregate(...)).
+    Arrow IPC files are memory-mapped rather than read."""
+    pa = _arrow()
+    schema = _schemas(pa, _manifest(archive)["format"])[table]
+    return pa.Table.from_batches(list(iter_batches(archive, table)), schema=schema)
+
+def _rows(archive: str, table: str) -> Iterator[Dict]:
+    for batch in iter_batches(archive, table):
+        yield from batch.to_pylist()
+
+def _format_time(value: Optional[datetime]) -> Optional[str]:
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+
+def import_archive(archive: str, checkpoint_dir: str = CHECKPOINT_DIR, usage_log: str = USAGE_LOG_FILE) -> Dict:
+    """Restore an archive's checkpoints and usage records.
+
+    Discussions that already have a checkpoint are left alone, and so are
+    their LLM calls. Unfinished discussions are restored as ended with
+    status "incomplete" so the agents do not pick them up again. Calls
+    that belong to no discussion are only restored into a usage log that
+    does not exist yet, since there is no telling whether an existing log
+    already has them.
+    """
+    _manifest(archive)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    # Only the small per-discussion records are held; turns are streamed
+    discussions = {}
+    skipped = 0
+    for row in _rows(archive, "discussions"):
+        if os.path.exists(os.path.join(checkpoint_dir, f"{row['discussion']}.jsonl")):
+            skipped += 1
+            continue
+        discussions[row["discussion"]] = row
+
+    def open_checkpoint(discussion_id: str):
+        return open(os.path.join(checkpoint_dir, f"{discussion_id}.jsonl"), "a")
+
+    def write(f, record: Dict):
+        f.write(json.dumps(record, default=str) + "\n")
+
+    def begin(f, row: Dict):
+        if row["start_record"]:
+            write(f, json.loads(row["start_record"]))
+
+    def end(f, row: Dict):
+        # An unfinished discussion is closed off, or the agents would resume it
+        write(f, json.loads(row["end_record"]) if row["end_record"] else
+              {"type": "end", "status": "incomplete", "finished": None})
+
+    # Turns are grouped by discussion, so one checkpoint is open at a time
+    current, f = None, None
+    started = set()
+    restored_turns = 0
+    try:
+        for row in _rows(archive, "turns"):
+            discussion_id = row["discussion"]
+            if discussion_id not in discussions:
+                continue
+            if discussion_id != current:
+                if f is not None:
+                    f.close()
+                current, f = discussion_id, open_checkpoint(discussion_id)
+                if discussion_id not in started:
+                    started.add(discussion_id)
+                    begin(f, discussions[discussion_id])
+            message = json.loads(row["message"]) if row["message"] else {
+                key: row[key] for key in ("role", "name", "content") if row[key] is not None}
+            write(f, {"type": "turn", "index": row["index"], "message": message})
+            restored_turns += 1
+    finally:
+        if f is not None:
+            f.close()
+    for discussion_id, row in discussions.items():
+        with open_checkpoint(discussion_id) as f:
+            if discussion_id not in started:
+                begin(f, row)
+            end(f, row)
+
+    fresh_log = not os.path.exists(usage_log)
+    restored_calls = 0
+    with open(usage_log, "a") as f:
+        for row in _rows(archive, "llm_calls"):
+            if row["discussion"] in discussions or (row["discussion"] is None and fresh_log):
+                timestamp = row["timestamp"]
+                record = {**row, "timestamp": _format_time(timestamp),
+                          "day": timestamp.strftime("%Y-%m-%d") if timestamp else None}
+                f.write(json.dumps(record) + "\n")
+                restored_calls += 1
+    return {"discussions": len(discussions), "skipped": skipped, "turns": restored_turns,
+            "llm_calls": restored_calls}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or restore a columnar archive of past discussions")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export_parser = subcommands.add_parser("export", help="Write checkpoints and LLM usage to an archive")
+    export_parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    export_parser.add_argument("--output", help=f"Archive directory (default: a new one under {ARCHIVE_DIR}/)")
+    import_parser = subcommands.add_parser("import", help="Restore the checkpoints and LLM usage in an archive")
+    import_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export_archive(args.output, args.format), indent=2))
+    else:
+        print(json.dumps(import_archive(args.archive), indent=2))
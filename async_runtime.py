@@ -0,0 +1,383 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+from admission import admission_controller, Overloaded, Ticket
+from checkpoint import write_turns
+from log_store import log_store
+from topology import topology_store
+from ws_clients import (Subscriptions, PROTOCOL_VERSION, encode_frames, handle_subscription, missed_entries,
+                        parse_channels)
+from config import (ASYNC_IO_WORKERS, ASYNC_MAX_DISCUSSIONS, ASYNC_MAX_QUEUE, ASYNC_WRITE_BATCH,
+                    ASYNC_AGENT_POOL_MAX, ASYNC_WS_HOST, ASYNC_WS_PORT, WS_BATCH_DELAY, WS_PING_INTERVAL,
+                    WS_QUEUE_MAX)
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT_POLL_INTERVAL = 0.2  # seconds an admitted discussion waits between checks for LLM call capacity
+
+def _in_executor(func: Callable) -> Callable:
+    """An async stand-in for a blocking function that runs it on the loop's default executor."""
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+    return call
+
+def offload_blocking(agent):
+    """Make the agent's tool calls and code execution awaitable.
+
+    autogen's async chat calls synchronous tools and reply functions on the
+    event loop itself, where one slow call would stall every discussion.
+    """
+    from autogen import ConversableAgent
+    agent.register_function({name: _in_executor(func) for name, func in agent.function_map.items()
+                             if not inspect.iscoroutinefunction(func)}, silent_override=True)
+    for reply_func in (ConversableAgent.generate_code_execution_reply,
+                       ConversableAgent._generate_code_execution_reply_using_executor):
+        agent.replace_reply_func(reply_func, _in_executor(reply_func))
+
+class AsyncWriter:
+    """Writes queued by coroutines, done in order on the executor in batches.
+
+    write_batch gets up to batch_max items at a time, so a burst of log
+    entries or checkpoint turns costs one executor hop and one file write
+    instead of one each. write() and flush() must be called on the loop.
+    """
+
+    def __init__(self, write_batch: Callable[[List], None], batch_max: int = ASYNC_WRITE_BATCH):
+        self.write_batch = write_batch
+        self.batch_max = batch_max
+        self.pending = deque()
+        self.task: Optional[asyncio.Task] = None
+
+    def write(self, item):
+        self.pending.append(item)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self._drain())
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while self.pending:
+            batch = [self.pending.popleft() for _ in range(min(len(self.pending), self.batch_max))]
+            try:
+                await loop.run_in_executor(None, self.write_batch, batch)
+            except Exception as e:
+                logger.error(f"Error writing {len(batch)} queued items: {e}")
+
+    async def flush(self):
+        """Wait until everything written so far is on disk."""
+        while self.task is not None and not self.task.done():
+            await asyncio.shield(self.task)
+
+# Turns of async discussions, written with one fsync per checkpoint and batch
+checkpoint_writer = AsyncWriter(write_turns)
+
+class AgentPool:
+    """Agent sets for async discussions: one per running discussion, reused afterwards.
+
+    Usage attribution, checkpoint hooks and per-chat state are keyed by
+    agent, so concurrent discussions cannot share a set. Finished sets wait
+    here for the next discussion on the same topology (up to max_idle each)
+    instead of being built again. Only used from the event loop.
+    """
+
+    def __init__(self, build: Callable, max_idle: int = ASYNC_AGENT_POOL_MAX):
+        self.build = build
+        self.max_idle = max_idle
+        # Topology name -> (the topology the sets were built from, idle sets)
+        self.idle: Dict[str, Tuple[object, List[Dict]]] = {}
+        self.built = 0
+        self.in_use = 0
+
+    async def acquire(self, topology_name: str):
+        """Return the topology and an agent set for it, building one if none is idle."""
+        loop = asyncio.get_running_loop()
+        topology = await loop.run_in_executor(None, topology_store.get, topology_name)
+        idle = self.idle.get(topology_name)
+        if idle is not None and idle[0] is topology and idle[1]:
+            agents = idle[1].pop()
+        else:
+            agents = await loop.run_in_executor(None, self.build, topology)
+            for agent in agents.values():
+                offload_blocking(agent)
+            self.built += 1
+        self.in_use += 1
+        return topology, agents
+
+    def release(self, topology, agents: Dict):
+        self.in_use -= 1
+        idle = self.idle.get(topology.name)
+        if idle is None or idle[0] is not topology:
+            # Sets built from an older version of the topology are dropped
+            idle = self.idle[topology.name] = (topology, [])
+        if len(idle[1]) < self.max_idle:
+            idle[1].append(agents)
+
+    def stats(self) -> Dict:
+        return {"built": self.built, "in_use": self.in_use,
+                "idle": sum(len(sets) for _, sets in list(self.idle.values()))}
+
+class AsyncWSClient:
+    """A connection to the async WebSocket server.
+
+    Queued like WSClient, but written by a task on the event loop instead of
+    a thread of its own, so thousands of idle dashboards cost only memory.
+    Only used from the event loop.
+    """
+
+    def __init__(self, connection, channels: Set[str]):
+        self.connection = connection
+        self.channels = channels
+        self.pending = deque()
+        # Live entries held back while the replay for a resuming client is queued
+        self.held: Optional[List[Dict]] = []
+        self.wakeup = asyncio.Event()
+        self.closed = False
+
+    def send_control(self, frame: Dict):
+        self.pending.append({"control": frame})
+        self.wakeup.set()
+
+    def enqueue(self, entry: Dict):
+        if self.held is not None:
+            self.held.append(entry)
+            return
+        if len(self.pending) >= WS_QUEUE_MAX:
+            logger.warning("WebSocket client fell too far behind, disconnecting it")
+            self.pending.clear()
+            self.close()
+            return
+        self.pending.append(entry)
+        self.wakeup.set()
+
+    def release(self, replay: List[Dict]):
+        """Queue the replayed entries, then the live ones that arrived meanwhile."""
+        self.pending.extend(replay)
+        last = max((e["seq"] for e in replay if e.get("seq") is not None), default=-1)
+        for entry in self.held or []:
+            if entry.get("seq") is None or entry["seq"] > last:
+                self.pending.append(entry)
+        self.held = None
+        self.wakeup.set()
+
+    async def write_loop(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.closed:
+                break
+            # Let a burst accumulate into one frame
+            await asyncio.sleep(WS_BATCH_DELAY)
+            try:
+                while self.pending and not self.closed:
+                    for frame in encode_frames(self.pending, PROTOCOL_VERSION):
+                        await self.connection.send(frame)
+            except Exception as e:
+                logger.error(f"Error sending to client: {e}")
+                self.closed = True
+        await self.connection.close()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+def _resume_point(cursor: Optional[int], channels: Set[str]) -> Tuple[int, Optional[List[Dict]]]:
+    latest = log_store.latest_seq()
+    if cursor is None or cursor >= latest:
+        return latest, []
+    return latest, missed_entries(cursor, latest, channels)
+
+class AsyncRuntime:
+    """An asyncio event loop on a background thread, bridged to the Flask app.
+
+    Discussions submitted from request threads run as coroutines on the
+    loop; what they still have to do blocking (LLM HTTP calls, tool calls,
+    file writes) runs on the loop's default executor, bounded to workers
+    threads. At most max_discussions run at once and up to max_queue more
+    wait for a slot; like the admission controller's, a discussion only
+    starts while fewer than its max_inflight LLM calls are outstanding. The
+    loop also serves the optional WebSocket server.
+    """
+
+    def __init__(self, workers: int = ASYNC_IO_WORKERS, max_discussions: int = ASYNC_MAX_DISCUSSIONS,
+                 max_queue: int = ASYNC_MAX_QUEUE):
+        self.workers = workers
+        self.max_discussions = max_discussions
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.slots = asyncio.Semaphore(max_discussions)
+        # Submitted discussions that have not finished, counted by admit()
+        self.admitted = 0
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        # Smoothed discussion duration, for Retry-After estimates
+        self.average_duration = 60.0
+        self.clients = Subscriptions()
+        self.ws_address = None
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop's thread, once; returns the loop."""
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="async-io"))
+                ready = threading.Event()
+                threading.Thread(target=self._run, args=(loop, ready), name="async-runtime", daemon=True).start()
+                ready.wait()
+                self.loop = loop
+        return self.loop
+
+    def _run(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    def submit(self, coro, ticket: Optional[Ticket] = None) -> Future:
+        """Run a coroutine on the loop from any thread; the future has its result.
+
+        ticket (from admit()) is released when the coroutine finishes.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.start())
+        if ticket is not None:
+            future.add_done_callback(lambda _: ticket.release())
+        return future
+
+    def admit(self, wait: bool = True) -> Ticket:
+        """Count a new discussion in, or raise Overloaded if it would be shed; call before submitting it."""
+        delay = admission_controller.shed_delay()
+        with self.lock:
+            queued = max(self.admitted - self.max_discussions, 0)
+            if delay > 0:
+                self.shed += 1
+                raise Overloaded("The LLM provider is rate limiting requests", delay)
+            if self.admitted >= self.max_discussions and (not wait or queued >= self.max_queue):
+                self.shed += 1
+                raise Overloaded("Too many discussions are running or waiting",
+                                 self.average_duration * (queued // max(self.max_discussions, 1) + 1))
+            if not wait and not admission_controller.inflight_available():
+                self.shed += 1
+                raise Overloaded("Too many LLM calls are outstanding", self.average_duration)
+            self.admitted += 1
+        return Ticket(self, "async", 0)
+
+    def _release(self, ticket: Ticket):
+        with self.lock:
+            self.admitted -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one of the max_discussions slots for a discussion."""
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+            try:
+                while not admission_controller.inflight_available():
+                    await asyncio.sleep(INFLIGHT_POLL_INTERVAL)
+            except BaseException:
+                self.slots.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.average_duration = 0.8 * self.average_duration + 0.2 * (time.time() - started)
+            self.slots.release()
+
+    def publish(self, entry: Dict, channels: List[str]):
+        """Send a log entry to the async WebSocket clients watching one of its channels (from any thread)."""
+        if self.loop is not None and len(self.clients):
+            self.loop.call_soon_threadsafe(self._fan_out, entry, channels)
+
+    def _fan_out(self, entry: Dict, channels: List[str]):
+        for client in self.clients.recipients(channels):
+            if client.closed:
+                self.clients.discard(client)
+            else:
+                client.enqueue(entry)
+
+    def serve_websockets(self, host: str = ASYNC_WS_HOST, port: int = ASYNC_WS_PORT):
+        """Start the WebSocket server on the loop and return once it is listening.
+
+        It speaks /ws protocol v2 (hello, cursor resume, batched frames,
+        channel subscriptions) at any path; the v query parameter is ignored.
+        """
+        try:
+            from websockets.asyncio.server import serve
+        except ImportError:
+            raise ImportError("The async WebSocket server needs websockets: pip install websockets")
+
+        async def start():
+            return await serve(self._serve_client, host, port, ping_interval=WS_PING_INTERVAL,
+                               ping_timeout=WS_PING_INTERVAL)
+
+        self.submit(start()).result()
+        self.ws_address = f"{host}:{port}"
+        logger.info(f"Async WebSocket server listening on {self.ws_address}")
+
+    async def _serve_client(self, connection):
+        query = parse_qs(urlsplit(connection.request.path).query)
+        try:
+            channels = parse_channels(query.get("channels", [None])[0])
+            cursor = int(query["cursor"][0]) if "cursor" in query else None
+        except ValueError as e:
+            await connection.send(json.dumps({"type": "error", "message": str(e)}))
+            return
+        client = AsyncWSClient(connection, channels)
+        self.clients.add(client)
+        writer = asyncio.create_task(client.write_loop())
+        try:
+            # Reading the log store may wait on its file, so it is done off the loop
+            latest, replay = await asyncio.get_running_loop().run_in_executor(None, _resume_point, cursor, channels)
+            client.send_control({"type": "hello", "v": PROTOCOL_VERSION, "latest": latest,
+                                 "channels": sorted(channels)})
+            if replay is None:
+                client.send_control({"type": "reset", "latest": latest})
+                replay = []
+            client.release(replay)
+            async for data in connection:
+                handle_subscription(self.clients, client, data)
+        except Exception as e:
+            logger.info(f"Async WebSocket closed: {e}")
+        finally:
+            client.close()
+            self.clients.discard(client)
+            await writer
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.loop is not None,
+            "active_discussions": self.active,
+            "queued_discussions": self.waiting,
+            "shed": self.shed,
+            "io_workers": self.workers,
+            "websocket_server": self.ws_address,
+            "websocket_clients": len(self.clients)
+        }
+
+    def load(self) -> Dict:
+        """Admitted discussions, as reported by admission_controller.stats()."""
+        with self.lock:
+            return {
+                "active": self.active,
+                "queued": self.admitted - self.active,
+                "max_discussions": self.max_discussions,
+                "max_queue": self.max_queue,
+                "shed": self.shed
+            }
+
+async_runtime = AsyncRuntime()
+admission_controller.add_load("async", async_runtime.load)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Batch runs for Agent Village
+Runs many goals through one topology and writes a consolidated result file
+with per-goal timing, e.g. python batch.py goals.txt --parallelism 4
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import BATCH_DIR, BATCH_PARALLELISM, BATCH_MAX_GOALS, BATCH_MAX_RETRIES, LOOP_TOPOLOGY, DISCUSSION_MODE
+from admission import admission_controller, Overloaded
+from usage import usage_tracker
+
+class Batch:
+    """A list of goals run through one topology by a fixed number of lanes.
+
+    Each lane is an AgentVillage with its own agents, built once before the
+    first goal and reused for every goal the lane picks up, so the cost of
+    compiling the topology and creating agents and their clients is paid
+    once per lane rather than once per goal. Lanes take goals from a shared
+    queue. Every goal is admitted by the global admission controller like
+    any other discussion, so there are never more lanes than it lets run at
+    once; a goal it sheds goes back on the queue after the Retry-After delay.
+    """
+
+    def __init__(self, goals: List[str], topology: str = LOOP_TOPOLOGY, mode: Optional[str] = None,
+                 parallelism: int = BATCH_PARALLELISM, batch_id: Optional[str] = None):
+        goals = [goal.strip() for goal in goals if goal and goal.strip()]
+        if not goals:
+            raise ValueError("A batch needs at least one goal")
+        if len(goals) > BATCH_MAX_GOALS:
+            raise ValueError(f"A batch can have at most {BATCH_MAX_GOALS} goals")
+        self.id = batch_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.goals = goals
+        self.topology = topology
+        self.mode = mode or DISCUSSION_MODE
+        self.parallelism = max(1, min(parallelism, len(goals), admission_controller.max_active))
+        self.path = os.path.join(BATCH_DIR, f"{self.id}.json")
+        self.lock = threading.Lock()
+        self.status = "pending"
+        self.results: List[Optional[Dict]] = [None] * len(goals)
+        self.started = None
+        self.warmup_seconds = None
+        self.elapsed = None
+        self.error = None
+
+    def _run_goal(self, village, index: int, goal: str, attempt: int) -> Dict:
+        started = time.time()
+        result = {"index": index, "goal": goal, "lane": village.lane, "attempts": attempt,
+                  "queued_seconds": round(started - self.started, 3)}
+        try:
+            transcript = village.run_session(goal, mode=self.mode)
+            result.update(status="ok", transcript=transcript)
+        except Overloaded:
+            raise
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        result["discussion"] = village.last_discussion_id
+        result["seconds"] = round(time.time() - started, 3)
+        if village.last_discussion_id:
+            result["usage"] = usage_tracker.summary(village.last_discussion_id)["totals"]
+        return result
+
+    def _lane(self, village, goals: "queue.Queue"):
+        while True:
+            try:
+                index, goal, attempt = goals.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = self._run_goal(village, index, goal, attempt)
+            except Overloaded as e:
+                if attempt > BATCH_MAX_RETRIES:
+                    result = {"index": index, "goal": goal, "lane": village.lane, "attempts": attempt,
+                              "status": "error", "error": str(e), "seconds": 0}
+                else:
+                    time.sleep(e.retry_after)
+                    goals.put((index, goal, attempt + 1))
+                    continue
+            with self.lock:
+                self.results[index] = result
+
+    def run(self) -> Dict:
+        """Run every goal and write the consolidated results; returns them too."""
+        from agents import AgentVillage
+
+        self.status = "running"
+        warmup_started = time.time()
+        try:
+            villages = [AgentVillage(self.topology, admission=admission_controller, lane=lane)
+                        for lane in range(self.parallelism)]
+            with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+                list(pool.map(lambda village: village.warm(), villages))
+        except Exception as e:
+            self.status = "failed"
+            self.error = f"Could not build the {self.topology} agents: {e}"
+            raise
+        self.warmup_seconds = round(time.time() - warmup_started, 3)
+
+        goals = queue.Queue()
+        for index, goal in enumerate(self.goals):
+            goals.put((index, goal, 1))
+        self.started = time.time()
+        try:
+            lanes = [threading.Thread(target=self._lane, args=(village, goals), name=f"batch-lane-{village.lane}")
+                     for village in villages]
+            for lane in lanes:
+                lane.start()
+            for lane in lanes:
+                lane.join()
+        finally:
+            self.elapsed = round(time.time() - self.started, 3)
+            self.status = "done"
+        report = self.report()
+        self._write(report)
+        return report
+
+    def report(self, include_transcripts: bool = True) -> Dict:
+        with self.lock:
+            results = [dict(r) for r in self.results if r is not None]
+        if not include_transcripts:
+            for result in results:
+                result.pop("transcript", None)
+        sequential = sum(r["seconds"] for r in results)
+        return {
+            "batch": self.id,
+            "status": self.status,
+            "topology": self.topology,
+            "mode": self.mode,
+            "parallelism": self.parallelism,
+            "goals": len(self.goals),
+            "completed": len(results),
+            "failed": sum(1 for r in results if r["status"] != "ok"),
+            "error": self.error,
+            "warmup_seconds": self.warmup_seconds,
+            "elapsed_seconds": self.elapsed if self.elapsed is not None else (
+                round(time.time() - self.started, 3) if self.started else None),
+            # What running the goals one after another would have taken
+            "sequential_seconds": round(sequential, 3),
+            "speedup": round(sequential / self.elapsed, 2) if self.elapsed else None,
+            "results": sorted(results, key=lambda r: r["index"])
+        }
+
+    def _write(self, report: Dict):
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def read_goals(path: str) -> List[str]:
+    """Goals from a JSON list or a text file with one goal per line."""
+    with open(path, "r") as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+    return [line for line in content.splitlines() if line.strip() and not line.startswith("#")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many goals through one agent topology")
+    parser.add_argument("goals", help="File with one goal per line, or a JSON list")
+    parser.add_argument("--topology", default=LOOP_TOPOLOGY)
+    parser.add_argument("--mode", choices=("groupchat", "parallel"), default=None)
+    parser.add_argument("--parallelism", type=int, default=BATCH_PARALLELISM)
+    args = parser.parse_args()
+
+    batch = Batch(read_goals(args.goals), args.topology, args.mode, args.parallelism)
+    print(f"Running {len(batch.goals)} goals on {batch.parallelism} lanes ({batch.topology}, {batch.mode})")
+    report = batch.run()
+    for result in report["results"]:
+        outcome = "ok" if result["status"] == "ok" else f"error: {result['error']}"
+        print(f"  [{result['seconds']:7.1f}s] {result['goal'][:60]} - {outcome}")
+    print(f"Warm-up {report['warmup_seconds']}s, batch {report['elapsed_seconds']}s "
+          f"vs {report['sequential_seconds']}s sequential ({report['speedup']}x)")
+    print(f"Results written to {batch.path}")
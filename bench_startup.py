@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for Agent Village
+This script measures cold import time of the entry points and the latency of
+the first request, so startup regressions show up before they reach workers.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+from datetime import datetime
+
+# Each probe runs in a fresh interpreter so module caches never hide the cost
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_REQUEST_PROBE = """
+import time
+start = time.perf_counter()
+import agent_village
+client = agent_village.app.test_client()
+client.get("/test")
+print(time.perf_counter() - start)
+"""
+
+FIRST_DISCUSSION_PROBE = """
+import time
+import agent_village
+start = time.perf_counter()
+agent_village.get_chat_stack()
+print(time.perf_counter() - start)
+"""
+
+def run_probe(code, runs):
+    """Run a probe snippet in fresh interpreters and return the timings."""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+def summarize(timings):
+    """Summarize timings in milliseconds."""
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "min_ms": round(min(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1)
+    }
+
+def main():
+    """Main benchmark function."""
+    parser = argparse.ArgumentParser(description="Measure Agent Village startup latency")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per probe")
+    parser.add_argument("--output", help="append results as a JSON line to this file")
+    args = parser.parse_args()
+
+    probes = {
+        "import agent_village": IMPORT_PROBE.format(module="agent_village"),
+        "import agents": IMPORT_PROBE.format(module="agents"),
+        "first request (/test)": FIRST_REQUEST_PROBE
+    }
+    # Building the LLM stack needs a key, so only measure it when one is set
+    if os.getenv("GOOGLE_API_KEY"):
+        probes["first discussion stack"] = FIRST_DISCUSSION_PROBE
+
+    results = {}
+    print("Agent Village Startup Benchmark\n")
+    for name, code in probes.items():
+        try:
+            results[name] = summarize(run_probe(code, args.runs))
+            stats = results[name]
+            print(f"  {name:<26} median {stats['median_ms']:>8} ms  "
+                  f"(min {stats['min_ms']}, max {stats['max_ms']})")
+        except Exception as e:
+            results[name] = {"error": str(e)}
+            print(f"  {name:<26} failed: {e}")
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps({
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "runs": args.runs,
+                "results": results
+            }) + "\n")
+        print(f"\nResults appended to {args.output}")
+
+if __name__ == "__main__":
+    main()
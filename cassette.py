@@ -0,0 +1,377 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import CASSETTE_DIR, TOPOLOGY_FILE, GOALS_FILE, STRATEGY_FILE, SCRATCHPAD_DIR, RETRIEVAL_DIR
+from llm_calls import add_middleware, remove_middleware
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+# What a replay's working directory is seeded with, so agents get the same context as live ones
+REPLAY_INPUTS = (TOPOLOGY_FILE, GOALS_FILE, STRATEGY_FILE, "current_strategy.txt", SCRATCHPAD_DIR, RETRIEVAL_DIR)
+
+# How autogen reports a code execution to the chat
+CODE_RESULT = re.compile(r"exitcode: (-?\d+) \(.*?\)\nCode output: (.*)", re.DOTALL)
+
+class ReplayError(Exception):
+    """A replay that ran out of recorded calls, or diverged from the recording in strict mode."""
+
+def message_key(message) -> str:
+    return hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def tool_call_key(name: str, arguments) -> Tuple[str, str]:
+    """Identify a tool call by its name and arguments, whether given as JSON or parsed."""
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except ValueError:
+            return name, arguments
+    return name, json.dumps(arguments, sort_keys=True, default=str)
+
+def default_path() -> str:
+    return os.path.join(CASSETTE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.jsonl.gz")
+
+class Recorder:
+    """Records every LLM call a discussion's agents make into a cassette file.
+
+    A cassette is gzip-compressed JSON lines: a header describing the
+    discussion, each distinct message once, and one line per call with the
+    ids of its request messages, the response and its timing. Group chats
+    attached to the recorder also save their speaker order on close, so a
+    replay can follow it without asking the LLM.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_path()
+        self.lock = threading.Lock()
+        self.file = None
+        self.agents = set()
+        self.message_ids: Dict[str, int] = {}
+        self.groupchats = []
+        self.started = None
+        self.calls = 0
+
+    def _write(self, record: Dict):
+        self.file.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+
+    def _message_id(self, message: Dict) -> int:
+        key = message_key(message)
+        if key not in self.message_ids:
+            self.message_ids[key] = len(self.message_ids)
+            self._write({"type": "message", "id": self.message_ids[key], "message": message})
+        return self.message_ids[key]
+
+    def start(self, agents: Iterable, **header):
+        """Begin recording the calls of these agents; header describes how to re-run the discussion."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.agents = {agent.name for agent in agents}
+        self.started = time.time()
+        self._write({"type": "header", "version": CASSETTE_VERSION,
+                     "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **header})
+        add_middleware(self.middleware)
+
+    def attach(self, groupchat):
+        self.groupchats.append(groupchat)
+
+    def middleware(self, call, proceed):
+        name = getattr(call.agent, "name", None)
+        if name not in self.agents:
+            return proceed()
+        with self.lock:
+            if self.file is None:
+                return proceed()
+            request = [self._message_id(message) for message in call.messages or []]
+        started = time.time()
+        record = {"type": "call", "agent": name, "sender": getattr(call.sender, "name", None),
+                  "request": request, "offset": round(started - self.started, 4)}
+        try:
+            result = proceed()
+            record["response"] = list(result)
+            return result
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["duration"] = round(time.time() - started, 4)
+            with self.lock:
+                if self.file is not None:
+                    self._write(record)
+                    self.calls += 1
+
+    def close(self):
+        remove_middleware(self.middleware)
+        with self.lock:
+            if self.file is None:
+                return
+            for groupchat in self.groupchats:
+                self._write({"type": "speakers", "names": [m.get("name") for m in groupchat.messages]})
+            self._write({"type": "end", "calls": self.calls, "elapsed": round(time.time() - self.started, 4)})
+            self.file.close()
+            self.file = None
+        logger.info(f"Recorded {self.calls} LLM calls to {self.path}")
+
+class Replayer:
+    """Answers LLM calls from a cassette instead of the API.
+
+    Each agent gets its recorded responses in the order it made them, so
+    concurrent (parallel mode) calls replay correctly. speed is "full"
+    (answer immediately) or "recorded" (wait as long as the original call
+    took). A request that differs from the recorded one is counted as a
+    divergence, or raises ReplayError when strict.
+
+    Tool calls and generated code are not run either: they return what
+    they returned in the recording, found in the messages sent after them.
+    """
+
+    def __init__(self, path: str, speed: str = "full", strict: bool = False):
+        if speed not in ("full", "recorded"):
+            raise ValueError(f"Unknown replay speed: {speed}")
+        self.path = path
+        self.speed = speed
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.header = {}
+        self.message_keys: Dict[int, str] = {}
+        self.calls: Dict[str, deque] = {}
+        self.speakers: List[List[str]] = []
+        self.tool_results: Dict[Tuple[str, str], deque] = {}
+        self.code_results: deque = deque()
+        self.agents = set()
+        self.function_maps = {}
+        self.code_executors = {}
+        self.stubbed = 0
+        self.replayed = 0
+        self.divergences = 0
+        self.llm_seconds = 0.0
+        self._load()
+
+    def _load(self):
+        outputs = {}
+        tool_calls = []
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["type"] == "header":
+                    self.header = record
+                elif record["type"] == "message":
+                    message = record["message"]
+                    self.message_keys[record["id"]] = message_key(message)
+                    for response in message.get("tool_responses") or ([message] if "tool_call_id" in message else []):
+                        outputs[response["tool_call_id"]] = response.get("content")
+                    if isinstance(message.get("content"), str) and (match := CODE_RESULT.match(message["content"])):
+                        self.code_results.append((int(match.group(1)), match.group(2)))
+                elif record["type"] == "call":
+                    self.calls.setdefault(record["agent"], deque()).append(record)
+                    reply = record.get("response", [None, None])[1]
+                    if isinstance(reply, dict):
+                        tool_calls.extend(reply.get("tool_calls") or [])
+                elif record["type"] == "speakers":
+                    self.speakers.append(record["names"])
+        for call in tool_calls:
+            if call.get("id") in outputs:
+                key = tool_call_key(call["function"]["name"], call["function"].get("arguments", "{}"))
+                self.tool_results.setdefault(key, deque()).append(outputs[call["id"]])
+
+    def start(self, agents: Iterable, **header):
+        agents = list(agents)
+        self.agents = {agent.name for agent in agents}
+        for agent in agents:
+            if agent.function_map:
+                self.function_maps[agent] = dict(agent.function_map)
+                agent.register_function({name: self._recorded_tool(name) for name in agent.function_map},
+                                        silent_override=True)
+            if getattr(agent, "_code_executor", None) is not None:
+                self.code_executors[agent] = agent._code_executor
+                agent._code_executor = RecordedCodeExecutor(self, agent._code_executor.code_extractor)
+        add_middleware(self.middleware)
+
+    def _recorded_tool(self, name: str):
+        def call(**kwargs):
+            with self.lock:
+                self.stubbed += 1
+                queue = self.tool_results.get(tool_call_key(name, kwargs))
+                if queue:
+                    return queue.popleft()
+            logger.warning(f"No recorded result for a call to {name}; it was not run")
+            return f"{name} was not run: the recording has no result for this call"
+        return call
+
+    def recorded_code_result(self) -> Tuple[int, str]:
+        with self.lock:
+            self.stubbed += 1
+            if self.code_results:
+                return self.code_results.popleft()
+        logger.warning("No recorded code execution left; the code was not run")
+        return 1, "The code was not run: the recording has no result for it"
+
+    def attach(self, groupchat):
+        """Make the group chat pick speakers in the recorded order."""
+        if not self.speakers:
+            return
+        names = self.speakers.pop(0)
+
+        def select_speaker(last_speaker, groupchat):
+            turn = len(groupchat.messages)
+            # None ends the chat where the recording ended
+            return groupchat.agent_by_name(names[turn]) if turn < len(names) else None
+
+        groupchat.speaker_selection_method = select_speaker
+
+    def middleware(self, call, proceed):
+        name = getattr(call.agent, "name", None)
+        if name not in self.agents:
+            return proceed()
+        with self.lock:
+            queue = self.calls.get(name)
+            if not queue:
+                raise ReplayError(f"No recorded LLM call left for {name}")
+            record = queue.popleft()
+        request = [message_key(message) for message in call.messages or []]
+        if request != [self.message_keys.get(i) for i in record["request"]]:
+            if self.strict:
+                raise ReplayError(f"Call {self.replayed} by {name} differs from the recording")
+            logger.warning(f"Call {self.replayed} by {name} differs from the recording")
+            with self.lock:
+                self.divergences += 1
+        if self.speed == "recorded":
+            time.sleep(record["duration"])
+        with self.lock:
+            self.replayed += 1
+            self.llm_seconds += record["duration"]
+        if "error" in record:
+            raise ReplayError(f"Recorded call failed: {record['error']}")
+        return tuple(record["response"])
+
+    def close(self):
+        remove_middleware(self.middleware)
+        for agent, function_map in self.function_maps.items():
+            agent.register_function(function_map, silent_override=True)
+        for agent, executor in self.code_executors.items():
+            agent._code_executor = executor
+        self.function_maps, self.code_executors = {}, {}
+
+    def report(self) -> Dict:
+        return {
+            "replayed": self.replayed,
+            "tool_calls_answered": self.stubbed,
+            "unused": sum(len(queue) for queue in self.calls.values()),
+            "divergences": self.divergences,
+            "recorded_llm_seconds": round(self.llm_seconds, 4)
+        }
+
+class RecordedCodeExecutor:
+    """autogen code executor that answers with the recording's code results instead of running code."""
+
+    def __init__(self, replayer: Replayer, code_extractor):
+        self.replayer = replayer
+        self._code_extractor = code_extractor
+
+    @property
+    def code_extractor(self):
+        return self._code_extractor
+
+    def execute_code_blocks(self, code_blocks):
+        from autogen.coding import CodeResult
+        exit_code, output = self.replayer.recorded_code_result()
+        return CodeResult(exit_code=exit_code, output=output)
+
+    def restart(self):
+        pass
+
+def replay(path: str, speed: str = "full", strict: bool = False, workdir: Optional[str] = None) -> Dict:
+    """Re-run the recorded discussion through its original pipeline, offline.
+
+    The discussion runs in workdir (a temporary directory, removed afterwards,
+    unless given), seeded with copies of REPLAY_INPUTS, so its checkpoints,
+    logs, usage and notes stay out of the real ones. This changes the
+    process's working directory while it runs: replay from the command line,
+    not from a server.
+    """
+    from topology import topology_store
+    replayer = Replayer(path, speed, strict)
+    header = replayer.header
+    # Agents need an API key to be built, even though no call reaches the API
+    for definition in topology_store.get(header["topology"]).models.values():
+        os.environ.setdefault(definition["api_key_env"], "offline-replay")
+    if header["pipeline"] == "agents":
+        from agents import AgentVillage
+    else:
+        from agent_village import start_discussion
+
+    root = os.getcwd()
+    scratch = os.path.abspath(workdir) if workdir else tempfile.mkdtemp(prefix="replay_")
+    os.makedirs(scratch, exist_ok=True)
+    for name in REPLAY_INPUTS:
+        source = os.path.join(root, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(scratch, name), dirs_exist_ok=True)
+        elif os.path.isfile(source):
+            shutil.copy2(source, os.path.join(scratch, name))
+    os.chdir(scratch)
+    try:
+        started = time.perf_counter()
+        if header["pipeline"] == "agents":
+            AgentVillage(header["topology"]).run_session(header["topic"], mode=header["mode"], cassette=replayer)
+            result = None
+        else:
+            result = start_discussion(header["topic"], header["mode"], header["topology"], cassette=replayer)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(root)
+        if not workdir:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = replayer.report()
+    report["elapsed_seconds"] = round(elapsed, 4)
+    # What the pipeline itself cost, with the LLM's share taken out
+    report["orchestration_seconds"] = round(elapsed - (report["recorded_llm_seconds"] if speed == "recorded" else 0), 4)
+    if result is not None:
+        report["result"] = result
+    if workdir:
+        report["workdir"] = scratch
+    return report
+
+def info(path: str) -> Dict:
+    """Summarize a cassette: what was recorded and how long the calls took."""
+    replayer = Replayer(path)
+    calls = [record for queue in replayer.calls.values() for record in queue]
+    return {
+        "header": replayer.header,
+        "calls": len(calls),
+        "calls_by_agent": {name: len(queue) for name, queue in replayer.calls.items()},
+        "messages": len(replayer.message_keys),
+        "llm_seconds": round(sum(record["duration"] for record in calls), 4),
+        "errors": sum(1 for record in calls if "error" in record)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay a recorded discussion")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subcommands.add_parser("replay", help="Re-run a recorded discussion without API calls")
+    replay_parser.add_argument("cassette")
+    replay_parser.add_argument("--speed", choices=("full", "recorded"), default="full")
+    replay_parser.add_argument("--strict", action="store_true", help="Stop at the first request that differs")
+    replay_parser.add_argument("--workdir", help="Run in (and keep) this directory instead of a temporary one")
+    info_parser = subcommands.add_parser("info", help="Summarize a cassette")
+    info_parser.add_argument("cassette")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.command == "replay":
+        print(json.dumps(replay(args.cassette, args.speed, args.strict, args.workdir), indent=2, default=str))
+    else:
+        print(json.dumps(info(args.cassette), indent=2))
@@ -0,0 +1,180 @@
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import CHECKPOINT_DIR
+
+class Checkpoint:
+    """Append-only record of a discussion, written one completed turn at a time.
+
+    The file is JSON lines: a "start" record with the discussion metadata,
+    one "turn" record per message an agent sends and an "end" record once
+    the discussion finishes. A file without an "end" record can be resumed.
+    """
+
+    def __init__(self, discussion_id: str):
+        self.discussion_id = discussion_id
+        self.path = os.path.join(CHECKPOINT_DIR, f"{discussion_id}.jsonl")
+        self.persisted = 0
+        # Turns seen since this object was created; on resume the saved turns
+        # are replayed first and must not be written twice
+        self.seen = 0
+        self.lock = threading.Lock()
+        # Takes (checkpoint, record) for each turn instead of writing it here;
+        # the async runtime queues turns for write_turns() off the event loop
+        self.defer = None
+
+    def _write(self, *records: dict):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, **metadata):
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        self._write({
+            "type": "start",
+            "discussion": self.discussion_id,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **metadata
+        })
+
+    def record_turn(self, message: dict):
+        """Persist one message unless it is a replay of a turn that is already saved."""
+        with self.lock:
+            self.seen += 1
+            if self.seen <= self.persisted:
+                return
+            record = {"type": "turn", "index": self.persisted, "message": message}
+            if self.defer is not None:
+                self.defer((self, record))
+            else:
+                self._write(record)
+            self.persisted += 1
+
+    def record_reply(self, name: str, content: str):
+        """Persist a single agent reply (used by parallel rounds)."""
+        self.record_turn({"role": "user", "name": name, "content": content})
+
+    def finish(self, status: str = "completed"):
+        self._write({"type": "end", "status": status,
+                     "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+        # A process still waiting on the claim sees the end record and leaves it
+        try:
+            os.remove(_claim_path(self.discussion_id))
+        except FileNotFoundError:
+            pass
+
+    def attach(self, agents):
+        """Checkpoint every message these agents send until detach() is called."""
+        for agent in agents:
+            if _record_send not in agent.hook_lists["process_message_before_send"]:
+                agent.register_hook("process_message_before_send", _record_send)
+            _active[agent] = self
+
+    def detach(self, agents):
+        for agent in agents:
+            if _active.get(agent) is self:
+                del _active[agent]
+
+# Agents currently being checkpointed, mapped to their checkpoint. The send
+# hook is registered once per agent and routes to whichever checkpoint is active.
+_active: Dict = {}
+
+def _record_send(sender, message, recipient, silent):
+    checkpoint = _active.get(sender)
+    if checkpoint is not None:
+        turn = {"content": message} if isinstance(message, str) else dict(message)
+        turn.setdefault("role", "user")
+        turn["name"] = sender.name
+        checkpoint.record_turn(turn)
+    return message
+
+class DiscussionClaimed(Exception):
+    """Another process is running the discussion."""
+
+def _claim_path(discussion_id: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{discussion_id}.lock")
+
+class Claim:
+    """An exclusive claim on a discussion, held by the process running it.
+
+    The claim is an flock on a file next to the checkpoint, so it ends with
+    the process even if that crashes; a process resuming unfinished
+    discussions skips the ones a live process still holds.
+    """
+
+    def __init__(self, discussion_id: str):
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        self.file = open(_claim_path(discussion_id), "a")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise DiscussionClaimed(f"Discussion {discussion_id} is being run by another process")
+
+    def release(self):
+        if not self.file.closed:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+def write_turns(items: List[Tuple[Checkpoint, dict]]):
+    """Write deferred turn records in order, with one fsync per checkpoint."""
+    by_checkpoint: Dict[Checkpoint, List[dict]] = {}
+    for checkpoint, record in items:
+        by_checkpoint.setdefault(checkpoint, []).append(record)
+    for checkpoint, records in by_checkpoint.items():
+        checkpoint._write(*records)
+
+def load(discussion_id: str) -> Tuple[Dict, List[dict], Optional[dict]]:
+    """Return a checkpoint's metadata, its turns and its end record (None if unfinished)."""
+    path = os.path.join(CHECKPOINT_DIR, f"{discussion_id}.jsonl")
+    metadata, turns, end = {}, [], None
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-write
+                continue
+            if record["type"] == "start":
+                metadata = record
+            elif record["type"] == "turn":
+                turns.append(record["message"])
+            elif record["type"] == "end":
+                end = record
+    return metadata, turns, end
+
+def resume_from(discussion_id: str) -> Checkpoint:
+    """Reopen an unfinished checkpoint so new turns are appended after the saved ones."""
+    checkpoint = Checkpoint(discussion_id)
+    # Drop a torn last line so new records start on a clean line
+    with open(checkpoint.path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    _, turns, _ = load(discussion_id)
+    checkpoint.persisted = len(turns)
+    return checkpoint
+
+def find_incomplete(source: Optional[str] = None) -> List[Dict]:
+    """List unfinished discussions, oldest first, optionally only those from one entry point."""
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return []
+    incomplete = []
+    for filename in sorted(os.listdir(CHECKPOINT_DIR)):
+        if not filename.endswith(".jsonl"):
+            continue
+        metadata, turns, end = load(filename[:-len(".jsonl")])
+        if end is None and metadata and (source is None or metadata.get("source") == source):
+            incomplete.append({**metadata, "turns": len(turns)})
+    return incomplete
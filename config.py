@@ -4,56 +4,207 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Agent definitions with their system messages
-AGENT_DEFS = [
-    {
-        "name": "Explorer",
-        "message": """You are the Explorer agent. Your role is to generate bold, unconventional strategies and ideas.
-        Think outside the box and don't be afraid to suggest radical approaches.
-        Focus on innovation and novel solutions that others might not consider."""
-    },
-    {
-        "name": "Critic",
-        "message": """You are the Critic agent. Your role is to find flaws and potential issues in all proposals.
-        Be thorough and analytical in your criticism, but maintain a constructive tone.
-        Focus on identifying risks, edge cases, and potential failure points."""
-    },
-    {
-        "name": "Synthesizer",
-        "message": """You are the Synthesizer agent. Your role is to merge and polish ideas into clear, actionable concepts.
-        Take the best elements from different proposals and combine them into coherent strategies.
-        Ensure the final output is practical and well-structured."""
-    },
-    {
-        "name": "Refiner",
-        "message": """You are the Refiner agent. Your role is to update the strategy document based on the best insights.
-        Write clear, concise, and actionable content that builds upon the group's discussion.
-        Focus on creating a living document that evolves with each iteration."""
-    }
-]
-
-# Model configurations
-MODELS = {
-    "openai": {
-        "temperature": 0.7,
-        "model": "gpt-4o",
-        "api_key": os.getenv("OPENAI_API_KEY")
-    },
-    "gemini": {
-        "temperature": 0.7,
-        "model": "gemini-2.5-pro",  # Latest Gemini model
-        "api_key": os.getenv("GOOGLE_API_KEY")
-    }
-}
-
-# Default model to use
-DEFAULT_MODEL = "gemini"  # Change this to "openai" to use OpenAI
+# Agent topologies (agents, models, tools, speaker order, limits) are declared
+# in TOPOLOGY_FILE and reloaded when it changes. The web dashboard and the
+# agents.py loop each run a named topology.
+TOPOLOGY_FILE = "topologies.json"
+WEB_TOPOLOGY = os.getenv("WEB_TOPOLOGY", "village")
+LOOP_TOPOLOGY = os.getenv("LOOP_TOPOLOGY", "explorer")
 
 # File paths
 GOALS_FILE = "goals.txt"
 STRATEGY_FILE = "strategy.txt"
 CHAT_LOGS_DIR = "chat_logs"
 SCRATCHPAD_DIR = "scratchpad"
+USAGE_LOG_FILE = "usage_log.jsonl"
+CHECKPOINT_DIR = "checkpoints"
 
 # Loop configuration
-LOOP_INTERVAL = 60  # seconds between iterations 
\ No newline at end of file
+LOOP_INTERVAL = 60  # seconds between iterations
+# The interval adapts (scheduler.py): each session in a row that leaves the
+# strategy unchanged multiplies it by LOOP_IDLE_FACTOR, failed sessions back
+# off exponentially from LOOP_ERROR_BACKOFF, and a change to the goals starts
+# the next session within LOOP_MIN_INTERVAL
+LOOP_MIN_INTERVAL = 10
+LOOP_MAX_INTERVAL = 3600
+LOOP_IDLE_FACTOR = 2
+LOOP_ERROR_BACKOFF = 30
+LOOP_GOAL_POLL_INTERVAL = 5  # seconds between checks of goals.txt while waiting
+LOOP_STATUS_DIR = "loop_status"  # each loop process writes its schedule to <pid>.json
+# A status file not updated for this long is left by a loop that died without
+# removing it; it is ignored even if its PID now belongs to another process.
+# Keep it well above LOOP_MAX_INTERVAL + HEALTH_LOOP_STALL so stalls still show
+LOOP_STATUS_MAX_AGE = 86400
+
+# Discussion mode: "groupchat" (agents take turns) or "parallel" (the
+# topology's parallel agents answer concurrently and its synthesizer merges them)
+DISCUSSION_MODE = os.getenv("DISCUSSION_MODE", "groupchat")
+PARALLEL_MAX_WORKERS = int(os.getenv("PARALLEL_MAX_WORKERS", "4"))  # concurrent LLM calls 
+
+# Supervisor configuration (start_system.py)
+AGENT_REPLICAS = int(os.getenv("AGENT_REPLICAS", "1"))  # agent loop processes to run
+SUPERVISOR_LOG_DIR = "logs"
+SUPERVISOR_LOG_MAX_BYTES = 5 * 1024 * 1024  # rotate child logs at 5 MB
+SUPERVISOR_LOG_BACKUPS = 5
+SUPERVISOR_CHECK_INTERVAL = 2  # seconds between liveness checks
+SUPERVISOR_HEALTH_GRACE = 10  # seconds after start before health URLs are probed
+RESTART_BACKOFF_INITIAL = 1  # seconds before the first restart
+RESTART_BACKOFF_MAX = 60
+RESTART_STABLE_AFTER = 30  # seconds of uptime that reset the backoff
+SHUTDOWN_TIMEOUT = 10  # seconds to wait for children before killing them
+
+# Usage budgets (0 disables a limit). When one is exceeded the discussion is
+# stopped, or with BUDGET_ACTION = "downgrade" its agents switch to DOWNGRADE_MODEL
+# (a model of the topology file) until the discussion ends
+BUDGETS = {
+    "discussion_tokens": int(os.getenv("BUDGET_DISCUSSION_TOKENS", "200000")),
+    "goal_tokens": int(os.getenv("BUDGET_GOAL_TOKENS", "0")),
+    "daily_tokens": int(os.getenv("BUDGET_DAILY_TOKENS", "2000000")),
+    "daily_cost": float(os.getenv("BUDGET_DAILY_COST", "0"))
+}
+BUDGET_ACTION = os.getenv("BUDGET_ACTION", "stop")
+DOWNGRADE_MODEL = "gemini-flash"
+
+# Conversation history: each agent sends its last "window" messages verbatim
+# plus a rolling summary of older ones capped at "summary_chars" characters
+HISTORY_WINDOWS = {
+    "default": {"window": 8, "summary_chars": 2000},
+    "Critic": {"window": 4, "summary_chars": 1500},
+    "Researcher": {"window": 4, "summary_chars": 1500}
+}
+HISTORY_SUMMARIZER = os.getenv("HISTORY_SUMMARIZER", "extractive")  # or "llm"
+
+# Scratchpad: notes whose similarity fingerprints differ in at most this many
+# bits (0-7), or that share this share of their word shingles, count as the
+# same idea; agents are shown the top N distinct ideas
+SCRATCHPAD_NEAR_DUPLICATE_BITS = 7
+SCRATCHPAD_NEAR_DUPLICATE_JACCARD = 0.5
+SCRATCHPAD_TOP_IDEAS = 5
+
+# Retrieval over past discussions, strategy revisions and scratchpad notes.
+# RETRIEVAL_EMBEDDER is "auto" (sentence-transformers if installed, else
+# hashing), "sentence-transformers" or "hashing"
+RETRIEVAL_DIR = "retrieval_index"
+RETRIEVAL_EMBEDDER = os.getenv("RETRIEVAL_EMBEDDER", "auto")
+RETRIEVAL_TOP_K = 5
+RETRIEVAL_CONTEXT_CHARS = 2000
+
+# Job queue: discussions queued through /jobs or cron schedules and run by
+# worker processes ("python agents.py --worker"); the supervisor starts JOB_WORKERS of them
+JOB_DB_FILE = "jobs.db"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))
+JOB_POLL_INTERVAL = 5  # seconds an idle worker waits before polling again
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF = 60  # seconds before the first retry, doubled on each further attempt
+JOB_LEASE_SECONDS = 300  # a running job whose worker stops renewing its lease this long is retried
+JOB_HEARTBEAT_INTERVAL = 60  # seconds between lease renewals
+
+# Structured log behind the /logs query API: one JSON line per entry. An
+# empty store starts with the entries of the plain-text LOG_TEXT_FILE
+LOG_STORE_FILE = "agent_logs.jsonl"
+LOG_TEXT_FILE = "agent_logs.txt"
+LOGS_PAGE_SIZE = 100
+LOGS_MAX_PAGE_SIZE = 1000
+LOGS_SCAN_LIMIT = 20000  # entries a text search examines per request before returning a cursor
+
+# WebSocket streaming (/ws). Clients are pinged every WS_PING_INTERVAL seconds
+# and dropped if they miss a pong; v2 frames batch entries queued within WS_BATCH_DELAY
+WS_PING_INTERVAL = 20
+WS_BATCH_DELAY = 0.05
+WS_BATCH_MAX = 200  # entries per batch frame
+WS_QUEUE_MAX = 5000  # entries a client may fall behind before it is disconnected
+WS_RESUME_MAX = 1000  # missed entries replayed on reconnect; beyond this the client reloads
+
+# Tool execution: agent tool calls and generated code run in a warm pool of
+# worker processes, each limited to TOOL_MEMORY_LIMIT bytes of address space
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL_SIZE", "2"))  # idle workers kept warm
+TOOL_MAX_CONCURRENCY = 4  # calls running at once; further calls wait up to TOOL_QUEUE_TIMEOUT seconds
+TOOL_QUEUE_TIMEOUT = 30
+TOOL_TIMEOUT = 60  # seconds per call before its worker is killed
+TOOL_MEMORY_LIMIT = 1024 * 1024 * 1024
+TOOL_WORKER_MAX_CALLS = 100  # calls before a worker is replaced
+TOOL_WORK_DIR = "tool_workspace"  # working directory for generated code
+
+# Cassettes: recordings of a discussion's LLM calls that "python cassette.py
+# replay" re-runs offline. CASSETTE_RECORD=1 records every discussion
+CASSETTE_DIR = "cassettes"
+CASSETTE_RECORD = os.getenv("CASSETTE_RECORD", "0") == "1"
+
+# Profiling. PROFILE_ENABLED traces and samples every request; otherwise a
+# single request is profiled with ?profile=1 or an "X-Profile: 1" header.
+# Spans are appended to PROFILE_TRACE_FILE as OTLP/JSON; /debug/profile
+# serves the stack samples as collapsed stacks for flame graphs
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+PROFILE_TRACE_FILE = "traces.jsonl"
+PROFILE_SERVICE_NAME = "agent_village"
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_MAX_SECONDS = 60  # longest on-demand profile /debug/profile will take
+
+# Admission control for discussions started in one process. At most
+# ADMISSION_MAX_ACTIVE run at once (never two on the same topology) and while
+# fewer than ADMISSION_MAX_INFLIGHT_LLM calls are outstanding; up to
+# ADMISSION_MAX_QUEUE more wait for a slot. New discussions are shed with a
+# Retry-After hint while the queue is full or more than ADMISSION_MAX_RATE_LIMITED
+# of the LLM calls in the last ADMISSION_RATE_LIMIT_WINDOW seconds got 429s
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "2"))
+ADMISSION_MAX_QUEUE = 8
+ADMISSION_QUEUE_TIMEOUT = 300  # seconds a queued discussion waits before it is shed
+ADMISSION_MAX_INFLIGHT_LLM = 8
+ADMISSION_RATE_LIMIT_WINDOW = 60
+ADMISSION_MAX_RATE_LIMITED = 0.2
+
+# Batch runs (batch.py, POST /batches): goals share one topology, run on
+# BATCH_PARALLELISM lanes that each build their agents once. Each goal takes
+# an admission slot, so a batch has at most ADMISSION_MAX_ACTIVE lanes
+BATCH_DIR = "batch_results"
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+BATCH_MAX_GOALS = 200
+BATCH_MAX_RETRIES = 3  # times a goal shed for rate limiting is retried
+
+# Speculative prefetch for round-robin group chats: while one agent waits for
+# its LLM, the next agent's history summary is prepared and its connection
+# kept open. PREFETCH_PRIME_CACHE also sends the next request's prefix with a
+# one-token limit to warm the provider's prompt cache (costs the prompt tokens)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_PRIME_CACHE = os.getenv("PREFETCH_PRIME_CACHE", "0") == "1"
+PREFETCH_PRIME_MIN_CHARS = 4000  # shorter prompts are below the providers' caching minimum
+PREFETCH_KEEPALIVE_INTERVAL = 4  # seconds; clients close idle connections after 5
+PREFETCH_KEEPALIVE_MAX = 120
+
+# In-memory message store: the newest log entries, for reconnecting clients.
+# Older entries are read from LOG_STORE_FILE; whichever cap is hit first applies
+MESSAGE_STORE_MAX_MESSAGES = int(os.getenv("MESSAGE_STORE_MAX_MESSAGES", "5000"))
+MESSAGE_STORE_MAX_BYTES = int(os.getenv("MESSAGE_STORE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Columnar archives (archive.py, needs pyarrow): discussions, turns and LLM
+# calls exported to Parquet or Arrow IPC, ARCHIVE_BATCH_ROWS rows at a time
+ARCHIVE_DIR = "exports"
+ARCHIVE_BATCH_ROWS = 10000
+ARCHIVE_COMPRESSION = "zstd"
+
+# Health checks (/health, /ready, /status in agent_village.py and server.py).
+# Providers are probed with a model listing at most every HEALTH_PROVIDER_TTL
+# seconds; an agents.py loop overdue by HEALTH_LOOP_STALL seconds is stalled
+HEALTH_PROVIDER_TTL = 60
+HEALTH_PROVIDER_TIMEOUT = 5
+HEALTH_DISK_TTL = 60
+HEALTH_MIN_FREE_BYTES = 512 * 1024 * 1024
+HEALTH_LOOP_STALL = 1800
+
+# Async runtime (async_runtime.py): discussions run as coroutines on one event
+# loop (/start_discussion with "async": true, or ASYNC_DISCUSSIONS=1). Their
+# blocking work (LLM HTTP calls, tool calls, file writes) shares ASYNC_IO_WORKERS
+# threads, so threads grow with in-flight calls rather than with discussions.
+# They show in /admission and /ready and, like other discussions, only start
+# while fewer than ADMISSION_MAX_INFLIGHT_LLM calls are outstanding
+ASYNC_DISCUSSIONS = os.getenv("ASYNC_DISCUSSIONS", "0") == "1"
+ASYNC_IO_WORKERS = int(os.getenv("ASYNC_IO_WORKERS", "32"))
+ASYNC_MAX_DISCUSSIONS = int(os.getenv("ASYNC_MAX_DISCUSSIONS", "200"))
+ASYNC_MAX_QUEUE = 200
+ASYNC_WRITE_BATCH = 500  # log entries or checkpoint turns per write
+ASYNC_AGENT_POOL_MAX = 50  # idle agent sets kept per topology
+ASYNC_RESULT_TTL = 3600  # seconds a finished background discussion stays at /discussions/<id>
+# Optional WebSocket server on the event loop (needs `pip install websockets`),
+# speaking /ws protocol v2 without a thread per connection; 0 disables it
+ASYNC_WS_HOST = "0.0.0.0"
+ASYNC_WS_PORT = int(os.getenv("ASYNC_WS_PORT", "0"))
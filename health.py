@@ -0,0 +1,185 @@
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import (HEALTH_PROVIDER_TTL, HEALTH_PROVIDER_TIMEOUT, HEALTH_DISK_TTL, HEALTH_MIN_FREE_BYTES,
+                    HEALTH_LOOP_STALL, CHAT_LOGS_DIR, CHECKPOINT_DIR, SUPERVISOR_LOG_DIR, CASSETTE_DIR,
+                    ARCHIVE_DIR, BATCH_DIR, LOG_STORE_FILE, USAGE_LOG_FILE, PROFILE_TRACE_FILE)
+
+STARTED = time.time()
+
+# What the log and history directories hold, reported in the status
+DISK_PATHS = (CHAT_LOGS_DIR, CHECKPOINT_DIR, SUPERVISOR_LOG_DIR, CASSETTE_DIR, ARCHIVE_DIR, BATCH_DIR,
+              LOG_STORE_FILE, USAGE_LOG_FILE, PROFILE_TRACE_FILE, "agent_logs.txt")
+
+def _probe_request(definition: Dict) -> Optional[urllib.request.Request]:
+    """A request listing the provider's models: answered without generating anything."""
+    api_key = os.getenv(definition["api_key_env"], "")
+    if definition.get("api_type") == "google":
+        base_url = definition.get("base_url", "https://generativelanguage.googleapis.com/v1beta")
+        return urllib.request.Request(f"{base_url.rstrip('/')}/models?pageSize=1",
+                                      headers={"x-goog-api-key": api_key})
+    if definition.get("api_type", "openai") == "openai":
+        base_url = definition.get("base_url", "https://api.openai.com/v1")
+        return urllib.request.Request(f"{base_url.rstrip('/')}/models",
+                                      headers={"Authorization": f"Bearer {api_key}"})
+    return None
+
+def probe_provider(definition: Dict, timeout: float = HEALTH_PROVIDER_TIMEOUT) -> Dict:
+    """Check that a model's provider answers and accepts its API key."""
+    result = {"ok": False, "checked": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    if not os.getenv(definition["api_key_env"]):
+        return {**result, "error": f"{definition['api_key_env']} is not set"}
+    request = _probe_request(definition)
+    if request is None:
+        return {**result, "ok": None, "error": f"No check for api_type {definition['api_type']}"}
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout):
+            result["ok"] = True
+    except urllib.error.HTTPError as e:
+        # Reachable, but the key or the endpoint is wrong
+        result["error"] = f"HTTP {e.code}"
+    except (urllib.error.URLError, OSError) as e:
+        result["error"] = str(getattr(e, "reason", e))
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+class ProviderHealth:
+    """Reachability of every LLM provider the topologies use, cached for HEALTH_PROVIDER_TTL.
+
+    Each provider (api type, endpoint and key) is probed with a model
+    listing, which costs no tokens. Probes of a stale entry run on one
+    thread at a time; meanwhile other callers get the previous result.
+    """
+
+    def __init__(self, ttl: float = HEALTH_PROVIDER_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results: Dict[tuple, Dict] = {}
+        self.checked: Dict[tuple, float] = {}
+        self.refreshing = set()
+
+    def _providers(self) -> Dict[tuple, Dict]:
+        from topology import topology_store
+        providers = {}
+        for name in topology_store.names():
+            topology = topology_store.get(name)
+            for agent in topology.agents:
+                definition = topology.models[agent.model]
+                key = (definition.get("api_type", "openai"), definition.get("base_url"), definition["api_key_env"])
+                providers.setdefault(key, {"definition": definition, "models": set()})["models"].add(definition["model"])
+        return providers
+
+    def check(self) -> List[Dict]:
+        now = time.time()
+        report = []
+        for key, provider in self._providers().items():
+            with self.lock:
+                stale = now - self.checked.get(key, 0) > self.ttl and key not in self.refreshing
+                if stale:
+                    self.refreshing.add(key)
+            if stale:
+                try:
+                    result = probe_provider(provider["definition"])
+                finally:
+                    with self.lock:
+                        self.results[key] = result
+                        self.checked[key] = time.time()
+                        self.refreshing.discard(key)
+            with self.lock:
+                result = self.results.get(key, {"ok": None, "error": "check in progress"})
+            report.append({"provider": key[0], "endpoint": key[1], "api_key_env": key[2],
+                           "models": sorted(provider["models"]), **result})
+        return report
+
+provider_health = ProviderHealth()
+
+def _size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+_disk = {"checked": 0, "report": None}
+_disk_lock = threading.Lock()
+
+def disk_usage() -> Dict:
+    """Free space and the size of the log and history directories, cached for HEALTH_DISK_TTL."""
+    with _disk_lock:
+        if time.time() - _disk["checked"] > HEALTH_DISK_TTL:
+            usage = shutil.disk_usage(".")
+            _disk["report"] = {
+                "free_bytes": usage.free,
+                "total_bytes": usage.total,
+                "ok": usage.free >= HEALTH_MIN_FREE_BYTES,
+                "paths": {path: _size(path) for path in DISK_PATHS if os.path.exists(path)}
+            }
+            _disk["checked"] = time.time()
+        return _disk["report"]
+
+def loop_health() -> Dict:
+    """The agents.py loops: which are alive and which have not started an overdue session."""
+    from scheduler import loop_statuses
+    now = time.time()
+    loops = []
+    for status in loop_statuses():
+        overdue = now - datetime.strptime(status["next_run"], "%Y-%m-%d %H:%M:%S").timestamp()
+        loops.append({
+            "pid": status["pid"],
+            "alive": status["alive"],
+            # A session runs once next_run has passed; one running far longer is stuck
+            "stalled": status["alive"] and overdue > HEALTH_LOOP_STALL,
+            "next_run": status["next_run"],
+            "reason": status["reason"],
+            "consecutive_errors": status["consecutive_errors"]
+        })
+    return {
+        "alive": sum(1 for loop in loops if loop["alive"]),
+        "stalled": sum(1 for loop in loops if loop["stalled"]),
+        "loops": loops
+    }
+
+def job_counts() -> Dict[str, int]:
+    from job_queue import job_queue
+    return job_queue.counts()
+
+def liveness() -> Dict:
+    return {"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.time() - STARTED, 1)}
+
+def readiness(extra_checks: Optional[Dict[str, Dict]] = None) -> Dict:
+    """Whether this process should get traffic: every provider reachable and enough disk.
+
+    extra_checks are the process's own checks ({name: {"ok": ..., ...}}).
+    """
+    providers = provider_health.check()
+    checks = {
+        # A provider without a check (ok None) does not count against readiness
+        "llm_providers": {"ok": all(p["ok"] is not False for p in providers), "providers": providers},
+        "disk": {key: value for key, value in disk_usage().items() if key != "paths"},
+        **(extra_checks or {})
+    }
+    ready = all(check["ok"] for check in checks.values())
+    return {"status": "ready" if ready else "not_ready", "checks": checks}
+
+def system_status(extra: Optional[Dict] = None) -> Dict:
+    """Everything a dashboard or autoscaler watches, from this process's point of view."""
+    status = {
+        **liveness(),
+        "llm_providers": provider_health.check(),
+        "jobs": job_counts(),
+        "agent_loops": loop_health(),
+        "disk": disk_usage()
+    }
+    status.update(extra or {})
+    return status
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from config import HISTORY_WINDOWS, HISTORY_SUMMARIZER
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Update the running summary of a discussion with the new messages below.
+Keep decisions, open questions and who proposed what. Stay under {budget} characters.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+def message_key(message: dict) -> str:
+    """Fingerprint a message so a changed history can be detected cheaply."""
+    text = f"{message.get('name', '')}:{message.get('content', '')}"
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()
+
+def message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return f"{message.get('name', message.get('role', 'unknown'))}: {content}"
+
+def extractive_summary(summary: str, new_messages: List[dict], budget: int) -> str:
+    """Append the opening line of each new message and keep the newest lines within budget."""
+    lines = summary.splitlines() if summary else []
+    for message in new_messages:
+        text = " ".join(message_text(message).split())
+        lines.append("- " + (text[:200] + "..." if len(text) > 200 else text))
+    while lines and len("\n".join(lines)) > budget:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def llm_summarizer(llm_config: dict) -> Callable[[str, List[dict], int], str]:
+    """Build a summarizer that folds new messages into the summary with an LLM call."""
+    from autogen import ConversableAgent
+    from llm_calls import instrument_agent
+
+    agent = ConversableAgent("History_Summarizer", llm_config=llm_config, human_input_mode="NEVER")
+    instrument_agent(agent)
+
+    def summarize(summary: str, new_messages: List[dict], budget: int) -> str:
+        prompt = SUMMARY_PROMPT.format(
+            budget=budget,
+            summary=summary or "(empty)",
+            messages="\n\n".join(message_text(m) for m in new_messages)
+        )
+        try:
+            reply = agent.generate_reply(messages=[{"role": "user", "content": prompt}])
+            text = reply.get("content") if isinstance(reply, dict) else reply
+            if text:
+                return text[:budget]
+        except Exception as e:
+            logger.error(f"History summarization failed, falling back to extractive: {e}")
+        return extractive_summary(summary, new_messages, budget)
+
+    return summarize
+
+class SummarizingWindow:
+    """Message transform that keeps recent turns verbatim and summarizes older ones.
+
+    The summary is refreshed incrementally: only messages that newly fall out
+    of the window are passed to the summarizer.
+    """
+
+    def __init__(self, window: int, summary_chars: int, summarizer: Optional[Callable] = None):
+        self.window = window
+        self.summary_chars = summary_chars
+        self.summarizer = summarizer or extractive_summary
+        # Held while summarizing, so a turn waits for a prefetch already doing its work
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.summary = ""
+        self.summarized = 0
+        self.first_key = None
+        self.boundary_key = None
+
+    def _split(self, messages: List[Dict], total: int) -> Optional[int]:
+        """Where the window starts in a history of total messages, None if that is past messages."""
+        split = total - self.window
+        if split >= len(messages):
+            return None
+        # Never start the window on a tool result whose call was cut off
+        while split > 0 and messages[split].get("role") in ("tool", "function"):
+            split -= 1
+        return split
+
+    def _windowed(self, messages: List[Dict], split: int) -> List[Dict]:
+        older = messages[:split]
+        if not older:
+            return list(messages)
+
+        # Start over if this is a different or rewritten conversation
+        if (len(older) < self.summarized
+                or message_key(messages[0]) != self.first_key
+                or (self.summarized and message_key(older[self.summarized - 1]) != self.boundary_key)):
+            self.reset()
+            self.first_key = message_key(messages[0])
+
+        new_messages = older[self.summarized:]
+        if new_messages:
+            self.summary = self.summarizer(self.summary, new_messages, self.summary_chars)
+            self.summarized = len(older)
+            self.boundary_key = message_key(older[-1])
+
+        summary_message = {
+            "role": "user",
+            "name": "History",
+            "content": f"Summary of the earlier discussion ({len(older)} messages):\n{self.summary}"
+        }
+        return [summary_message] + messages[split:]
+
+    def apply_transform(self, messages: List[Dict]) -> List[Dict]:
+        if len(messages) <= self.window:
+            return messages
+        with self.lock:
+            return self._windowed(messages, self._split(messages, len(messages)))
+
+    def prefetch(self, messages: List[Dict], upcoming: int = 1) -> Optional[List[Dict]]:
+        """Summarize now what will leave the window once upcoming more messages arrive.
+
+        Returns the start of the history the next turn will send (all of it
+        but the upcoming messages), or None if that depends on them.
+        """
+        if len(messages) + upcoming <= self.window:
+            return list(messages)
+        with self.lock:
+            split = self._split(messages, len(messages) + upcoming)
+            return None if split is None else self._windowed(messages, split)
+
+    def get_logs(self, pre_transform_messages: List[Dict], post_transform_messages: List[Dict]):
+        if len(post_transform_messages) < len(pre_transform_messages):
+            removed = len(pre_transform_messages) - len(post_transform_messages) + 1
+            return f"Summarized {removed} older messages.", True
+        return "No messages were summarized.", False
+
+def history_settings(agent_name: str) -> Dict[str, int]:
+    """Window size and summary budget for an agent, falling back to the defaults."""
+    return {**HISTORY_WINDOWS["default"], **HISTORY_WINDOWS.get(agent_name, {})}
+
+def add_history_window(agent, llm_config: Optional[dict] = None) -> SummarizingWindow:
+    """Limit the history the agent sends to its LLM to a window plus a rolling summary."""
+    from autogen.agentchat.contrib.capabilities.transform_messages import TransformMessages
+
+    settings = history_settings(agent.name)
+    summarizer = llm_summarizer(llm_config) if HISTORY_SUMMARIZER == "llm" and llm_config else None
+    window = SummarizingWindow(settings["window"], settings["summary_chars"], summarizer)
+    TransformMessages(transforms=[window], verbose=False).add_to_agent(agent)
+    # Kept on the agent so its next turn can be prepared ahead (see prefetch.py)
+    agent.history_window = window
+    return window
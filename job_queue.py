@@ -0,0 +1,328 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from config import JOB_DB_FILE, JOB_RETRY_BACKOFF, JOB_LEASE_SECONDS, JOB_HEARTBEAT_INTERVAL, JOB_MAX_ATTEMPTS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'groupchat',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    dedup_key TEXT NOT NULL,
+    schedule_id INTEGER,
+    worker TEXT,
+    lease_until REAL,
+    discussion TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status, priority DESC, run_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_topic ON jobs(dedup_key)
+    WHERE status IN ('queued', 'running');
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'groupchat',
+    priority INTEGER NOT NULL DEFAULT 0,
+    cron TEXT NOT NULL,
+    next_run REAL NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+def parse_cron_field(field: str, low: int, high: int) -> set:
+    """Parse one cron field ("*", "*/15", "1-5", "0,30", "9-17/2") into its values."""
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-"))
+        else:
+            start = end = int(part)
+        if start < low or end > high + (1 if high == 6 else 0) or step < 1:
+            raise ValueError(f"Invalid cron field: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class Cron:
+    """Standard five-field cron expression: minute hour day-of-month month day-of-week."""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_cron_field(f, low, high) for f, (low, high) in zip(fields, CRON_RANGES)
+        )
+        # Both 0 and 7 mean Sunday
+        self.weekdays = {d % 7 for d in weekdays}
+        self.day_restricted = fields[2] != "*"
+        self.weekday_restricted = fields[4] != "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """The first matching minute strictly after moment."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError("Cron expression never matches")
+
+def dedup_key(topic: str, mode: str) -> str:
+    return f"{mode}:{' '.join(topic.lower().split())}"
+
+class JobQueue:
+    """Durable SQLite job queue for discussions.
+
+    Jobs are claimed by priority, then due time. A claimed job holds a lease
+    that its worker renews while it runs (lease()); if the worker dies, the
+    expired lease counts as a failed attempt. Failed jobs are retried with
+    exponential backoff up to max_attempts. Only the claiming worker can
+    complete or fail a job, so a worker that lost its lease cannot overwrite
+    the result of the one that took over. Identical topics are only queued
+    once while one is pending.
+    """
+
+    def __init__(self, path: str = JOB_DB_FILE):
+        self.path = path
+        self.local = threading.local()
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        with self.init_lock:
+            if not self.initialized:
+                connection.executescript(SCHEMA)
+                # Databases created before jobs were linked to their discussion
+                columns = {row["name"] for row in connection.execute("PRAGMA table_info(jobs)")}
+                if "discussion" not in columns:
+                    connection.execute("ALTER TABLE jobs ADD COLUMN discussion TEXT")
+                self.initialized = True
+        return connection
+
+    def enqueue(self, topic: str, mode: str = "groupchat", priority: int = 0,
+                run_at: Optional[float] = None, max_attempts: int = JOB_MAX_ATTEMPTS,
+                schedule_id: Optional[int] = None) -> Dict:
+        """Queue a discussion. Returns the job, which is the already pending one for a duplicate topic."""
+        connection = self._connect()
+        key = dedup_key(topic, mode)
+        now = time.time()
+        try:
+            cursor = connection.execute(
+                "INSERT INTO jobs (topic, mode, priority, max_attempts, run_at, dedup_key, schedule_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (topic, mode, priority, max_attempts, run_at or now, key, schedule_id, now)
+            )
+            return {**self.get(cursor.lastrowid), "duplicate": False}
+        except sqlite3.IntegrityError:
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')", (key,)
+            ).fetchone()
+            if row is None:
+                raise
+            return {**self.get(row["id"]), "duplicate": True}
+
+    def claim(self, worker: Optional[str] = None) -> Optional[Dict]:
+        """Take the next due job, or None if nothing is ready."""
+        connection = self._connect()
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # A job whose worker died counts as a failed attempt
+            expired = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND lease_until < ?", (now,)
+            ).fetchall()
+            for job in expired:
+                self._retry_or_fail(connection, job, f"Lease expired: worker {job['worker']} stopped", now)
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND run_at <= ? "
+                "ORDER BY priority DESC, run_at, id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started_at = ?, lease_until = ? WHERE id = ?",
+                (worker, now, now + JOB_LEASE_SECONDS, row["id"])
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return self.get(row["id"])
+
+    def _retry_or_fail(self, connection: sqlite3.Connection, job, error: str, now: float):
+        if job["attempts"] < job["max_attempts"]:
+            delay = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, error = ?, run_at = ? WHERE id = ?",
+                (error, now + delay, job["id"])
+            )
+        else:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', worker = NULL, error = ?, finished_at = ? WHERE id = ?",
+                (error, now, job["id"])
+            )
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """Extend the worker's lease on a running job; False if the job is no longer its own."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + JOB_LEASE_SECONDS, job_id, worker)
+        )
+        return cursor.rowcount > 0
+
+    @contextmanager
+    def lease(self, job: Dict):
+        """Renew the claimed job's lease every JOB_HEARTBEAT_INTERVAL while the block runs."""
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+                if not self.heartbeat(job["id"], job["worker"]):
+                    print(f"Lost the lease on job {job['id']}; another worker may run it")
+                    return
+
+        thread = threading.Thread(target=renew, name=f"job-{job['id']}-lease", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def link_discussion(self, job_id: int, worker: str, discussion_id: str) -> bool:
+        """Record the discussion a running job writes, so a retry resumes it instead of starting over."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET discussion = ? WHERE id = ? AND worker = ? AND status = 'running'",
+            (discussion_id, job_id, worker)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: int, worker: str, result: str = "") -> bool:
+        """Mark the worker's job done; False if the job is no longer its own."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'done', worker = NULL, result = ?, error = NULL, finished_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (result, time.time(), job_id, worker)
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Retry the worker's job with exponential backoff, or mark it failed after its last attempt.
+
+        False if the job is no longer its own.
+        """
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            job = connection.execute(
+                "SELECT * FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)
+            ).fetchone()
+            if job is not None:
+                self._retry_or_fail(connection, job, error, time.time())
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return job is not None
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        if status:
+            rows = self._connect().execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._connect().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    def add_schedule(self, topic: str, cron: str, mode: str = "groupchat", priority: int = 0) -> Dict:
+        next_run = Cron(cron).next_after(datetime.now()).timestamp()
+        cursor = self._connect().execute(
+            "INSERT INTO schedules (topic, mode, priority, cron, next_run) VALUES (?, ?, ?, ?, ?)",
+            (topic, mode, priority, cron, next_run)
+        )
+        return self.get_schedule(cursor.lastrowid)
+
+    def get_schedule(self, schedule_id: int) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_schedules(self) -> List[Dict]:
+        return [dict(row) for row in self._connect().execute("SELECT * FROM schedules ORDER BY id")]
+
+    def remove_schedule(self, schedule_id: int):
+        self._connect().execute("DELETE FROM schedules WHERE id = ?", (schedule_id,))
+
+    def enqueue_due_schedules(self) -> int:
+        """Queue a job for every schedule that is due and advance it. Returns the number queued."""
+        connection = self._connect()
+        now = datetime.now()
+        queued = 0
+        due = connection.execute(
+            "SELECT * FROM schedules WHERE enabled = 1 AND next_run <= ?", (now.timestamp(),)
+        ).fetchall()
+        for schedule in due:
+            next_run = Cron(schedule["cron"]).next_after(now).timestamp()
+            # Only the process that advances next_run queues the job
+            cursor = connection.execute(
+                "UPDATE schedules SET next_run = ? WHERE id = ? AND next_run = ?",
+                (next_run, schedule["id"], schedule["next_run"])
+            )
+            if cursor.rowcount:
+                self.enqueue(schedule["topic"], schedule["mode"], schedule["priority"],
+                             schedule_id=schedule["id"])
+                queued += 1
+        return queued
+
+job_queue = JobQueue()
@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import threading
+import time
+from typing import Callable, List
+
+# Middleware wraps every LLM call made by an instrumented agent. Each one is
+# called as middleware(call, proceed) and must return proceed()'s result (or
+# a replacement for it); the first registered middleware is the outermost.
+_middlewares: List[Callable] = []
+_middlewares_lock = threading.Lock()
+
+class LLMCall:
+    """One LLM request made by an agent."""
+
+    def __init__(self, agent, messages, sender):
+        self.agent = agent
+        self.messages = messages
+        self.sender = sender
+        self.started_at = time.time()
+
+def add_middleware(middleware: Callable):
+    """Register middleware to run around every LLM call."""
+    with _middlewares_lock:
+        if middleware not in _middlewares:
+            _middlewares.append(middleware)
+
+def remove_middleware(middleware: Callable):
+    """Unregister middleware added with add_middleware."""
+    with _middlewares_lock:
+        if middleware in _middlewares:
+            _middlewares.remove(middleware)
+
+def instrument_agent(agent):
+    """Route the agent's LLM replies through the registered middleware."""
+    from autogen import ConversableAgent
+    agent.replace_reply_func(ConversableAgent.generate_oai_reply, generate_oai_reply)
+    agent.replace_reply_func(ConversableAgent.a_generate_oai_reply, a_generate_oai_reply)
+
+def generate_oai_reply(agent, messages=None, sender=None, config=None):
+    """Drop-in replacement for ConversableAgent.generate_oai_reply."""
+    from autogen import ConversableAgent
+
+    def proceed():
+        return ConversableAgent.generate_oai_reply(agent, messages, sender, config)
+
+    call = LLMCall(agent, messages, sender)
+    handler = proceed
+    for middleware in reversed(list(_middlewares)):
+        handler = functools.partial(middleware, call, handler)
+    return handler()
+
+async def a_generate_oai_reply(agent, messages=None, sender=None, config=None):
+    """Drop-in replacement for ConversableAgent.a_generate_oai_reply.
+
+    The call goes through the same middleware, on the running loop's
+    default executor (the async runtime bounds it).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(generate_oai_reply, agent, messages, sender, config))
@@ -0,0 +1,240 @@
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from config import LOG_STORE_FILE, LOG_TEXT_FILE, LOGS_PAGE_SIZE, LOGS_SCAN_LIMIT
+
+# A line of the plain-text log; lines that do not match continue the previous message
+TEXT_LINE = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ([^:\n]+): (.*)")
+
+def parse_time(value) -> Optional[float]:
+    """Accept epoch seconds or "YYYY-mm-dd[ HH:MM:SS]" / ISO timestamps."""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value)).timestamp()
+
+class LogStore:
+    """Append-only structured log with an in-memory index for paged queries.
+
+    Every entry is one JSON line carrying a sequence number, which doubles as
+    the pagination cursor. The index keeps each entry's byte offset and time
+    plus per-sender and per-discussion sequence lists, so a page is found by
+    bisecting instead of rescanning the file; only text search reads entries
+    that are not returned.
+
+    A store that is missing or empty when first loaded is seeded from the
+    plain-text log ("ts - sender: message" lines), so history written
+    before the store existed stays queryable.
+    """
+
+    def __init__(self, path: str = LOG_STORE_FILE, text_path: str = LOG_TEXT_FILE):
+        self.path = path
+        self.text_path = text_path
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def _reset_index(self, first_seq: int = 0):
+        self.first_seq = first_seq
+        self.offsets = array("Q")
+        self.times = array("d")
+        self.by_sender: Dict[str, array] = {}
+        self.by_discussion: Dict[str, array] = {}
+        self.size = 0
+
+    def _index(self, record: Dict, offset: int):
+        if not self.offsets:
+            self.first_seq = record["seq"]
+        self.offsets.append(offset)
+        self.times.append(record["t"])
+        self.by_sender.setdefault(record["sender"], array("Q")).append(record["seq"])
+        if record.get("discussion"):
+            self.by_discussion.setdefault(record["discussion"], array("Q")).append(record["seq"])
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        self._reset_index()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            self._import_text_log()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self._index(json.loads(line), offset)
+                except ValueError:
+                    break
+                offset += len(line)
+        if offset < os.path.getsize(self.path):
+            # Drop a torn last line so the next append starts cleanly
+            with open(self.path, "rb+") as f:
+                f.truncate(offset)
+        self.size = offset
+
+    def _import_text_log(self):
+        if not os.path.exists(self.text_path):
+            return
+        records = []
+        with open(self.text_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if match := TEXT_LINE.fullmatch(line):
+                    ts, sender, message = match.groups()
+                    records.append({"seq": len(records), "t": datetime.strptime(ts, "%Y-%m-%d %H:%M:%S").timestamp(),
+                                    "ts": ts, "sender": sender, "discussion": None, "message": message})
+                elif records:
+                    records[-1]["message"] += "\n" + line
+        if not records:
+            return
+        # Written aside and moved into place, so a reader never sees half an import
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        os.replace(tmp_path, self.path)
+
+    @property
+    def next_seq(self) -> int:
+        return self.first_seq + len(self.offsets)
+
+    def latest_seq(self) -> int:
+        """Sequence number of the newest entry (-1 before the first)."""
+        with self.lock:
+            self._load()
+            return self.next_seq - 1
+
+    def append(self, sender: str, message: str, discussion: Optional[str] = None,
+               on_append: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Append an entry; on_append gets its record under the lock, so in seq order."""
+        now = time.time()
+        with self.lock:
+            self._load()
+            record = {
+                "seq": self.next_seq,
+                "t": now,
+                "ts": datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+                "sender": sender,
+                "discussion": discussion,
+                "message": message
+            }
+            line = (json.dumps(record) + "\n").encode("utf-8")
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self._index(record, self.size)
+            self.size += len(line)
+            if on_append is not None:
+                on_append(record)
+            return record
+
+    def clear(self):
+        """Remove all entries. Sequence numbers keep increasing so old cursors stay unambiguous."""
+        with self.lock:
+            self._load()
+            next_seq = self.next_seq
+            open(self.path, "w").close()
+            self._reset_index(next_seq)
+
+    def _read(self, seqs: List[int]) -> List[Dict]:
+        """Read entries by sequence number, coalescing neighbours into one read."""
+        records = []
+        with open(self.path, "rb") as f:
+            i = 0
+            while i < len(seqs):
+                j = i
+                while j + 1 < len(seqs) and abs(seqs[j + 1] - seqs[j]) == 1:
+                    j += 1
+                lo, hi = sorted((seqs[i] - self.first_seq, seqs[j] - self.first_seq))
+                f.seek(self.offsets[lo])
+                end = self.offsets[hi + 1] if hi + 1 < len(self.offsets) else self.size
+                chunk = [json.loads(line) for line in f.read(end - self.offsets[lo]).splitlines()]
+                records.extend(chunk if seqs[j] >= seqs[i] else reversed(chunk))
+                i = j + 1
+        return records
+
+    def _candidates(self, lo: int, hi: int, senders: Optional[List[str]],
+                    discussion: Optional[str], newest_first: bool) -> Iterator[int]:
+        """Sequence numbers in [lo, hi) matching the sender/discussion filters."""
+        lists = []
+        if discussion is not None:
+            lists.append(self.by_discussion.get(discussion, array("Q")))
+        if senders:
+            merged = sorted(seq for sender in senders for seq in self.by_sender.get(sender, ()))
+            lists.append(merged)
+        if not lists:
+            seqs = range(lo, hi)
+            return iter(reversed(seqs) if newest_first else seqs)
+        # Walk the shortest list and check membership in the others
+        lists.sort(key=len)
+        shortest = lists[0]
+        window = shortest[bisect_left(shortest, lo):bisect_left(shortest, hi)]
+        others = [set(l[bisect_left(l, lo):bisect_left(l, hi)]) for l in lists[1:]]
+        matching = [seq for seq in window if all(seq in other for other in others)]
+        return iter(reversed(matching) if newest_first else matching)
+
+    def query(self, before: Optional[int] = None, after: Optional[int] = None,
+              limit: int = LOGS_PAGE_SIZE, senders: Optional[List[str]] = None,
+              discussion: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, text: Optional[str] = None) -> Dict:
+        """One page of entries, oldest first.
+
+        Without a cursor or with before=, pages go backwards from the newest
+        entry; with after=, forwards. next_cursor continues in the same
+        direction and is None once there is nothing left. A page can be short
+        of limit when LOGS_SCAN_LIMIT entries were examined for a text search.
+        """
+        with self.lock:
+            self._load()
+            newest_first = after is None
+            lo, hi = self.first_seq, self.next_seq
+            if before is not None:
+                hi = min(hi, before)
+            if after is not None:
+                lo = max(lo, after + 1)
+            # Entries are appended in time order, so a time window is a sequence range
+            if since is not None:
+                lo = max(lo, self.first_seq + bisect_left(self.times, since))
+            if until is not None:
+                hi = min(hi, self.first_seq + bisect_right(self.times, until))
+            candidates = self._candidates(lo, hi, senders, discussion, newest_first)
+
+            needle = text.lower() if text else None
+            entries, scanned, cursor, more = [], 0, None, True
+            while len(entries) < limit and scanned < LOGS_SCAN_LIMIT:
+                batch = list(islice(candidates, min(256, LOGS_SCAN_LIMIT - scanned)))
+                if not batch:
+                    more = False
+                    break
+                records = self._read(batch)
+                for position, record in enumerate(records, 1):
+                    scanned += 1
+                    cursor = record["seq"]
+                    if needle and needle not in record["message"].lower() and needle not in record["sender"].lower():
+                        continue
+                    entries.append(record)
+                    if len(entries) == limit:
+                        break
+                if len(entries) == limit and position == len(records):
+                    # Peek so that a last full page does not hand out a dangling cursor
+                    more = next(candidates, None) is not None
+
+            if newest_first:
+                entries.reverse()
+            return {
+                "entries": entries,
+                "next_cursor": cursor if more else None,
+                "scanned": scanned
+            }
+
+log_store = LogStore()
@@ -0,0 +1,115 @@
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from config import MESSAGE_STORE_MAX_MESSAGES, MESSAGE_STORE_MAX_BYTES
+
+class Message:
+    """One log entry held in memory.
+
+    Slots instead of a dict, interned sender and discussion names shared by
+    every entry, and the time as a float formatted only when asked for keep
+    an entry to its text plus about a hundred bytes.
+    """
+
+    __slots__ = ("seq", "t", "sender", "discussion", "text")
+
+    def __init__(self, seq: int, t: float, sender: str, discussion: Optional[str], text: str):
+        self.seq = seq
+        self.t = t
+        self.sender = sys.intern(sender)
+        self.discussion = sys.intern(discussion) if discussion else None
+        self.text = text
+
+    @property
+    def ts(self) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.t))
+
+    @property
+    def log(self) -> str:
+        return f"{self.ts} - {self.sender}: {self.text}"
+
+    def size(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.text)
+
+    def record(self) -> Dict:
+        """The entry in the log store's record format."""
+        return {"seq": self.seq, "t": self.t, "ts": self.ts, "sender": self.sender,
+                "discussion": self.discussion, "message": self.text}
+
+class MessageStore:
+    """The most recent log entries, bounded by count and by bytes.
+
+    The log store on disk has every entry; this keeps the newest ones at
+    hand so reconnecting clients are served without reading the file, and
+    drops the oldest once either cap is reached so memory stays flat however
+    long the server runs.
+    """
+
+    def __init__(self, max_messages: int = MESSAGE_STORE_MAX_MESSAGES, max_bytes: int = MESSAGE_STORE_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.messages = deque()
+        self.bytes = 0
+        self.evicted = 0
+
+    def append(self, record: Dict) -> Message:
+        """Add a record from log_store.append(), which passes them in seq order."""
+        message = Message(record["seq"], record["t"], record["sender"], record.get("discussion"), record["message"])
+        with self.lock:
+            self.messages.append(message)
+            self.bytes += message.size()
+            while self.messages and (len(self.messages) > self.max_messages or self.bytes > self.max_bytes):
+                self.bytes -= self.messages.popleft().size()
+                self.evicted += 1
+        return message
+
+    def after(self, seq: int) -> Optional[List[Dict]]:
+        """Records newer than seq, or None if some of them are no longer in memory."""
+        with self.lock:
+            if not self.messages or self.messages[0].seq > seq + 1:
+                return None
+            # Binary search on seq rather than assuming the numbers are consecutive
+            start, end = 0, len(self.messages)
+            while start < end:
+                middle = (start + end) // 2
+                if self.messages[middle].seq <= seq:
+                    start = middle + 1
+                else:
+                    end = middle
+            return [self.messages[i].record() for i in range(start, len(self.messages))]
+
+    def clear(self):
+        with self.lock:
+            self.messages.clear()
+            self.bytes = 0
+
+    def footprint(self) -> Dict:
+        with self.lock:
+            return {
+                "messages": len(self.messages),
+                "bytes": self.bytes,
+                "max_messages": self.max_messages,
+                "max_bytes": self.max_bytes,
+                "evicted": self.evicted,
+                "oldest_seq": self.messages[0].seq if self.messages else None,
+                "newest_seq": self.messages[-1].seq if self.messages else None
+            }
+
+message_store = MessageStore()
+
+def release_chat(groupchat, manager):
+    """Drop what a finished group chat left behind in its agents.
+
+    Agents keep their conversation with every chat manager they have talked
+    to, keyed by the manager, and each discussion has a new manager; without
+    this every discussion's messages stay in memory as long as the agents do.
+    """
+    for agent in groupchat.agents:
+        for per_peer in (agent._oai_messages, agent._consecutive_auto_reply_counter,
+                         agent._max_consecutive_auto_reply_dict, agent.reply_at_receive):
+            per_peer.pop(manager, None)
+    manager._oai_messages.clear()
+    groupchat.messages.clear()
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from config import PARALLEL_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+SYNTHESIS_PROMPT = """Several agents answered the same request independently.
+
+Request:
+{message}
+
+Answers:
+{answers}
+
+Merge these answers into one coherent, concise response. Keep the strongest
+points, resolve contradictions and drop repetition."""
+
+# One pool shared by every parallel round, so concurrent discussions together
+# never run more than PARALLEL_MAX_WORKERS LLM calls at once
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ThreadPoolExecutor:
+    """Return the shared bounded pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=PARALLEL_MAX_WORKERS,
+                                           thread_name_prefix="parallel-round")
+    return _pool
+
+def reply_text(reply) -> str:
+    """Extract the text of an agent reply, which may be a string or a message dict."""
+    if isinstance(reply, dict):
+        return reply.get("content") or ""
+    return reply or ""
+
+def run_parallel_round(agents: List, message: str, synthesizer, on_reply=None,
+                       done: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Optional[str]], str]:
+    """Send the same message to independent agents concurrently and merge their replies.
+
+    Agents with a reply in done (e.g. restored from a checkpoint) are not asked again.
+    Returns each agent's reply (None if it failed) and the synthesizer's merged answer.
+    """
+    done = done or {}
+    # Each agent gets its own message list; reply generation may mutate it
+    futures = {
+        agent.name: get_pool().submit(agent.generate_reply, messages=[{"role": "user", "content": message}])
+        for agent in agents if agent.name not in done
+    }
+
+    # Report replies as they finish but keep them in agent order
+    replies = {agent.name: done.get(agent.name) for agent in agents}
+    names = {future: name for name, future in futures.items()}
+    for future in as_completed(names):
+        name = names[future]
+        try:
+            replies[name] = reply_text(future.result())
+        except Exception as e:
+            logger.error(f"{name} failed in parallel round: {e}")
+            continue
+        if on_reply:
+            on_reply(name, replies[name])
+
+    answers = [f"{name}:\n{reply}" for name, reply in replies.items() if reply is not None]
+    if not answers:
+        raise RuntimeError("All agents failed in parallel round")
+
+    prompt = SYNTHESIS_PROMPT.format(message=message, answers="\n\n".join(answers))
+    synthesis = reply_text(synthesizer.generate_reply(messages=[{"role": "user", "content": prompt}]))
+    return replies, synthesis
+
+async def a_run_parallel_round(agents: List, message: str, synthesizer, on_reply=None,
+                               done: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Optional[str]], str]:
+    """run_parallel_round for the async runtime: the replies are awaited together on its event loop."""
+    done = done or {}
+
+    async def ask(agent):
+        try:
+            reply = await agent.a_generate_reply(messages=[{"role": "user", "content": message}])
+            return agent.name, reply_text(reply)
+        except Exception as e:
+            logger.error(f"{agent.name} failed in parallel round: {e}")
+            return agent.name, None
+
+    replies = {agent.name: done.get(agent.name) for agent in agents}
+    for answered in asyncio.as_completed([ask(agent) for agent in agents if agent.name not in done]):
+        name, reply = await answered
+        if reply is None:
+            continue
+        replies[name] = reply
+        if on_reply:
+            on_reply(name, reply)
+
+    answers = [f"{name}:\n{reply}" for name, reply in replies.items() if reply is not None]
+    if not answers:
+        raise RuntimeError("All agents failed in parallel round")
+
+    prompt = SYNTHESIS_PROMPT.format(message=message, answers="\n\n".join(answers))
+    synthesis = reply_text(await synthesizer.a_generate_reply(messages=[{"role": "user", "content": prompt}]))
+    return replies, synthesis
@@ -0,0 +1,148 @@
+import copy
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from config import (PREFETCH_ENABLED, PREFETCH_PRIME_CACHE, PREFETCH_PRIME_MIN_CHARS,
+                    PREFETCH_KEEPALIVE_INTERVAL, PREFETCH_KEEPALIVE_MAX)
+from llm_calls import add_middleware, remove_middleware
+
+logger = logging.getLogger(__name__)
+
+# One-token copies of agents, used to put an agent's request prefix in the provider's prompt cache
+_primers = weakref.WeakKeyDictionary()
+
+def prime_cache(agent, prefix: List[Dict]):
+    """Send the start of the agent's next request with a one-token limit.
+
+    Providers cache long prompt prefixes per model (Gemini implicitly,
+    OpenAI from about 1024 tokens), so the real request that follows is
+    answered sooner. The call goes through the llm_calls middleware like
+    any other, so its tokens are accounted for.
+    """
+    size = len(agent.system_message) + sum(len(str(message.get("content") or "")) for message in prefix)
+    if size < PREFETCH_PRIME_MIN_CHARS or not agent.llm_config:
+        return
+    config_list = agent.llm_config["config_list"]
+    primed_for, primer = _primers.get(agent, (None, None))
+    # Rebuilt when the agent's model changed, e.g. downgraded by its budget
+    if primer is None or primed_for != config_list:
+        from autogen import ConversableAgent
+        from llm_calls import instrument_agent
+        primer = ConversableAgent(
+            f"{agent.name}_Primer",
+            system_message=agent.system_message,
+            llm_config={**copy.deepcopy(agent.llm_config), "max_tokens": 1},
+            human_input_mode="NEVER"
+        )
+        instrument_agent(primer)
+        _primers[agent] = (copy.deepcopy(config_list), primer)
+    primer.generate_reply(messages=prefix)
+
+def keep_warm(agent, cancelled: threading.Event):
+    """Keep the agent's HTTP connections open until its turn starts.
+
+    OpenAI-compatible clients drop idle connections after 5 seconds, so by
+    the time a round-robin agent speaks again its connection is gone and
+    the request pays for a new TLS handshake. A cheap request every
+    PREFETCH_KEEPALIVE_INTERVAL seconds keeps one in the client's pool.
+    Clients that open a connection per request (Gemini's) are left alone.
+    """
+    clients = [getattr(client, "_oai_client", None) for client in getattr(agent.client, "_clients", None) or []]
+    clients = [client.with_options(max_retries=0, timeout=5) for client in clients if client is not None]
+    deadline = time.time() + PREFETCH_KEEPALIVE_MAX
+    while clients and not cancelled.is_set() and time.time() < deadline:
+        for client in clients:
+            client.models.list()
+        cancelled.wait(PREFETCH_KEEPALIVE_INTERVAL)
+
+class Prefetcher:
+    """Prepares the next speaker's turn of a round-robin group chat while the current speaker waits for its LLM.
+
+    In round robin the next speaker is known as soon as the current one
+    starts, and so is its request, except for the reply being generated.
+    While that call runs, the next agent's history window summarizes the
+    messages about to leave it, its connection is kept open and, with
+    PREFETCH_PRIME_CACHE, its request prefix is put in the provider's prompt
+    cache. None of this produces messages, so the discussion is the same
+    with or without it. Work for an agent that turns out not to speak next,
+    or for a chat that ends, is cancelled.
+    """
+
+    def __init__(self, groupchat, manager):
+        self.groupchat = groupchat
+        self.manager = manager
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        # Messages already in the group chat when it started (a resumed chat)
+        self.offset = len(groupchat.messages)
+        self.pending = None
+        self.stats = {"prefetched": 0, "used": 0, "wasted": 0}
+
+    def start(self):
+        add_middleware(self.middleware)
+
+    def _next_speaker(self, speaker):
+        """The agent that will speak after this one, or None if this is the last round."""
+        if len(self.groupchat.messages) - self.offset >= self.groupchat.max_round - 1:
+            return None
+        return self.groupchat.next_agent(speaker)
+
+    def _prepare(self, agent, messages: List[Dict], cancelled: threading.Event):
+        try:
+            window = getattr(agent, "history_window", None)
+            prefix = window.prefetch(messages) if window is not None else messages
+            if PREFETCH_PRIME_CACHE and prefix is not None and not cancelled.is_set():
+                prime_cache(agent, prefix)
+            keep_warm(agent, cancelled)
+        except Exception as e:
+            logger.warning(f"Prefetch for {agent.name} failed: {e}")
+
+    def _settle(self, speaker: Optional[object]):
+        """Stop the pending prefetch; it was used if it was for this speaker."""
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if pending is None:
+                return
+            agent, future, cancelled = pending
+            self.stats["used" if agent is speaker else "wasted"] += 1
+        cancelled.set()
+        future.cancel()
+
+    def middleware(self, call, proceed):
+        if call.sender is not self.manager or call.agent not in self.groupchat.agents:
+            return proceed()
+        self._settle(call.agent)
+        upcoming = self._next_speaker(call.agent)
+        if upcoming is not None:
+            # Snapshot now: the chat adds to it while the prefetch runs
+            messages = list(upcoming.chat_messages.get(self.manager, []))
+            cancelled = threading.Event()
+            future = self.executor.submit(self._prepare, upcoming, messages, cancelled)
+            with self.lock:
+                self.pending = (upcoming, future, cancelled)
+                self.stats["prefetched"] += 1
+        return proceed()
+
+    def close(self):
+        remove_middleware(self.middleware)
+        self._settle(None)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Prefetched {self.stats['prefetched']} turns: {self.stats['used']} used, "
+                    f"{self.stats['wasted']} wasted")
+
+@contextmanager
+def speculate(groupchat, manager):
+    """Prefetch the next speaker's turns while the chat runs, if enabled and the order is round robin."""
+    if not PREFETCH_ENABLED or groupchat.speaker_selection_method != "round_robin":
+        yield None
+        return
+    prefetcher = Prefetcher(groupchat, manager)
+    prefetcher.start()
+    try:
+        yield prefetcher
+    finally:
+        prefetcher.close()
@@ -0,0 +1,239 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Dict, Optional
+from config import PROFILE_ENABLED, PROFILE_TRACE_FILE, PROFILE_SAMPLE_INTERVAL, PROFILE_SERVICE_NAME
+
+# Tracing is opt-in: either PROFILE_ENABLED for everything or one request at a
+# time. _tracing counts the reasons to trace, so while it is 0 every hook in
+# this module returns after a single global check.
+_tracing = 1 if PROFILE_ENABLED else 0
+_tracing_lock = threading.Lock()
+_local = threading.local()
+
+def _attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class TraceExporter:
+    """Writes finished spans to a local file as OTLP/JSON, one export request per line.
+
+    The format is what the OpenTelemetry collector's file exporter writes,
+    so the file can be loaded by OTLP tooling as is. Spans are buffered and
+    written when a trace's root span ends.
+    """
+
+    def __init__(self, path: str = PROFILE_TRACE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.buffer = []
+
+    def export(self, span: Dict, root: bool):
+        with self.lock:
+            self.buffer.append(span)
+            if not root and len(self.buffer) < 256:
+                return
+            spans, self.buffer = self.buffer, []
+            request = {"resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", PROFILE_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "agent_village.profiling"}, "spans": spans}]
+            }]}
+            with open(self.path, "a") as f:
+                f.write(json.dumps(request, separators=(",", ":")) + "\n")
+
+exporter = TraceExporter()
+
+class Span:
+    """A timed section of work. Records wall time and the thread's CPU time,
+    so the difference shows how long the section spent waiting."""
+
+    def __init__(self, name: str, attributes: Dict):
+        self.name = name
+        self.attributes = attributes
+        self.parent: Optional[Span] = None
+
+    def __enter__(self):
+        stack = getattr(_local, "spans", None)
+        if stack is None:
+            stack = _local.spans = []
+        self.parent = stack[-1] if stack else None
+        self.trace_id = self.parent.trace_id if self.parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        stack.append(self)
+        self.start_ns = time.time_ns()
+        self.cpu_start_ns = time.thread_time_ns()
+        return self
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __exit__(self, exc_type, exc, tb):
+        cpu_ns = time.thread_time_ns() - self.cpu_start_ns
+        end_ns = time.time_ns()
+        _local.spans.pop()
+        attributes = dict(self.attributes)
+        attributes["thread.name"] = threading.current_thread().name
+        attributes["cpu.time_ms"] = round(cpu_ns / 1e6, 3)
+        attributes["wait.time_ms"] = round(max(end_ns - self.start_ns - cpu_ns, 0) / 1e6, 3)
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [_attribute(key, value) for key, value in attributes.items()],
+            "status": {"code": 2, "message": f"{exc_type.__name__}: {exc}"} if exc_type else {"code": 1}
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        exporter.export(span, root=self.parent is None)
+        return False
+
+def active() -> bool:
+    """Whether work on this thread is being traced."""
+    return bool(_tracing) and (PROFILE_ENABLED or getattr(_local, "request", None) is not None)
+
+def span(name: str, **attributes):
+    """Context manager tracing a section of work; a no-op unless tracing is on for this thread."""
+    if not _tracing or not active():
+        return nullcontext()
+    return Span(name, attributes)
+
+def traced(name: Optional[str] = None):
+    """Decorator tracing every call of a function as a span."""
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracing:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def llm_call_span(call, proceed):
+    """llm_calls middleware tracing each agent turn's LLM call."""
+    if not _tracing:
+        return proceed()
+    with span("agent.turn", agent=getattr(call.agent, "name", ""), sender=getattr(call.sender, "name", "")):
+        return proceed()
+
+class Sampler:
+    """Statistical profiler: samples the stacks of watched threads every
+    PROFILE_SAMPLE_INTERVAL seconds and counts them as collapsed stacks
+    ("thread;file:function;..." lines), the input format of flame graph tools.
+
+    The sampling thread only runs while some thread is watched or a timed
+    profile of all threads is being taken.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watched = set()
+        self.all_threads = 0
+        self.counts = Counter()
+        self.thread = None
+
+    def _ensure_running(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self.thread.start()
+
+    def watch(self, ident: int):
+        with self.lock:
+            self.watched.add(ident)
+            self._ensure_running()
+
+    def unwatch(self, ident: int):
+        with self.lock:
+            self.watched.discard(ident)
+
+    @staticmethod
+    def collapse(frame, thread_name: str) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack.append(thread_name)
+        return ";".join(reversed(stack))
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self.lock:
+                if not self.watched and not self.all_threads:
+                    self.thread = None
+                    return
+                watched = None if self.all_threads else set(self.watched)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = [self.collapse(frame, names.get(ident, str(ident)))
+                       for ident, frame in sys._current_frames().items()
+                       if ident != me and (watched is None or ident in watched)]
+            with self.lock:
+                self.counts.update(samples)
+            time.sleep(self.interval)
+
+    def profile(self, seconds: float) -> Counter:
+        """Sample every thread for the given time and return just those samples."""
+        with self.lock:
+            before = Counter(self.counts)
+            self.all_threads += 1
+            self._ensure_running()
+        try:
+            time.sleep(seconds)
+        finally:
+            with self.lock:
+                self.all_threads -= 1
+                window = self.counts - before
+        return window
+
+    def snapshot(self, reset: bool = False) -> Counter:
+        with self.lock:
+            counts = Counter(self.counts)
+            if reset:
+                self.counts.clear()
+        return counts
+
+sampler = Sampler()
+
+def collapsed(counts: Counter) -> str:
+    """Collapsed-stack text, one "stack count" line per distinct stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+def begin_request(name: str, **attributes) -> str:
+    """Trace and sample the rest of the current request; returns its trace id."""
+    global _tracing
+    with _tracing_lock:
+        _tracing += 1
+    root = Span(name, attributes)
+    _local.request = root
+    root.__enter__()
+    sampler.watch(threading.get_ident())
+    return root.trace_id
+
+def end_request(error: Optional[BaseException] = None):
+    """Finish the trace started by begin_request, if any, on this thread."""
+    global _tracing
+    root = getattr(_local, "request", None)
+    if root is None:
+        return
+    sampler.unwatch(threading.get_ident())
+    root.__exit__(type(error) if error else None, error, None)
+    _local.request = None
+    with _tracing_lock:
+        _tracing -= 1
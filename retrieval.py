@@ -0,0 +1,454 @@
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import (
+    RETRIEVAL_DIR,
+    RETRIEVAL_EMBEDDER,
+    RETRIEVAL_TOP_K,
+    RETRIEVAL_CONTEXT_CHARS,
+    CHAT_LOGS_DIR,
+    CHECKPOINT_DIR,
+    STRATEGY_FILE
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CHARS = 800
+# Up to EXACT_SCAN_SNIPPETS snippets are scanned exactly (about 20 ms with
+# hashed vectors, 200 ms with sentence embeddings). Larger indexes use LSH:
+# short signatures in many tables, each also probed one bit away, because a
+# short query is only loosely similar to the snippets it should find
+EXACT_SCAN_SNIPPETS = 10000
+LSH_TABLES = 16
+LSH_BITS = 8
+MIN_SCORE = 0.2  # cosine below which a snippet is not worth its tokens
+
+def chunk_text(text: str, size: int = CHUNK_CHARS) -> List[str]:
+    """Split text into paragraph-aligned chunks of roughly size characters."""
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+        while len(current) > size:
+            chunks.append(current[:size])
+            current = current[size:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+class HashingEmbedder:
+    """CPU-only fallback: feature-hashed, log-scaled term frequencies.
+
+    Document frequencies are counted as documents are added, and queries are
+    weighted by idf, so rare terms dominate the match like in TF-IDF.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.doc_freq = Counter()
+        self.docs = 0
+
+    def _features(self, text: str) -> Counter:
+        features = Counter()
+        for token in re.findall(r"\w+", text.lower()):
+            if len(token) > 2:
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest()
+                features[int.from_bytes(digest, "big") % self.dim] += 1
+        return features
+
+    def _vector(self, weights: Dict[int, float]) -> array:
+        vector = array("f", bytes(4 * self.dim))
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for index, weight in weights.items():
+            vector[index] = weight / norm
+        return vector
+
+    def embed_document(self, text: str) -> array:
+        features = self._features(text)
+        self.docs += 1
+        self.doc_freq.update(features.keys())
+        return self._vector({i: 1 + math.log(tf) for i, tf in features.items()})
+
+    def embed_query(self, text: str) -> array:
+        features = self._features(text)
+        return self._vector({
+            i: (1 + math.log(tf)) * math.log((1 + self.docs) / (1 + self.doc_freq[i]))
+            for i, tf in features.items()
+        })
+
+class SentenceTransformerEmbedder:
+    """Small CPU sentence-embedding model, used when sentence-transformers is installed."""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed_document(self, text: str) -> array:
+        return array("f", self.model.encode(text, normalize_embeddings=True).tolist())
+
+    embed_query = embed_document
+
+def create_embedder():
+    if RETRIEVAL_EMBEDDER in ("auto", "sentence-transformers"):
+        try:
+            return SentenceTransformerEmbedder()
+        except ImportError:
+            if RETRIEVAL_EMBEDDER == "sentence-transformers":
+                raise
+            logger.info("sentence-transformers not installed, using the hashing embedder")
+    return HashingEmbedder()
+
+def nonzero(vector: array) -> List[Tuple[int, float]]:
+    """The vector's nonzero components: hashed vectors have a few dozen of their 1024."""
+    return [(i, x) for i, x in enumerate(vector) if x]
+
+def sparse_dot(terms: List[Tuple[int, float]], vector: array) -> float:
+    return sum(x * vector[i] for i, x in terms)
+
+class VectorIndex:
+    """Incremental on-disk vector index with random-hyperplane LSH search.
+
+    Snippets are appended to meta.jsonl, their vectors to vectors.f32 and
+    their LSH signatures to signatures.u32, so loading does not hash them
+    again. state.json records how far each source file has been indexed, so
+    refresh() only embeds new material. Processes sharing the index append
+    under a lock on index.lock and first read what the others appended.
+    """
+
+    def __init__(self, root: str = RETRIEVAL_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.embedder = None
+        self.snippets = []
+        self.vectors = []
+        self.buckets = [dict() for _ in range(LSH_TABLES)]
+        self.planes = None
+        self.state = {"offsets": {}, "embedder": None, "doc_freq": {}, "docs": 0, "lsh": None}
+        # Bytes of meta.jsonl read into snippets so far
+        self.meta_offset = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path("index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load(self):
+        """Create the embedder and read the index on first use. Callers hold self.lock."""
+        if self.loaded:
+            return
+        self.loaded = True
+        self.embedder = create_embedder()
+        rng = random.Random(42)
+        self.planes = [[array("f", [rng.gauss(0, 1) for _ in range(self.embedder.dim)])
+                        for _ in range(LSH_BITS)] for _ in range(LSH_TABLES)]
+        with self._file_lock():
+            self._sync()
+
+    def _clear(self):
+        self.snippets = []
+        self.vectors = []
+        self.buckets = [dict() for _ in range(LSH_TABLES)]
+        self.meta_offset = 0
+
+    def _sync(self):
+        """Catch up with the state and snippets saved by other processes. Callers hold the file lock."""
+        if os.path.exists(self._path("state.json")):
+            with open(self._path("state.json"), "r") as f:
+                self.state = json.load(f)
+        if self.state["embedder"] not in (None, self.embedder.name):
+            # Vectors from another embedder are not comparable; start over
+            logger.info(f"Embedder changed to {self.embedder.name}, rebuilding the index")
+            for name in ("meta.jsonl", "vectors.f32", "signatures.u32", "state.json"):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self.state = {"offsets": {}, "embedder": None, "doc_freq": {}, "docs": 0, "lsh": None}
+        self.state["embedder"] = self.embedder.name
+        if isinstance(self.embedder, HashingEmbedder):
+            self.embedder.doc_freq = Counter({int(k): v for k, v in self.state["doc_freq"].items()})
+            self.embedder.docs = self.state["docs"]
+
+        meta_path = self._path("meta.jsonl")
+        if not os.path.exists(meta_path) or os.path.getsize(meta_path) < self.meta_offset:
+            # Removed or rebuilt by another process: read it again from the start
+            self._clear()
+        if os.path.exists(meta_path):
+            self._read_tail()
+        self.state["lsh"] = [LSH_TABLES, LSH_BITS]
+
+    def _read_tail(self):
+        """Load the snippets appended after meta_offset."""
+        dim = self.embedder.dim
+        start = len(self.vectors)
+        with open(self._path("meta.jsonl"), "rb") as f:
+            f.seek(self.meta_offset)
+            lines = f.read().splitlines(keepends=True)
+        snippets = []
+        for line in lines:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                snippets.append(json.loads(line))
+            except ValueError:
+                break
+        data = b""
+        if os.path.exists(self._path("vectors.f32")):
+            with open(self._path("vectors.f32"), "rb") as f:
+                f.seek(start * dim * 4)
+                data = f.read()
+        # Keep only snippets whose vector was fully written
+        count = min(len(snippets), len(data) // (dim * 4))
+        vectors = array("f")
+        vectors.frombytes(data[:count * dim * 4])
+        meta_end = self.meta_offset + sum(len(line) for line in lines[:count])
+        # Writers append under the file lock, so anything past the last whole
+        # snippet was torn by a crash; cut it off before appending after it
+        for name, end in (("meta.jsonl", meta_end), ("vectors.f32", (start + count) * dim * 4)):
+            if os.path.exists(self._path(name)) and os.path.getsize(self._path(name)) > end:
+                os.truncate(self._path(name), end)
+        self.snippets.extend(snippets[:count])
+        self.vectors.extend(vectors[i * dim:(i + 1) * dim] for i in range(count))
+        self.meta_offset = meta_end
+        self._load_signatures(start)
+
+    def _load_signatures(self, start: int = 0):
+        """Bucket the vectors from start on by their saved signatures, hashing only those missing."""
+        signatures = array("I")
+        path = self._path("signatures.u32")
+        data = b""
+        if self.state.get("lsh") == [LSH_TABLES, LSH_BITS] and os.path.exists(path):
+            with open(path, "rb") as f:
+                f.seek(start * 4 * LSH_TABLES)
+                data = f.read()
+        # Signatures of other LSH settings are recomputed, as are torn or missing ones
+        vectors = self.vectors[start:]
+        signatures.frombytes(data[:min(len(data) // (4 * LSH_TABLES), len(vectors)) * 4 * LSH_TABLES])
+        for vector in vectors[len(signatures) // LSH_TABLES:]:
+            signatures.extend(self._signatures(vector))
+        if len(data) != 4 * len(signatures):
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(start * 4 * LSH_TABLES)
+                f.write(signatures.tobytes())
+                f.truncate()
+        for offset in range(len(vectors)):
+            for table in range(LSH_TABLES):
+                signature = signatures[offset * LSH_TABLES + table]
+                self.buckets[table].setdefault(signature, []).append(start + offset)
+
+    def _signatures(self, vector: array) -> List[int]:
+        terms = nonzero(vector)
+        return [sum(1 << bit for bit, plane in enumerate(planes) if sparse_dot(terms, plane) > 0)
+                for planes in self.planes]
+
+    def _bucket(self, position: int, vector: array) -> List[int]:
+        signatures = self._signatures(vector)
+        for table, signature in enumerate(signatures):
+            self.buckets[table].setdefault(signature, []).append(position)
+        return signatures
+
+    def _save_state(self):
+        if isinstance(self.embedder, HashingEmbedder):
+            self.state["doc_freq"] = dict(self.embedder.doc_freq)
+            self.state["docs"] = self.embedder.docs
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path("state.json"), "w") as f:
+            json.dump(self.state, f)
+
+    def add(self, texts: List[str], source: str, ref: str):
+        """Embed and append snippets. Callers hold self.lock and the file lock, and have synced."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path("meta.jsonl"), "ab") as meta, open(self._path("vectors.f32"), "ab") as vectors, \
+                open(self._path("signatures.u32"), "ab") as signatures:
+            for text in texts:
+                vector = self.embedder.embed_document(text)
+                snippet = {"source": source, "ref": ref, "text": text,
+                           "added": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                signatures.write(array("I", self._bucket(len(self.vectors), vector)).tobytes())
+                vectors.write(vector.tobytes())
+                line = (json.dumps(snippet) + "\n").encode("utf-8")
+                meta.write(line)
+                self.meta_offset += len(line)
+                self.snippets.append(snippet)
+                self.vectors.append(vector)
+
+    def _new_text(self, path: str, whole_lines: bool = False) -> str:
+        """Text appended to a file since it was last indexed."""
+        offset = self.state["offsets"].get(path, 0)
+        size = os.path.getsize(path)
+        if size < offset:
+            # The file was rewritten rather than appended to
+            offset = 0
+        if size == offset:
+            return ""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        if whole_lines:
+            # Leave a line that is still being written for the next refresh
+            data = data[:data.rfind(b"\n") + 1]
+        self.state["offsets"][path] = offset + len(data)
+        return data.decode("utf-8", "replace")
+
+    def refresh(self):
+        """Index chat logs, checkpointed turns, strategy revisions and scratchpad notes added since last time."""
+        with self.lock:
+            self._load()
+            with self._file_lock():
+                self._sync()
+                for path in sorted(glob.glob(os.path.join(CHAT_LOGS_DIR, "log_*.txt"))):
+                    if text := self._new_text(path):
+                        self.add(chunk_text(text), "chat_log", os.path.basename(path))
+                for path in sorted(glob.glob(os.path.join(CHECKPOINT_DIR, "*.jsonl"))):
+                    for line in self._new_text(path, whole_lines=True).splitlines():
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if record.get("type") == "turn" and record["message"].get("content"):
+                            message = record["message"]
+                            self.add(chunk_text(f"{message.get('name')}: {message['content']}"),
+                                     "discussion", os.path.basename(path)[:-len(".jsonl")])
+                if os.path.exists(STRATEGY_FILE) and (text := self._new_text(STRATEGY_FILE)):
+                    self.add(chunk_text(text), "strategy", STRATEGY_FILE)
+                from scratchpad import scratchpad_store
+                indexed = self.state.setdefault("scratchpad", [])
+                for entry in scratchpad_store.all_entries():
+                    if entry["hash"] not in indexed:
+                        self.add(chunk_text(scratchpad_store.read(entry["hash"])), "scratchpad", entry["hash"])
+                        indexed.append(entry["hash"])
+                self._save_state()
+
+    def _candidates(self, vector: array) -> set:
+        """Snippets in the query's bucket, or a bucket one bit away, in any table."""
+        candidates = set()
+        for table, signature in enumerate(self._signatures(vector)):
+            buckets = self.buckets[table]
+            candidates.update(buckets.get(signature, ()))
+            for bit in range(LSH_BITS):
+                candidates.update(buckets.get(signature ^ (1 << bit), ()))
+        return candidates
+
+    def _rank(self, vector: array, candidates, k: int) -> List[Tuple[float, int]]:
+        terms = nonzero(vector)
+        return sorted(((sparse_dot(terms, self.vectors[i]), i) for i in candidates), reverse=True)[:k]
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[Tuple[float, Dict]]:
+        """Approximate nearest neighbours: LSH candidates, reranked by exact cosine."""
+        with self.lock:
+            self._load()
+            if not self.vectors:
+                return []
+            vector = self.embedder.embed_query(query)
+            candidates = range(len(self.vectors))
+            if len(self.vectors) > EXACT_SCAN_SNIPPETS:
+                probed = self._candidates(vector)
+                # Too few collisions (unusual query): scan everything
+                if len(probed) >= k:
+                    candidates = probed
+            return [(score, self.snippets[i]) for score, i in self._rank(vector, candidates, k) if score >= MIN_SCORE]
+
+    def check_recall(self, queries: int = 100, k: int = RETRIEVAL_TOP_K, seed: int = 0) -> Dict:
+        """Compare LSH search with an exact scan, for queries made of words from stored snippets.
+
+        recall is the share of the exact top k that LSH also returns.
+        """
+        with self.lock:
+            self._load()
+            if not self.vectors:
+                return {"snippets": 0}
+            rng = random.Random(seed)
+            found = wanted = candidates = 0
+            lsh_time = exact_time = 0.0
+            for _ in range(queries):
+                words = rng.choice(self.snippets)["text"].split()
+                start = rng.randrange(max(len(words) - 8, 1))
+                vector = self.embedder.embed_query(" ".join(words[start:start + 8]))
+                started = time.perf_counter()
+                exact = {i for score, i in self._rank(vector, range(len(self.vectors)), k) if score >= MIN_SCORE}
+                exact_time += time.perf_counter() - started
+                started = time.perf_counter()
+                probed = self._candidates(vector)
+                approximate = {i for _, i in self._rank(vector, probed, k)}
+                lsh_time += time.perf_counter() - started
+                found += len(exact & approximate)
+                wanted += len(exact)
+                candidates += len(probed)
+            return {
+                "snippets": len(self.vectors),
+                # What search() uses at this size
+                "search": "exact" if len(self.vectors) <= EXACT_SCAN_SNIPPETS else "lsh",
+                "queries": queries,
+                "k": k,
+                "recall": round(found / wanted, 3) if wanted else None,
+                "candidates_per_query": round(candidates / queries),
+                "lsh_ms_per_query": round(lsh_time / queries * 1000, 2),
+                "exact_ms_per_query": round(exact_time / queries * 1000, 2)
+            }
+
+def build_context(query: str, k: int = RETRIEVAL_TOP_K, max_chars: int = RETRIEVAL_CONTEXT_CHARS,
+                  index: Optional[VectorIndex] = None) -> str:
+    """Relevant snippets from past discussions, formatted for a prompt ("" if none)."""
+    index = index or vector_index
+    try:
+        index.refresh()
+        results = index.search(query, k)
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+        return ""
+    lines, used = [], 0
+    for _, snippet in results:
+        line = f"- [{snippet['source']} {snippet['ref']}] {' '.join(snippet['text'].split())}"
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line)
+    if not lines:
+        return ""
+    return "Relevant notes from earlier discussions:\n" + "\n".join(lines) + "\n\n"
+
+vector_index = VectorIndex()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain or check the retrieval index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("refresh", help="Index material added since the last refresh")
+    recall_parser = subcommands.add_parser("check-recall", help="Measure LSH recall against an exact scan")
+    recall_parser.add_argument("--queries", type=int, default=100)
+    recall_parser.add_argument("--k", type=int, default=RETRIEVAL_TOP_K)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    vector_index.refresh()
+    if args.command == "check-recall":
+        print(json.dumps(vector_index.check_recall(args.queries, args.k), indent=2))
+    else:
+        print(json.dumps({"snippets": len(vector_index.vectors)}, indent=2))
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import (GOALS_FILE, STRATEGY_FILE, LOOP_INTERVAL, LOOP_MIN_INTERVAL, LOOP_MAX_INTERVAL,
+                    LOOP_IDLE_FACTOR, LOOP_ERROR_BACKOFF, LOOP_GOAL_POLL_INTERVAL, LOOP_STATUS_DIR,
+                    LOOP_STATUS_MAX_AGE)
+
+def file_fingerprint(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def process_start_time(pid: int) -> Optional[int]:
+    """When a process started, in clock ticks since boot (None without /proc)."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # The command name may contain spaces; starttime is the 20th field after it
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+class LoopScheduler:
+    """Decides when run_chat_loop starts its next session, and says why.
+
+    A session that changes the strategy keeps the interval at LOOP_INTERVAL.
+    Each one in a row that leaves it unchanged multiplies the interval by
+    LOOP_IDLE_FACTOR, up to LOOP_MAX_INTERVAL, since running again on the
+    same goal is unlikely to help. A failed session backs off exponentially
+    from LOOP_ERROR_BACKOFF instead of retrying at the full rate. Editing
+    the goals resets the interval and ends the wait within LOOP_MIN_INTERVAL.
+    The schedule is written to LOOP_STATUS_DIR/<pid>.json after every
+    decision, for /loop_status, and removed by close() when the loop exits.
+    """
+
+    def __init__(self, status_dir: str = LOOP_STATUS_DIR):
+        self.path = os.path.join(status_dir, f"{os.getpid()}.json")
+        self.process_start = process_start_time(os.getpid())
+        self.interval = LOOP_INTERVAL
+        self.errors = 0
+        self.unchanged = 0
+        self.sessions = 0
+        self.goal = file_fingerprint(GOALS_FILE)
+        self.strategy = None
+        self.next_run = time.time()
+        self.reason = "starting"
+        self.history = deque(maxlen=20)
+
+    def begin(self):
+        """Note the goals and strategy a session starts from."""
+        self.goal = file_fingerprint(GOALS_FILE)
+        self.strategy = file_fingerprint(STRATEGY_FILE)
+
+    def _schedule(self, delay: float, outcome: str, reason: str):
+        now = time.time()
+        self.next_run = now + delay
+        self.reason = reason
+        self.history.append({"time": _format_time(now), "outcome": outcome, "delay": round(delay, 1),
+                             "reason": reason})
+        self._write()
+        print(f"Next session in {delay:.0f}s: {reason}")
+
+    def succeeded(self):
+        self.sessions += 1
+        self.errors = 0
+        if file_fingerprint(STRATEGY_FILE) != self.strategy:
+            self.unchanged = 0
+            self.interval = LOOP_INTERVAL
+            self._schedule(self.interval, "changed", "the strategy changed")
+        else:
+            self.unchanged += 1
+            self.interval = min(self.interval * LOOP_IDLE_FACTOR, LOOP_MAX_INTERVAL)
+            self._schedule(self.interval, "unchanged",
+                           f"the strategy was left unchanged by {self.unchanged} session(s) in a row")
+
+    def failed(self, error: Exception):
+        self.sessions += 1
+        self.errors += 1
+        delay = min(LOOP_ERROR_BACKOFF * 2 ** (self.errors - 1), LOOP_MAX_INTERVAL)
+        # Jitter, so replicas failing on the same outage do not retry in step
+        delay *= random.uniform(0.8, 1.2)
+        self._schedule(delay, "error", f"{self.errors} session(s) in a row failed, last with: {error}")
+
+    def defer(self, delay: float, reason: str):
+        """Put off the next session without counting it as a success or failure."""
+        self._schedule(delay, "deferred", reason)
+
+    def wait(self):
+        """Sleep until the next session is due; a change to the goals brings it forward."""
+        while True:
+            remaining = self.next_run - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, LOOP_GOAL_POLL_INTERVAL))
+            goal = file_fingerprint(GOALS_FILE)
+            if goal == self.goal:
+                continue
+            self.goal = goal
+            self.unchanged = 0
+            self.interval = LOOP_INTERVAL
+            # New goals do not fix whatever is making sessions fail
+            if not self.errors:
+                self._schedule(min(self.next_run - time.time(), LOOP_MIN_INTERVAL), "goals_changed",
+                               "the goals changed")
+
+    def status(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "process_start": self.process_start,
+            "updated": _format_time(time.time()),
+            "sessions": self.sessions,
+            "interval": round(self.interval, 1),
+            "next_run": _format_time(self.next_run),
+            "reason": self.reason,
+            "consecutive_errors": self.errors,
+            "unchanged_sessions": self.unchanged,
+            "history": list(self.history)
+        }
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        """Remove the status file, as the loop is exiting."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def loop_statuses(status_dir: str = LOOP_STATUS_DIR) -> List[Dict]:
+    """The schedules written by loop processes, marking those whose process has exited.
+
+    A PID that now belongs to a process started at another time counts as
+    exited; files not updated for LOOP_STATUS_MAX_AGE seconds are skipped.
+    """
+    statuses = []
+    cutoff = time.time() - LOOP_STATUS_MAX_AGE
+    if not os.path.isdir(status_dir):
+        return statuses
+    for name in sorted(os.listdir(status_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(status_dir, name), "r") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            continue
+        try:
+            if datetime.strptime(status["updated"], "%Y-%m-%d %H:%M:%S").timestamp() < cutoff:
+                continue
+        except (KeyError, ValueError):
+            continue
+        try:
+            os.kill(status["pid"], 0)
+            started = status.get("process_start")
+            status["alive"] = started is None or process_start_time(status["pid"]) in (None, started)
+        except ProcessLookupError:
+            status["alive"] = False
+        except PermissionError:
+            status["alive"] = True
+        statuses.append(status)
+    return statuses
@@ -0,0 +1,220 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import SCRATCHPAD_DIR, SCRATCHPAD_NEAR_DUPLICATE_BITS, SCRATCHPAD_NEAR_DUPLICATE_JACCARD
+
+# Notes further apart than this are not worth reading back for a shingle comparison
+JACCARD_CANDIDATE_BITS = 20
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def shingles(content: str, size: int = 3) -> List[str]:
+    """Overlapping runs of size words."""
+    words = re.findall(r"\w+", content.lower())
+    return [" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))]
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def simhash(content: str, shingle_size: int = 3) -> int:
+    """64-bit similarity fingerprint: near-identical texts differ in few bits."""
+    weights = [0] * 64
+    for shingle in shingles(content, shingle_size):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def bands(fingerprint: int):
+    """Split a fingerprint into eight 8-bit bands. Two fingerprints at most
+    7 bits apart always share at least one band exactly."""
+    return [(i, fingerprint >> (8 * i) & 0xFF) for i in range(8)]
+
+class ScratchpadStore:
+    """Content-addressed scratchpad.
+
+    Notes are stored once as blobs named by their SHA-256 under blobs/, and
+    index.json keeps one small entry per distinct note. A note whose simhash
+    is within SCRATCHPAD_NEAR_DUPLICATE_BITS (at most 7) of an existing one,
+    or that shares a fingerprint band with one and overlaps it in at least
+    SCRATCHPAD_NEAR_DUPLICATE_JACCARD of their word shingles, is counted
+    against that note instead of being stored again.
+
+    Tool calls save notes from worker processes, so saves, and the migration
+    of legacy notes, hold a file lock; the cached index is reloaded whenever
+    index.json changed on disk.
+    """
+
+    def __init__(self, root: str = SCRATCHPAD_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.lock = threading.Lock()
+        self.entries = None
+        self.by_band = {}
+        self.index_stamp = None
+        self.goal_context = threading.local()
+        self.last_goal = None
+
+    @property
+    def current_goal(self) -> Optional[str]:
+        """The goal being discussed on this thread (batch lanes discuss several at once),
+        else the one set most recently."""
+        return getattr(self.goal_context, "goal", self.last_goal)
+
+    @current_goal.setter
+    def current_goal(self, goal: Optional[str]):
+        self.goal_context.goal = goal
+        self.last_goal = goal
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], f"{digest}.txt")
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.index_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        if self.entries is not None and self._stamp() == self.index_stamp:
+            return
+        self.entries = []
+        self.by_band = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.entries = json.load(f)["entries"]
+        for entry in self.entries:
+            self._index(entry)
+        self.index_stamp = self._stamp()
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _refresh(self):
+        """Load the index for reading, migrating legacy notes first if there are any. Callers hold self.lock."""
+        if self._legacy_notes():
+            with self._file_lock():
+                self._load()
+                self._migrate_legacy_notes()
+        else:
+            self._load()
+
+    def _index(self, entry: Dict):
+        for band in bands(int(entry["simhash"], 16)):
+            self.by_band.setdefault(band, []).append(entry)
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+        self.index_stamp = self._stamp()
+
+    def _legacy_notes(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if name.endswith(".txt") and os.path.isfile(os.path.join(self.root, name)))
+
+    def _migrate_legacy_notes(self):
+        """Fold the old one-file-per-note scratchpad files into the store. Callers hold the file lock."""
+        legacy = self._legacy_notes()
+        for name in legacy:
+            path = os.path.join(self.root, name)
+            with open(path, "r") as f:
+                self._add(f.read(), prefix=name.split("_")[0], goal=None)
+            os.remove(path)
+        if legacy:
+            self._save_index()
+
+    def _find_near_duplicate(self, content: str, fingerprint: int, digest: str) -> Optional[Dict]:
+        # Only notes sharing a band are compared, so never scan the whole index
+        candidates = []
+        for band in bands(fingerprint):
+            for entry in self.by_band.get(band, []):
+                distance = hamming(int(entry["simhash"], 16), fingerprint)
+                if entry["hash"] == digest or distance <= SCRATCHPAD_NEAR_DUPLICATE_BITS:
+                    return entry
+                if distance <= JACCARD_CANDIDATE_BITS:
+                    candidates.append((distance, entry))
+        # Fingerprints of short notes drift apart quickly; compare the text of the closest ones
+        words = set(shingles(content))
+        seen = set()
+        for _, entry in sorted(candidates, key=lambda candidate: candidate[0]):
+            if entry["hash"] not in seen:
+                seen.add(entry["hash"])
+                if jaccard(words, set(shingles(self.read(entry["hash"])))) >= SCRATCHPAD_NEAR_DUPLICATE_JACCARD:
+                    return entry
+        return None
+
+    def _add(self, content: str, prefix: str, goal: Optional[str]) -> str:
+        digest = content_hash(content)
+        fingerprint = simhash(content)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        existing = self._find_near_duplicate(content, fingerprint, digest)
+        if existing is not None:
+            existing["seen"] += 1
+            existing["last_seen"] = now
+            return existing["hash"]
+
+        blob_path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        with open(blob_path, "w") as f:
+            f.write(content)
+        entry = {
+            "hash": digest,
+            "simhash": f"{fingerprint:016x}",
+            "prefix": prefix,
+            "goal": goal,
+            "size": len(content),
+            "created": now,
+            "last_seen": now,
+            "seen": 1
+        }
+        self.entries.append(entry)
+        self._index(entry)
+        return digest
+
+    def save(self, content: str, prefix: str = "explorer", goal: Optional[str] = None) -> str:
+        """Store a note and return the hash of the note it was stored as."""
+        with self.lock, self._file_lock():
+            self._load()
+            self._migrate_legacy_notes()
+            digest = self._add(content, prefix, goal or self.current_goal)
+            self._save_index()
+            return digest
+
+    def read(self, digest: str) -> str:
+        with open(self._blob_path(digest), "r") as f:
+            return f.read()
+
+    def all_entries(self) -> List[Dict]:
+        with self.lock:
+            self._refresh()
+            return list(self.entries)
+
+    def top_ideas(self, goal: Optional[str] = None, n: int = 5) -> List[str]:
+        """The n most often proposed distinct notes for a goal, most recent first on ties."""
+        with self.lock:
+            self._refresh()
+            entries = [e for e in self.entries if goal is None or e["goal"] == goal]
+        entries.sort(key=lambda e: (e["seen"], e["last_seen"]), reverse=True)
+        return [self.read(e["hash"]) for e in entries[:n]]
+
+scratchpad_store = ScratchpadStore()
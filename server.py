@@ -3,6 +3,7 @@ import glob
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 import json
 from datetime import datetime
+import health
 
 class LogHandler(SimpleHTTPRequestHandler):
     def do_GET(self):
@@ -33,9 +34,27 @@ class LogHandler(SimpleHTTPRequestHandler):
                 combined_logs = "No logs found. The agent system may not be running."
             
             self.wfile.write(combined_logs.encode())
+        elif self.path == '/health':
+            self.send_json(200, health.liveness())
+        elif self.path == '/ready':
+            loops = health.loop_health()
+            result = health.readiness({
+                "agent_loops": {"ok": loops["stalled"] == 0, "alive": loops["alive"], "stalled": loops["stalled"]}
+            })
+            self.send_json(200 if result["status"] == "ready" else 503, result)
+        elif self.path == '/status':
+            self.send_json(200, health.system_status())
         else:
             return SimpleHTTPRequestHandler.do_GET(self)
 
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
 def run_server(port=8000):
     server_address = ('', port)
     httpd = HTTPServer(server_address, LogHandler)
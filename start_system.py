@@ -3,63 +3,190 @@ import sys
 import time
 import os
 import signal
-import atexit
-
-def start_agents():
-    print("Starting Agent Village system...")
-    agent_process = subprocess.Popen([sys.executable, "agents.py"], 
-                                    stdout=subprocess.PIPE, 
-                                    stderr=subprocess.PIPE)
-    return agent_process
-
-def start_server():
-    print("Starting monitoring server...")
-    server_process = subprocess.Popen([sys.executable, "server.py"], 
-                                     stdout=subprocess.PIPE, 
-                                     stderr=subprocess.PIPE)
-    return server_process
-
-def cleanup(agent_process, server_process):
-    print("\nShutting down...")
-    if agent_process:
-        agent_process.terminate()
-    if server_process:
-        server_process.terminate()
-    print("All processes terminated.")
+import threading
+import logging
+import urllib.request
+from logging.handlers import RotatingFileHandler
+from config import (
+    AGENT_REPLICAS,
+    JOB_WORKERS,
+    SUPERVISOR_LOG_DIR,
+    SUPERVISOR_LOG_MAX_BYTES,
+    SUPERVISOR_LOG_BACKUPS,
+    SUPERVISOR_CHECK_INTERVAL,
+    SUPERVISOR_HEALTH_GRACE,
+    RESTART_BACKOFF_INITIAL,
+    RESTART_BACKOFF_MAX,
+    RESTART_STABLE_AFTER,
+    SHUTDOWN_TIMEOUT
+)
+
+def create_child_logger(name):
+    """Create a rotating file logger for a child process's output."""
+    os.makedirs(SUPERVISOR_LOG_DIR, exist_ok=True)
+    child_logger = logging.getLogger(f"supervisor.{name}")
+    child_logger.setLevel(logging.INFO)
+    child_logger.propagate = False
+    if not child_logger.handlers:
+        handler = RotatingFileHandler(
+            os.path.join(SUPERVISOR_LOG_DIR, f"{name}.log"),
+            maxBytes=SUPERVISOR_LOG_MAX_BYTES,
+            backupCount=SUPERVISOR_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        child_logger.addHandler(handler)
+    return child_logger
+
+class SupervisedProcess:
+    """A child process that is kept alive and whose output is always drained."""
+
+    def __init__(self, name, command, health_url=None):
+        self.name = name
+        self.command = command
+        self.health_url = health_url
+        self.logger = create_child_logger(name)
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.backoff = RESTART_BACKOFF_INITIAL
+        self.next_start = 0
+        self.drain_threads = []
+
+    def start(self):
+        print(f"Starting {self.name}...")
+        self.process = subprocess.Popen(self.command,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        text=True,
+                                        bufsize=1,
+                                        env={**os.environ, "PYTHONUNBUFFERED": "1"})
+        self.started_at = time.time()
+        # Read both pipes continuously so the child never blocks on a full buffer
+        self.drain_threads = [
+            threading.Thread(target=self._drain, args=(self.process.stdout, "stdout"), daemon=True),
+            threading.Thread(target=self._drain, args=(self.process.stderr, "stderr"), daemon=True)
+        ]
+        for thread in self.drain_threads:
+            thread.start()
+        self.logger.info(f"[supervisor] started pid {self.process.pid}")
+
+    def _drain(self, pipe, stream):
+        for line in iter(pipe.readline, ""):
+            self.logger.info(f"[{stream}] {line.rstrip()}")
+        pipe.close()
+
+    def is_alive(self):
+        """Check that the process is running and, if it has a health URL, answering."""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        if self.health_url and time.time() - self.started_at > SUPERVISOR_HEALTH_GRACE:
+            try:
+                with urllib.request.urlopen(self.health_url, timeout=5):
+                    pass
+            except Exception as e:
+                self.logger.info(f"[supervisor] health check failed: {e}")
+                return False
+        return True
+
+    def check(self):
+        """Restart the process with exponential backoff if it is not alive."""
+        if self.is_alive():
+            return
+        now = time.time()
+        if self.process is not None:
+            self.stop()
+            uptime = now - self.started_at
+            self.logger.info(f"[supervisor] exited with code {self.process.returncode} after {uptime:.0f}s")
+            # A process that ran for a while earns a fresh backoff
+            if uptime >= RESTART_STABLE_AFTER:
+                self.backoff = RESTART_BACKOFF_INITIAL
+            self.next_start = now + self.backoff
+            print(f"{self.name} stopped; restarting in {self.backoff}s")
+            self.backoff = min(self.backoff * 2, RESTART_BACKOFF_MAX)
+            self.process = None
+        if now >= self.next_start:
+            self.restarts += 1
+            self.start()
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Terminate the process, killing it if it does not exit in time."""
+        if self.process is None:
+            return
+        self.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.logger.info("[supervisor] did not exit in time, killing")
+            self.process.kill()
+            self.process.wait()
+        for thread in self.drain_threads:
+            thread.join(timeout=1)
+
+class Supervisor:
+    """Runs the agent loop replicas, the job workers and the monitoring server."""
+
+    def __init__(self, agent_replicas=AGENT_REPLICAS, job_workers=JOB_WORKERS):
+        self.children = [
+            SupervisedProcess(f"agents-{i}", [sys.executable, "agents.py"])
+            for i in range(agent_replicas)
+        ]
+        self.children.extend(
+            SupervisedProcess(f"worker-{i}", [sys.executable, "agents.py", "--worker"])
+            for i in range(job_workers)
+        )
+        self.children.append(
+            SupervisedProcess("server", [sys.executable, "server.py"], health_url="http://localhost:8000/health")
+        )
+        self.stopping = threading.Event()
+        self.shut_down = False
+
+    def run(self):
+        for child in self.children:
+            child.start()
+        while not self.stopping.wait(SUPERVISOR_CHECK_INTERVAL):
+            for child in self.children:
+                child.check()
+
+    def shutdown(self):
+        """Stop all children together: signal every one first, then wait."""
+        if self.shut_down:
+            return
+        self.shut_down = True
+        self.stopping.set()
+        print("\nShutting down...")
+        for child in self.children:
+            child.terminate()
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        for child in self.children:
+            child.stop(timeout=max(0, deadline - time.time()))
+        print("All processes terminated.")
 
 def main():
-    # Start the agent system
-    agent_process = start_agents()
-    
-    # Give the agent system a moment to start
-    time.sleep(2)
-    
-    # Start the monitoring server
-    server_process = start_server()
-    
-    # Register cleanup function
-    atexit.register(cleanup, agent_process, server_process)
-    
-    # Handle Ctrl+C gracefully
+    supervisor = Supervisor()
+
+    # Handle Ctrl+C and SIGTERM gracefully
     def signal_handler(sig, frame):
-        print("\nReceived Ctrl+C. Shutting down...")
-        cleanup(agent_process, server_process)
-        sys.exit(0)
-    
+        supervisor.stopping.set()
+
     signal.signal(signal.SIGINT, signal_handler)
-    
+    signal.signal(signal.SIGTERM, signal_handler)
+
     print("\n" + "="*50)
     print("Agent Village system is running!")
+    print(f"Agent loop replicas: {AGENT_REPLICAS}, job workers: {JOB_WORKERS}")
+    print(f"Child output is written to {SUPERVISOR_LOG_DIR}/")
     print("Open your browser and go to: http://localhost:8000")
     print("Press Ctrl+C to stop the system")
     print("="*50 + "\n")
-    
-    # Keep the script running
+
     try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        pass
+        supervisor.run()
+    finally:
+        supervisor.shutdown()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,312 @@
+import hashlib
+import importlib
+import inspect
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import (TOOL_POOL_SIZE, TOOL_MAX_CONCURRENCY, TOOL_QUEUE_TIMEOUT, TOOL_TIMEOUT,
+                    TOOL_MEMORY_LIMIT, TOOL_WORKER_MAX_CALLS, TOOL_WORK_DIR)
+
+logger = logging.getLogger(__name__)
+
+class ToolError(Exception):
+    """A tool call that could not be completed: it failed, timed out or the pool was busy."""
+
+class ToolSpec:
+    """A registered tool: where the worker finds it and what the model sees.
+
+    Every parameter and the return value must be annotated; the annotations
+    (with typing.Annotated descriptions) become the schema offered to the
+    model. Parameters in bind are filled in by the calling process at call
+    time and hidden from the model.
+    """
+
+    def __init__(self, func: Callable, name: str, description: str, bind: Dict[str, Callable[[], Any]]):
+        self.name = name
+        self.description = description
+        self.target = f"{func.__module__}:{func.__qualname__}"
+        self.bind = bind
+        signature = inspect.signature(func)
+        for param in signature.parameters.values():
+            if param.annotation is inspect.Parameter.empty:
+                raise TypeError(f"Tool {name}: parameter {param.name} needs a type annotation")
+        if signature.return_annotation is inspect.Signature.empty:
+            raise TypeError(f"Tool {name} needs a return type annotation")
+        for param in bind:
+            if param not in signature.parameters:
+                raise TypeError(f"Tool {name} binds unknown parameter {param}")
+        self.signature = signature
+        self.visible_signature = signature.replace(
+            parameters=[p for p in signature.parameters.values() if p.name not in bind])
+
+    def proxy(self, pool: "ToolPool") -> Callable:
+        """A stand-in with the tool's visible signature that runs the call in the pool."""
+        def call(**kwargs):
+            for param, value in self.bind.items():
+                kwargs[param] = value()
+            # Reject bad arguments here rather than in a worker
+            self.signature.bind(**kwargs)
+            return pool.call_tool(self.name, kwargs)
+
+        call.__name__ = call.__qualname__ = self.name
+        call.__doc__ = self.description
+        call.__signature__ = self.visible_signature
+        call.__annotations__ = {p.name: p.annotation for p in self.visible_signature.parameters.values()}
+        call.__annotations__["return"] = self.signature.return_annotation
+        return call
+
+_registry: Dict[str, ToolSpec] = {}
+
+def tool(name: Optional[str] = None, description: Optional[str] = None,
+         bind: Optional[Dict[str, Callable[[], Any]]] = None):
+    """Register a function as a tool agents can call. The function itself is returned unchanged."""
+    def register(func: Callable) -> Callable:
+        spec = ToolSpec(func, name or func.__name__, description or (func.__doc__ or "").strip(), bind or {})
+        _registry[spec.name] = spec
+        return func
+    return register
+
+def registered_tools() -> Dict[str, ToolSpec]:
+    """All tools, keyed by name."""
+    import tools  # noqa: F401  (registers the built-in tools)
+    return dict(_registry)
+
+def register_tool(name: str, caller, executor, pool: Optional["ToolPool"] = None):
+    """Offer a registered tool to caller's model and run its calls from executor through the pool."""
+    from autogen import register_function
+    spec = registered_tools()[name]
+    register_function(spec.proxy(pool or tool_pool), caller=caller, executor=executor,
+                      name=spec.name, description=spec.description)
+
+# --- worker side ---
+
+def _limit_resources(memory_limit: int):
+    import resource
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def _call_tool(target: str, kwargs: Dict) -> Any:
+    module, qualname = target.split(":")
+    func = importlib.import_module(module)
+    for part in qualname.split("."):
+        func = getattr(func, part)
+    return func(**kwargs)
+
+def _run_code(language: str, code: str, work_dir: str, timeout: float) -> Tuple[int, str]:
+    """Run one code block as a child of the worker, in its own process group."""
+    language = language.lower()
+    if language in ("python", "py", "python3"):
+        command, suffix = [sys.executable], ".py"
+    elif language in ("bash", "sh", "shell"):
+        command, suffix = ["bash"], ".sh"
+    else:
+        return 1, f"Unsupported language: {language}"
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, f"tmp_code_{hashlib.md5(code.encode()).hexdigest()}{suffix}")
+    with open(path, "w") as f:
+        f.write(code)
+    process = subprocess.Popen(command + [os.path.abspath(path)], cwd=work_dir, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True, start_new_session=True)
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+        return 124, output + f"\nTimed out after {timeout} seconds"
+    return process.returncode, output
+
+def serve(requests_fd: int, responses_fd: int, memory_limit: int, preload: List[str]):
+    """Worker loop: answer ("tool" | "code", payload) requests until the parent goes away."""
+    _limit_resources(memory_limit)
+    requests = Connection(requests_fd, writable=False)
+    responses = Connection(responses_fd, readable=False)
+    for module in preload:
+        importlib.import_module(module)
+    while True:
+        try:
+            kind, payload = requests.recv()
+        except EOFError:
+            break
+        try:
+            result = _call_tool(*payload) if kind == "tool" else _run_code(*payload)
+            responses.send(("ok", result))
+        except MemoryError:
+            responses.send(("error", "MemoryError: the tool exceeded its memory limit"))
+        except Exception as e:
+            responses.send(("error", f"{type(e).__name__}: {e}"))
+
+# --- parent side ---
+
+class _Worker:
+    def __init__(self, memory_limit: int, preload: List[str]):
+        requests_r, requests_w = os.pipe()
+        responses_r, responses_w = os.pipe()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "tool_pool", str(requests_r), str(responses_w), str(memory_limit), *preload],
+            pass_fds=(requests_r, responses_w)
+        )
+        os.close(requests_r)
+        os.close(responses_w)
+        self.requests = Connection(requests_w, readable=False)
+        self.responses = Connection(responses_r, writable=False)
+        self.calls = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+        self.requests.close()
+        self.responses.close()
+
+class ToolPool:
+    """A warm pool of worker processes that run tool calls and generated code.
+
+    Workers start with an address-space limit (TOOL_MEMORY_LIMIT), so a
+    runaway call kills its worker rather than the server. At most
+    max_concurrency calls run at once; beyond the warm workers, extra ones
+    are started on demand and retired afterwards. A call that exceeds its
+    timeout has its worker killed and replaced, and every worker is
+    replaced after TOOL_WORKER_MAX_CALLS calls.
+    """
+
+    def __init__(self, size: int = TOOL_POOL_SIZE, max_concurrency: int = TOOL_MAX_CONCURRENCY,
+                 memory_limit: int = TOOL_MEMORY_LIMIT, timeout: float = TOOL_TIMEOUT):
+        self.size = size
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self.lock = threading.Lock()
+        self.idle: List[_Worker] = []
+        self.closed = False
+
+    def _spawn(self) -> _Worker:
+        preload = sorted({spec.target.split(":")[0] for spec in registered_tools().values()})
+        return _Worker(self.memory_limit, preload)
+
+    def start(self):
+        """Start the warm workers now instead of on the first call."""
+        with self.lock:
+            while len(self.idle) < self.size:
+                self.idle.append(self._spawn())
+
+    def _checkout(self) -> _Worker:
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker.alive():
+                    return worker
+                worker.kill()
+        return self._spawn()
+
+    def _checkin(self, worker: _Worker):
+        with self.lock:
+            if not self.closed and worker.alive() and worker.calls < TOOL_WORKER_MAX_CALLS and len(self.idle) < self.size:
+                self.idle.append(worker)
+                return
+        worker.kill()
+        self._replenish()
+
+    def _replenish(self):
+        """Bring the pool back to size in the background so callers never wait on a cold start."""
+        def fill():
+            with self.lock:
+                missing = 0 if self.closed else self.size - len(self.idle)
+            for _ in range(missing):
+                worker = self._spawn()
+                with self.lock:
+                    if self.closed or len(self.idle) >= self.size:
+                        worker.kill()
+                        return
+                    self.idle.append(worker)
+        threading.Thread(target=fill, name="tool-pool-fill", daemon=True).start()
+
+    def _submit(self, kind: str, payload: Tuple, timeout: float) -> Any:
+        if not self.slots.acquire(timeout=TOOL_QUEUE_TIMEOUT):
+            raise ToolError(f"Tool pool busy: no slot free within {TOOL_QUEUE_TIMEOUT} seconds")
+        try:
+            worker = self._checkout()
+            worker.calls += 1
+            try:
+                worker.requests.send((kind, payload))
+                if not worker.responses.poll(timeout):
+                    worker.kill()
+                    self._replenish()
+                    raise ToolError(f"Timed out after {timeout} seconds")
+                status, result = worker.responses.recv()
+            except (EOFError, OSError):
+                worker.kill()
+                self._replenish()
+                raise ToolError("Tool worker died (memory limit exceeded?)")
+            self._checkin(worker)
+        finally:
+            self.slots.release()
+        if status == "error":
+            raise ToolError(result)
+        return result
+
+    def call_tool(self, name: str, kwargs: Dict, timeout: Optional[float] = None) -> Any:
+        spec = registered_tools()[name]
+        return self._submit("tool", (spec.target, kwargs), timeout or self.timeout)
+
+    def run_code(self, language: str, code: str, work_dir: str = TOOL_WORK_DIR,
+                 timeout: Optional[float] = None) -> Tuple[int, str]:
+        timeout = timeout or self.timeout
+        # The worker enforces the timeout on the code itself; allow it a moment to report back
+        return self._submit("code", (language, code, work_dir, timeout), timeout + 5)
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.kill()
+
+class PooledCodeExecutor:
+    """autogen code executor that runs generated code blocks in the tool pool.
+
+    Blocks run one after another in work_dir and stop at the first failure,
+    like autogen's local command-line executor, but in a limited worker
+    process instead of the agent's own.
+    """
+
+    def __init__(self, pool: Optional[ToolPool] = None, work_dir: str = TOOL_WORK_DIR,
+                 timeout: Optional[float] = None):
+        from autogen.coding import MarkdownCodeExtractor
+        self.pool = pool or tool_pool
+        self.work_dir = work_dir
+        self.timeout = timeout
+        self._code_extractor = MarkdownCodeExtractor()
+
+    @property
+    def code_extractor(self):
+        return self._code_extractor
+
+    def execute_code_blocks(self, code_blocks):
+        from autogen.coding import CodeResult
+        outputs = []
+        exit_code = 0
+        for block in code_blocks:
+            try:
+                exit_code, output = self.pool.run_code(block.language, block.code, self.work_dir, self.timeout)
+            except ToolError as e:
+                exit_code, output = 1, str(e)
+            outputs.append(output)
+            if exit_code != 0:
+                break
+        return CodeResult(exit_code=exit_code, output="\n".join(outputs))
+
+    def restart(self):
+        pass
+
+tool_pool = ToolPool()
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]), sys.argv[4:])
@@ -1,14 +1,22 @@
 import os
+import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Optional
 from config import GOALS_FILE, STRATEGY_FILE, CHAT_LOGS_DIR, SCRATCHPAD_DIR
+from tool_pool import tool
 
 def ensure_directories():
     """Ensure all required directories exist."""
     os.makedirs(CHAT_LOGS_DIR, exist_ok=True)
     os.makedirs(SCRATCHPAD_DIR, exist_ok=True)
 
-def write_strategy(content: str, append: bool = True):
+def new_discussion_id() -> str:
+    """Create a sortable, unique id for a discussion."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+@tool(description="Update the strategy document, appending a dated section unless append is false.")
+def write_strategy(content: Annotated[str, "The strategy text to write"],
+                   append: Annotated[bool, "Append to the document instead of replacing it"] = True) -> str:
     """Write content to strategy file, with option to append or overwrite."""
     mode = "a" if append else "w"
     with open(STRATEGY_FILE, mode) as f:
@@ -17,6 +25,7 @@ def write_strategy(content: str, append: bool = True):
             f.write(f"Update at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("="*50 + "\n\n")
         f.write(content)
+    return "Strategy updated"
 
 def log_chat(content: str):
     """Log chat content to a timestamped file."""
@@ -37,14 +46,18 @@ def load_goal() -> Optional[str]:
     except FileNotFoundError:
         return None
 
-def save_to_scratchpad(content: str, prefix: str = "explorer"):
-    """Save content to scratchpad with timestamp."""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{prefix}_{timestamp}.txt"
-    filepath = os.path.join(SCRATCHPAD_DIR, filename)
-    
-    with open(filepath, "w") as f:
-        f.write(content)
+def _current_goal() -> Optional[str]:
+    from scratchpad import scratchpad_store
+    return scratchpad_store.current_goal
+
+@tool(description="Save an idea to the shared scratchpad; near-duplicates of earlier ideas are counted, not stored again.",
+      bind={"goal": _current_goal})
+def save_to_scratchpad(content: Annotated[str, "The idea to save"],
+                       prefix: Annotated[str, "Short label for the kind of note"] = "explorer",
+                       goal: Optional[str] = None) -> str:
+    """Save content to the content-addressed scratchpad, skipping near-duplicates."""
+    from scratchpad import scratchpad_store
+    return scratchpad_store.save(content, prefix, goal)
 
 def get_latest_strategy() -> Optional[str]:
     """Read the current strategy file."""
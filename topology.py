@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, TYPE_CHECKING
+from config import TOPOLOGY_FILE
+from tool_pool import registered_tools
+
+if TYPE_CHECKING:
+    import autogen
+
+logger = logging.getLogger(__name__)
+
+ROLES = ("assistant", "user_proxy")
+SPEAKER_SELECTION = ("round_robin", "auto", "random", "manual")
+
+def model_llm_config(definition: Dict) -> Dict:
+    """autogen llm_config for a model definition of the topology file."""
+    api_key = os.getenv(definition["api_key_env"])
+    if not api_key:
+        raise ValueError(f"{definition['api_key_env']} environment variable is not set")
+    entry = {"model": definition["model"], "api_key": api_key}
+    for key in ("api_type", "base_url"):
+        if key in definition:
+            entry[key] = definition[key]
+    config = {"config_list": [entry], "timeout": definition.get("timeout", 600), "cache_seed": None}
+    if "temperature" in definition:
+        config["temperature"] = definition["temperature"]
+    return config
+
+class AgentSpec:
+    """One agent of a topology, as declared in the topology file."""
+
+    def __init__(self, spec: Dict, default_model: str):
+        self.name = spec["name"]
+        self.role = spec.get("role", "assistant")
+        self.system_message = spec.get("system_message", "")
+        self.model = spec.get("model", default_model)
+        self.tools = list(spec.get("tools", []))
+        self.human_input_mode = spec.get("human_input_mode", "NEVER")
+        self.code_execution = spec.get("code_execution", False)
+        self.max_consecutive_auto_reply = spec.get("max_consecutive_auto_reply")
+
+class Topology:
+    """A validated topology: which agents talk, on which models, in what order and for how long.
+
+    Compiling checks every reference (models, tools, agent names) up front so
+    a bad edit to the topology file is rejected before any agent is built.
+    """
+
+    def __init__(self, name: str, spec: Dict, models: Dict[str, Dict]):
+        self.name = name
+        # Identifies the definition, so an unchanged topology survives a reload
+        self.fingerprint = json.dumps([spec, models], sort_keys=True)
+        self.description = spec.get("description", "")
+        self.model = spec.get("model")
+        self.models = models
+        self.agents = [AgentSpec(agent, self.model) for agent in spec.get("agents", [])]
+        self.speaker_selection = spec.get("speaker_selection", "auto")
+        self.max_round = int(spec.get("max_round", 10))
+        self.initiator = spec.get("initiator", self.agents[0].name if self.agents else None)
+        self.allowed_transitions = spec.get("allowed_transitions")
+        termination = spec.get("termination", {})
+        self.termination_keywords = list(termination.get("keywords", []))
+        self.max_consecutive_auto_reply = termination.get("max_consecutive_auto_reply")
+        parallel = spec.get("parallel", {})
+        self.parallel_agents = list(parallel.get("agents", []))
+        self.synthesizer = parallel.get("synthesizer")
+        self._validate()
+
+    def _validate(self):
+        names = [agent.name for agent in self.agents]
+        if not names:
+            raise ValueError(f"Topology {self.name} has no agents")
+        if len(set(names)) != len(names):
+            raise ValueError(f"Topology {self.name} has duplicate agent names")
+        if self.speaker_selection not in SPEAKER_SELECTION:
+            raise ValueError(f"Topology {self.name}: unknown speaker_selection {self.speaker_selection}")
+        if self.max_round < 1:
+            raise ValueError(f"Topology {self.name}: max_round must be at least 1")
+        tools = registered_tools()
+        for agent in self.agents:
+            if agent.role not in ROLES:
+                raise ValueError(f"Topology {self.name}: agent {agent.name} has unknown role {agent.role}")
+            if agent.model not in self.models:
+                raise ValueError(f"Topology {self.name}: agent {agent.name} uses unknown model {agent.model}")
+            for tool in agent.tools:
+                if tool not in tools:
+                    raise ValueError(f"Topology {self.name}: agent {agent.name} uses unknown tool {tool}")
+            executor = agent.code_execution.get("executor") if isinstance(agent.code_execution, dict) else None
+            if executor not in (None, "pool"):
+                raise ValueError(f"Topology {self.name}: agent {agent.name} uses unknown code executor {executor}")
+        referenced = [self.initiator, self.synthesizer, *self.parallel_agents]
+        for source, targets in (self.allowed_transitions or {}).items():
+            referenced += [source, *targets]
+        for name in referenced:
+            if name is not None and name not in names:
+                raise ValueError(f"Topology {self.name} refers to unknown agent {name}")
+        if self.parallel_agents and not self.synthesizer:
+            raise ValueError(f"Topology {self.name}: parallel agents need a synthesizer")
+
+    def agent_spec(self, name: str) -> AgentSpec:
+        return next(agent for agent in self.agents if agent.name == name)
+
+    def llm_config(self, model: Optional[str] = None) -> Dict:
+        """autogen llm_config for one of the topology's models (its default model if None)."""
+        return model_llm_config(self.models[model or self.model])
+
+    def is_termination_msg(self, message: Dict) -> bool:
+        content = message.get("content") or ""
+        return isinstance(content, str) and any(keyword in content for keyword in self.termination_keywords)
+
+    def code_execution_config(self, spec: AgentSpec):
+        """autogen code_execution_config for an agent; {"executor": "pool"} runs code in the tool pool."""
+        config = spec.code_execution
+        if isinstance(config, dict) and config.get("executor") == "pool":
+            from tool_pool import PooledCodeExecutor
+            options = {key: config[key] for key in ("work_dir", "timeout") if key in config}
+            return {"executor": PooledCodeExecutor(**options)}
+        return config
+
+    def build_agents(self) -> Dict[str, "autogen.ConversableAgent"]:
+        """Create the agents, instrumented and with bounded history.
+
+        An agent's tools are offered to its model and executed by the agent
+        itself when it is next selected, in the tool pool's worker processes.
+        """
+        from autogen import AssistantAgent, UserProxyAgent
+        from history import add_history_window
+        from llm_calls import instrument_agent
+        from tool_pool import register_tool
+
+        google_models = [agent.model for agent in self.agents if self.models[agent.model].get("api_type") == "google"]
+        if google_models:
+            import google.generativeai as genai
+            genai.configure(api_key=self.llm_config(google_models[0])["config_list"][0]["api_key"])
+
+        agents = {}
+        for spec in self.agents:
+            llm_config = self.llm_config(spec.model)
+            options = {
+                "name": spec.name,
+                "system_message": spec.system_message,
+                "llm_config": llm_config,
+                "human_input_mode": spec.human_input_mode
+            }
+            if self.termination_keywords:
+                options["is_termination_msg"] = self.is_termination_msg
+            max_replies = spec.max_consecutive_auto_reply or self.max_consecutive_auto_reply
+            if max_replies is not None:
+                options["max_consecutive_auto_reply"] = max_replies
+            if spec.role == "user_proxy":
+                agent = UserProxyAgent(code_execution_config=self.code_execution_config(spec), **options)
+            else:
+                agent = AssistantAgent(**options)
+            for tool in spec.tools:
+                register_tool(tool, caller=agent, executor=agent)
+            instrument_agent(agent)
+            add_history_window(agent, llm_config)
+            agents[spec.name] = agent
+        return agents
+
+    def build_groupchat(self, agents: Dict, max_round: Optional[int] = None, cassette=None):
+        """Create the group chat and its manager for these agents.
+
+        A cassette (recorder or replayer) is attached so it can save or
+        impose the speaker order.
+        """
+        from autogen import GroupChat, GroupChatManager
+
+        options = {}
+        if self.allowed_transitions:
+            options["allowed_or_disallowed_speaker_transitions"] = {
+                agents[source]: [agents[target] for target in targets]
+                for source, targets in self.allowed_transitions.items()
+            }
+            options["speaker_transitions_type"] = "allowed"
+        groupchat = GroupChat(
+            agents=list(agents.values()),
+            messages=[],
+            max_round=max_round or self.max_round,
+            speaker_selection_method=self.speaker_selection,
+            **options
+        )
+        if cassette is not None:
+            cassette.attach(groupchat)
+        manager_options = {}
+        if self.termination_keywords:
+            manager_options["is_termination_msg"] = self.is_termination_msg
+        manager = GroupChatManager(groupchat=groupchat, llm_config=self.llm_config(), **manager_options)
+        return groupchat, manager
+
+class TopologyStore:
+    """Topologies from the topology file, recompiled when the file changes.
+
+    get() checks the file's modification time on every call and returns
+    the same object for as long as a topology's definition is unchanged, so
+    callers can cache what they build from it by identity. A file that fails
+    to parse or validate is logged and the last good topologies stay in use.
+    """
+
+    def __init__(self, path: str = TOPOLOGY_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.topologies: Dict[str, Topology] = {}
+        self.models: Dict[str, Dict] = {}
+
+    def _compile(self) -> Dict[str, Topology]:
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        models = data.get("models", {})
+        compiled = {}
+        for name, spec in data["topologies"].items():
+            topology = Topology(name, spec, models)
+            previous = self.topologies.get(name)
+            # Keep the old object when nothing changed so callers need not rebuild agents
+            compiled[name] = previous if previous and previous.fingerprint == topology.fingerprint else topology
+        self.models = models
+        return compiled
+
+    def _refresh(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return
+        try:
+            self.topologies = self._compile()
+            if self.mtime is not None:
+                logger.info(f"Reloaded topologies from {self.path}")
+        except (ValueError, KeyError, TypeError) as e:
+            if not self.topologies:
+                raise ValueError(f"Invalid topology file {self.path}: {e}")
+            logger.error(f"Invalid topology file {self.path}, keeping the previous topologies: {e}")
+        self.mtime = mtime
+
+    def get(self, name: str) -> Topology:
+        with self.lock:
+            self._refresh()
+            if name not in self.topologies:
+                raise ValueError(f"Unknown topology: {name}")
+            return self.topologies[name]
+
+    def names(self) -> List[str]:
+        with self.lock:
+            self._refresh()
+            return list(self.topologies)
+
+    def llm_config(self, model: str) -> Dict:
+        """autogen llm_config for a model defined in the topology file."""
+        with self.lock:
+            self._refresh()
+            if model not in self.models:
+                raise ValueError(f"Unknown model: {model}")
+            return model_llm_config(self.models[model])
+
+topology_store = TopologyStore()
@@ -67,8 +67,8 @@ def check_env_file():
     with open(env_file, "r") as f:
         content = f.read()
         
-        if "OPENAI_API_KEY" not in content:
-            print("❌ OPENAI_API_KEY not found in .env file.")
+        if "GOOGLE_API_KEY" not in content and "OPENAI_API_KEY" not in content:
+            print("❌ Neither GOOGLE_API_KEY nor OPENAI_API_KEY found in .env file.")
             return False
         
         if "your_openai_api_key_here" in content:
@@ -108,31 +108,29 @@ def check_file_permissions():
         print("✓ File permissions are correct.")
         return True
 
-def check_openai_api():
-    """Test OpenAI API connection."""
+def check_llm_providers():
+    """Test that every LLM provider the topologies use answers and accepts its API key."""
     try:
         from dotenv import load_dotenv
-        import openai
-        
         load_dotenv()
-        api_key = os.getenv("OPENAI_API_KEY")
-        
-        if not api_key:
-            print("❌ OpenAI API key not found in environment.")
-            return False
-        
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "Hello"}],
-            max_tokens=5
-        )
+        from health import provider_health
         
-        print("✓ OpenAI API connection successful.")
-        return True
+        providers = provider_health.check()
     except Exception as e:
-        print(f"❌ OpenAI API connection failed: {e}")
+        print(f"❌ Could not check the LLM providers: {e}")
         return False
+    
+    all_ok = True
+    for provider in providers:
+        models = ", ".join(provider["models"])
+        if provider["ok"] is False:
+            print(f"❌ {provider['provider']} ({models}) is unreachable: {provider['error']}")
+            all_ok = False
+        elif provider["ok"] is None:
+            print(f"  {provider['provider']} ({models}) was not checked: {provider['error']}")
+        else:
+            print(f"✓ {provider['provider']} ({models}) answered in {provider['latency_ms']} ms.")
+    return all_ok
 
 def main():
     """Main troubleshooting function."""
@@ -143,7 +141,7 @@ def main():
         ("Dependencies", check_dependencies),
         ("Environment Configuration", check_env_file),
         ("File Permissions", check_file_permissions),
-        ("OpenAI API Connection", check_openai_api)
+        ("LLM Provider Connections", check_llm_providers)
     ]
     
     all_passed = True
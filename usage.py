@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional
+from config import USAGE_LOG_FILE, BUDGETS, BUDGET_ACTION, DOWNGRADE_MODEL
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+class BudgetExceeded(Exception):
+    """Raised to stop a discussion that has used up its budget."""
+
+def empty_totals() -> Dict[str, float]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+
+def add_to_totals(totals: Dict[str, float], record: dict):
+    totals["calls"] += 1
+    for field in TOKEN_FIELDS:
+        totals[field] += record[field]
+    totals["cost"] += record["cost"]
+
+def usage_snapshot(agent) -> Dict[str, float]:
+    """Sum the agent client's actual usage over all models."""
+    snapshot = empty_totals()
+    summary = agent.client.actual_usage_summary if agent.client is not None else None
+    for model, usage in (summary or {}).items():
+        if isinstance(usage, dict):
+            for field in TOKEN_FIELDS:
+                snapshot[field] += usage.get(field, 0)
+            snapshot["cost"] += usage.get("cost", 0)
+    return snapshot
+
+def agent_model(agent) -> Optional[str]:
+    config = agent.llm_config or {}
+    if "config_list" in config:
+        return config["config_list"][0].get("model")
+    return config.get("model")
+
+class UsageTracker:
+    """Per-call token accounting aggregated per discussion, goal and day.
+
+    Every call is appended to USAGE_LOG_FILE; aggregates are rebuilt from
+    that ledger the first time they are needed.
+    """
+
+    def __init__(self, path: str = USAGE_LOG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.discussions = defaultdict(empty_totals)
+        self.goals = defaultdict(empty_totals)
+        self.days = defaultdict(empty_totals)
+        self.discussion_goals = {}
+        # Agents taking part in a running discussion, mapped to its id
+        self.agent_discussions = {}
+        # Downgraded agents, mapped to the llm_config and client they had before
+        self.downgraded = {}
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    self._aggregate(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+
+    def _aggregate(self, record: dict):
+        add_to_totals(self.days[record["day"]], record)
+        if record.get("discussion"):
+            add_to_totals(self.discussions[record["discussion"]], record)
+            self.discussion_goals[record["discussion"]] = record.get("goal")
+        if record.get("goal"):
+            add_to_totals(self.goals[record["goal"]], record)
+
+    def begin_discussion(self, discussion_id: str, goal: str, agents):
+        """Attribute LLM calls made by these agents to a discussion."""
+        with self.lock:
+            self._load()
+            self.discussion_goals[discussion_id] = goal
+            for agent in agents:
+                self.agent_discussions[agent] = discussion_id
+
+    def end_discussion(self, discussion_id: str):
+        """Stop attributing the discussion's calls and undo its downgrades."""
+        with self.lock:
+            for agent in [a for a, d in self.agent_discussions.items() if d == discussion_id]:
+                del self.agent_discussions[agent]
+                if agent in self.downgraded:
+                    agent.llm_config, agent.client = self.downgraded.pop(agent)
+                    logger.info(f"Restored {agent.name} to {agent_model(agent)}")
+
+    def _exceeded_budget(self, discussion_id: str) -> Optional[str]:
+        """Return the name of the first exceeded budget, if any."""
+        day = self.days.get(datetime.now().strftime("%Y-%m-%d"), empty_totals())
+        discussion = self.discussions.get(discussion_id, empty_totals())
+        goal = self.goals.get(self.discussion_goals.get(discussion_id), empty_totals())
+        checks = [
+            ("discussion_tokens", discussion["total_tokens"]),
+            ("goal_tokens", goal["total_tokens"]),
+            ("daily_tokens", day["total_tokens"]),
+            ("daily_cost", day["cost"])
+        ]
+        for name, used in checks:
+            limit = BUDGETS.get(name)
+            if limit and used >= limit:
+                return name
+        return None
+
+    def _downgrade(self, agent):
+        """Switch the agent to the cheaper fallback model until its discussion ends."""
+        from autogen import OpenAIWrapper
+        from topology import topology_store
+        config = topology_store.llm_config(DOWNGRADE_MODEL)
+        with self.lock:
+            self.downgraded[agent] = (agent.llm_config, agent.client)
+        agent.llm_config = config
+        agent.client = OpenAIWrapper(**config)
+        logger.info(f"Downgraded {agent.name} to {DOWNGRADE_MODEL}")
+
+    def enforce_budget(self, agent, discussion_id: str):
+        with self.lock:
+            exceeded = self._exceeded_budget(discussion_id)
+        if not exceeded:
+            return
+        if BUDGET_ACTION == "downgrade":
+            if agent not in self.downgraded:
+                self._downgrade(agent)
+            return
+        raise BudgetExceeded(f"{exceeded} budget of {BUDGETS[exceeded]} exceeded")
+
+    def record(self, record: dict):
+        with self.lock:
+            self._load()
+            self._aggregate(record)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def account(self, call, proceed):
+        """llm_calls middleware: check budgets, run the call and record its usage."""
+        agent = call.agent
+        discussion_id = self.agent_discussions.get(agent)
+        if discussion_id:
+            self.enforce_budget(agent, discussion_id)
+
+        before = usage_snapshot(agent)
+        start = time.time()
+        try:
+            return proceed()
+        finally:
+            after = usage_snapshot(agent)
+            record = {
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "day": datetime.now().strftime("%Y-%m-%d"),
+                "discussion": discussion_id,
+                "goal": self.discussion_goals.get(discussion_id),
+                "agent": agent.name,
+                "model": agent_model(agent),
+                "latency": round(time.time() - start, 3)
+            }
+            for field in TOKEN_FIELDS + ("cost",):
+                # A replaced client starts from zero, so never count negative usage
+                record[field] = max(after[field] - before[field], 0)
+            self.record(record)
+
+    def summary(self, discussion_id: Optional[str] = None, limit: int = 50) -> dict:
+        """Return usage totals for the API."""
+        with self.lock:
+            self._load()
+            if discussion_id:
+                return {
+                    "discussion": discussion_id,
+                    "goal": self.discussion_goals.get(discussion_id),
+                    "totals": dict(self.discussions.get(discussion_id, empty_totals()))
+                }
+            today = datetime.now().strftime("%Y-%m-%d")
+            recent = list(self.discussions.items())[-limit:]
+            return {
+                "today": dict(self.days.get(today, empty_totals())),
+                "days": {day: dict(t) for day, t in self.days.items()},
+                "goals": {goal: dict(t) for goal, t in self.goals.items()},
+                "discussions": {d: dict(t) for d, t in recent},
+                "budgets": BUDGETS,
+                "budget_action": BUDGET_ACTION
+            }
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,231 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set
+from config import WS_BATCH_DELAY, WS_BATCH_MAX, WS_QUEUE_MAX, WS_RESUME_MAX
+from log_store import log_store
+from message_store import message_store
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 2
+
+# Channels an entry can be subscribed through: "all", "system" (entries
+# from System), "agent:<name>" and "discussion:<id>"
+CHANNEL_PREFIXES = ("agent:", "discussion:")
+
+def entry_channels(sender: Optional[str], discussion: Optional[str]) -> List[str]:
+    channels = ["all"]
+    if sender in (None, "System"):
+        channels.append("system")
+    if sender:
+        channels.append(f"agent:{sender}")
+    if discussion:
+        channels.append(f"discussion:{discussion}")
+    return channels
+
+def parse_channels(value) -> Set[str]:
+    """Validate channels given as a list or a comma-separated string; none means "all"."""
+    if isinstance(value, str):
+        value = value.split(",")
+    channels = {channel.strip() for channel in value or [] if channel and channel.strip()}
+    for channel in channels:
+        if channel not in ("all", "system") and not (
+                channel.startswith(CHANNEL_PREFIXES) and channel.split(":", 1)[1]):
+            raise ValueError(f"Unknown channel: {channel}")
+    return channels or {"all"}
+
+def missed_entries(cursor: int, latest: int, channels: Set[str]) -> Optional[List[Dict]]:
+    """Entries on the channels a client reconnecting from cursor missed, or None
+    if it missed more than WS_RESUME_MAX and should reload through /logs."""
+    if latest - cursor > WS_RESUME_MAX:
+        return None
+    # Recent entries are still in memory; older ones come from the log file
+    missed = message_store.after(cursor)
+    if missed is None:
+        missed = log_store.query(after=cursor, limit=WS_RESUME_MAX)["entries"]
+    return [{"seq": r["seq"], "log": f"{r['ts']} - {r['sender']}: {r['message']}",
+             "sender": r["sender"], "discussion": r["discussion"]}
+            for r in missed
+            if channels & set(entry_channels(r["sender"], r["discussion"]))]
+
+def encode_frames(pending: Deque[Dict], version: int) -> List[str]:
+    """Take queued entries and control frames off pending and encode them as frames.
+
+    v2 batches are capped at WS_BATCH_MAX entries; whatever is left stays queued.
+    """
+    if version < PROTOCOL_VERSION:
+        # v1 has no control frames
+        frames = []
+        while pending:
+            entry = pending.popleft()
+            if "control" not in entry:
+                frames.append(json.dumps({k: entry[k] for k in ("log", "seq") if entry.get(k) is not None}))
+        return frames
+    frames, batch = [], []
+    while pending and len(batch) < WS_BATCH_MAX:
+        entry = pending.popleft()
+        if "control" in entry:
+            if batch:
+                frames.append(json.dumps({"type": "batch", "entries": batch}))
+                batch = []
+            frames.append(json.dumps(entry["control"]))
+        else:
+            batch.append(entry)
+    if batch:
+        frames.append(json.dumps({"type": "batch", "entries": batch}))
+    return frames
+
+def handle_subscription(subscriptions: "Subscriptions", client, data: str):
+    """Apply a subscribe, unsubscribe or set request from a v2 client."""
+    try:
+        request_frame = json.loads(data)
+        action = request_frame.get("type")
+        if action not in ("subscribe", "unsubscribe", "set"):
+            return
+        channels = parse_channels(request_frame.get("channels"))
+    except (ValueError, AttributeError) as e:
+        client.send_control({"type": "error", "message": str(e)})
+        return
+    if action == "unsubscribe":
+        subscriptions.update(client, unsubscribe=channels)
+    else:
+        subscriptions.update(client, subscribe=channels, replace=action == "set")
+    client.send_control({"type": "subscribed", "channels": sorted(client.channels)})
+
+class WSClient:
+    """One /ws connection with its own outbound queue and writer thread.
+
+    Broadcasting only appends to the queue, so a slow or dead socket never
+    blocks the sender. Protocol v1 clients get one {"log": ...} frame per
+    entry. v2 clients get {"type": "batch", "entries": [...]} frames that
+    coalesce everything queued within WS_BATCH_DELAY. A client that falls
+    WS_QUEUE_MAX entries behind is disconnected and can resume from its
+    last sequence number.
+    """
+
+    def __init__(self, ws, version: int = 1, channels: Optional[Set[str]] = None):
+        self.ws = ws
+        self.version = version
+        self.channels = channels or {"all"}
+        self.lock = threading.Lock()
+        self.pending = deque()
+        # Live entries held back while the replay for a resuming client is queued
+        self.held: Optional[List[Dict]] = []
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._write_loop, name="ws-writer", daemon=True)
+        self.thread.start()
+
+    def send_control(self, frame: Dict):
+        """Queue a protocol frame (hello, reset) ahead of any held entries."""
+        with self.lock:
+            self.pending.append({"control": frame})
+        self.wakeup.set()
+
+    def enqueue(self, entry: Dict):
+        with self.lock:
+            if self.held is not None:
+                self.held.append(entry)
+                return
+            if len(self.pending) >= WS_QUEUE_MAX:
+                logger.warning("WebSocket client fell too far behind, disconnecting it")
+                self.pending.clear()
+                self.closed = True
+            else:
+                self.pending.append(entry)
+        self.wakeup.set()
+
+    def release(self, replay: List[Dict]):
+        """Queue the replayed entries, then the live ones that arrived meanwhile."""
+        with self.lock:
+            self.pending.extend(replay)
+            last = max((e["seq"] for e in replay if e.get("seq") is not None), default=-1)
+            for entry in self.held or []:
+                if entry.get("seq") is None or entry["seq"] > last:
+                    self.pending.append(entry)
+            self.held = None
+        self.wakeup.set()
+
+    def _next_frames(self) -> List[str]:
+        with self.lock:
+            frames = encode_frames(self.pending, self.version)
+            if self.pending:
+                self.wakeup.set()
+            return frames
+
+    def _write_loop(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.closed:
+                break
+            if self.version >= PROTOCOL_VERSION:
+                # Let a burst accumulate into one frame
+                time.sleep(WS_BATCH_DELAY)
+            try:
+                for frame in self._next_frames():
+                    self.ws.send(frame)
+            except Exception as e:
+                logger.error(f"Error sending to client: {e}")
+                self.closed = True
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+class Subscriptions:
+    """Connected clients indexed by the channels they watch.
+
+    Fan-out looks up only the channels an entry belongs to, so its cost
+    grows with the number of interested clients rather than all clients.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: Set[WSClient] = set()
+        self.by_channel: Dict[str, Set[WSClient]] = {}
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def _unindex(self, client: WSClient):
+        for channel in client.channels:
+            watchers = self.by_channel.get(channel)
+            if watchers is not None:
+                watchers.discard(client)
+                if not watchers:
+                    del self.by_channel[channel]
+
+    def add(self, client: WSClient):
+        with self.lock:
+            self.clients.add(client)
+            for channel in client.channels:
+                self.by_channel.setdefault(channel, set()).add(client)
+
+    def discard(self, client: WSClient):
+        with self.lock:
+            self.clients.discard(client)
+            self._unindex(client)
+
+    def update(self, client: WSClient, subscribe: Iterable[str] = (), unsubscribe: Iterable[str] = (),
+               replace: bool = False):
+        with self.lock:
+            self._unindex(client)
+            current = set() if replace else client.channels
+            client.channels = (current | set(subscribe)) - set(unsubscribe)
+            for channel in client.channels:
+                self.by_channel.setdefault(channel, set()).add(client)
+
+    def recipients(self, channels: Iterable[str]) -> Set[WSClient]:
+        with self.lock:
+            found = set()
+            for channel in channels:
+                found |= self.by_channel.get(channel, set())
+            return found